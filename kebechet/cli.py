@@ -58,9 +58,24 @@ def cli(ctx=None, verbose=0):
 
 @cli.command('run')
 @click.argument('configuration', metavar='config', envvar='KEBECHET_CONFIGURATION_PATH')
-def cli_run(configuration):
+@click.option('-j', '--jobs', type=int, default=1, show_default=True, envvar='KEBECHET_JOBS',
+              help="Number of repositories processed in parallel.")
+def cli_run(configuration, jobs):
     """Run Kebechet using provided YAML configuration file."""
-    config.run(configuration)
+    config.run(configuration, jobs=jobs)
+
+
+@cli.command('serve')
+@click.argument('configuration', metavar='config', envvar='KEBECHET_CONFIGURATION_PATH')
+@click.option('--host', type=str, default='0.0.0.0', show_default=True, envvar='KEBECHET_HOST',
+              help="Address to listen on for webhooks.")
+@click.option('-p', '--port', type=int, default=8080, show_default=True, envvar='KEBECHET_PORT',
+              help="Port to listen on for webhooks.")
+@click.option('-j', '--jobs', type=int, default=1, show_default=True, envvar='KEBECHET_JOBS',
+              help="Number of repositories processed in parallel.")
+def cli_serve(configuration, host, port, jobs):
+    """Serve GitHub and GitLab webhooks, run managers affected by events."""
+    config.serve(configuration, host=host, port=port, workers=jobs)
 
 
 if __name__ == '__main__':
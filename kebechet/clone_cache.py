@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""A persistent on-disk cache of bare mirrors of repositories Kebechet operates on.
+
+Working copies are created as shared clones of local mirrors so the network is touched only once per
+repository per run (when the mirror is created or refreshed).
+"""
+
+import hashlib
+import logging
+import os
+import re
+import shutil
+import typing
+from contextlib import ExitStack
+from contextlib import contextmanager
+
+import git
+
+from . import utils
+
+_LOGGER = logging.getLogger(__name__)
+
+_CACHE_DIR = os.getenv('KEBECHET_CLONE_CACHE')
+# Size of the cache in MiB, least recently used mirrors are evicted once the size is exceeded.
+_CACHE_SIZE = int(os.getenv('KEBECHET_CLONE_CACHE_SIZE', 2048))
+
+# Mirrors already refreshed by this process, there is no need to fetch them again.
+_REFRESHED = set()
+
+
+def is_enabled() -> bool:
+    """Check whether the clone cache was configured."""
+    return bool(_CACHE_DIR)
+
+
+def _get_mirror_path(repo_url: str) -> str:
+    """Get path to the mirror of the given repository in the cache."""
+    digest = hashlib.sha256(repo_url.encode()).hexdigest()[:16]
+    # Keep a human readable part so it is easy to navigate in the cache.
+    readable = re.sub(r'[^A-Za-z0-9_.-]', '_', repo_url.rsplit(':', maxsplit=1)[-1])
+    return os.path.join(_CACHE_DIR, f'{readable}-{digest}')
+
+
+def _get_directory_size(path: str) -> int:
+    """Get size of the given directory in bytes."""
+    size = 0
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            try:
+                size += os.lstat(os.path.join(root, file_name)).st_size
+            except FileNotFoundError:
+                pass
+
+    return size
+
+
+def _evict(keep: str) -> None:
+    """Evict least recently used mirrors so that the cache fits into the configured size."""
+    mirrors = []
+    for entry in os.listdir(_CACHE_DIR):
+        path = os.path.join(_CACHE_DIR, entry)
+        if entry.endswith('.lock') or not os.path.isdir(path):
+            continue
+        mirrors.append((os.stat(path).st_mtime, path, _get_directory_size(path)))
+
+    total_size = sum(size for _, _, size in mirrors)
+    for _, path, size in sorted(mirrors):
+        if total_size <= _CACHE_SIZE * 1024 * 1024:
+            break
+
+        if path == keep:
+            continue
+
+        # Mirrors being created or refreshed and mirrors used by working copies (of other workers) cannot be evicted.
+        with utils.file_lock(path + '.lock', blocking=False) as acquired, \
+                utils.file_lock(path + '.use.lock', blocking=False) as acquired_use:
+            if not acquired or not acquired_use:
+                continue
+
+            _LOGGER.debug("Evicting mirror %r from clone cache (%d bytes)", path, size)
+            shutil.rmtree(path, ignore_errors=True)
+            total_size -= size
+
+
+@contextmanager
+def mirror(repo_url: str) -> typing.Generator[str, None, None]:
+    """Get an up-to-date mirror of the given repository, keep the mirror protected from eviction while used."""
+    os.makedirs(_CACHE_DIR, exist_ok=True)
+    mirror_path = _get_mirror_path(repo_url)
+
+    with ExitStack() as stack:
+        with utils.file_lock(mirror_path + '.lock'):
+            if not os.path.isdir(mirror_path):
+                _LOGGER.info(f"Creating mirror of {repo_url} in {mirror_path}")
+                git.Repo.clone_from(repo_url, mirror_path, mirror=True)
+            elif mirror_path not in _REFRESHED:
+                _LOGGER.info(f"Refreshing mirror of {repo_url} in {mirror_path}")
+                git.Repo(mirror_path).git.fetch('--prune', 'origin')
+
+            _REFRESHED.add(mirror_path)
+            # Modification time is used for LRU eviction.
+            os.utime(mirror_path)
+            # Mark the mirror as used before it is unlocked so it cannot be evicted in between.
+            stack.enter_context(utils.file_lock(mirror_path + '.use.lock', shared=True))
+
+        try:
+            _evict(keep=mirror_path)
+        except Exception:
+            _LOGGER.exception("Failed to evict mirrors from clone cache")
+
+        yield mirror_path
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Run shell commands asynchronously with timeouts, bounded output capture and resource accounting."""
+
+import asyncio
+import logging
+import os
+import resource
+import signal
+import sys
+import time
+from collections import deque
+
+_LOGGER = logging.getLogger(__name__)
+
+# Timeout in seconds for a single command, the whole process group of the command is killed once exceeded.
+_TIMEOUT = float(os.getenv('KEBECHET_COMMAND_TIMEOUT', 1800))
+# Number of bytes of stdout and stderr (each) kept, only the tail of the output is kept if exceeded.
+_OUTPUT_LIMIT = int(os.getenv('KEBECHET_COMMAND_OUTPUT_LIMIT', 8 * 1024 * 1024))
+# Seconds given to a command to terminate gracefully before it is killed.
+_KILL_GRACE_PERIOD = 10
+# Commands running longer than the given number of seconds are reported on info level.
+_SLOW_COMMAND = 60
+_CHUNK_SIZE = 64 * 1024
+
+_STATS = {
+    'commands': 0,
+    'timeouts': 0,
+    'wall_time': 0.0,
+    'cpu_time': 0.0,
+}
+
+
+class CommandResult:
+    """Result of a command run, holding output captured and resources consumed."""
+
+    __slots__ = ('cmd', 'out', 'err', 'return_code', 'timed_out', 'wall_time', 'cpu_time', 'max_rss')
+
+    def __init__(self, cmd: str, out: str, err: str, return_code: int, timed_out: bool = False,
+                 wall_time: float = 0.0, cpu_time: float = 0.0, max_rss: int = None):
+        """Initialize command result, max_rss (in KiB) is None if it cannot be attributed to the command."""
+        self.cmd = cmd
+        self.out = out
+        self.err = err
+        self.return_code = return_code
+        self.timed_out = timed_out
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.max_rss = max_rss
+
+    def __repr__(self):
+        """Represent the command result."""
+        return f'{self.__class__.__name__}({self.cmd!r}, return_code={self.return_code!r})'
+
+
+def get_stats() -> dict:
+    """Get statistics of commands run by this process."""
+    return dict(_STATS)
+
+
+async def _read_stream(stream: asyncio.StreamReader, limit: int) -> str:
+    """Read the given stream as data arrive, keep at most limit bytes from the end of the stream."""
+    chunks = deque()
+    size = 0
+    dropped = 0
+    while True:
+        chunk = await stream.read(_CHUNK_SIZE)
+        if not chunk:
+            break
+
+        chunks.append(chunk)
+        size += len(chunk)
+        while size - len(chunks[0]) >= limit:
+            dropped += len(chunks[0])
+            size -= len(chunks.popleft())
+
+    data = b''.join(chunks)
+    if size > limit:
+        dropped += size - limit
+        data = data[-limit:]
+
+    result = data.decode(errors='replace')
+    if dropped:
+        result = f"[... {dropped} bytes of output truncated ...]\n" + result
+
+    return result
+
+
+def _signal_process_group(process: asyncio.subprocess.Process, signal_number: int) -> None:
+    """Send the given signal to the command and all the processes it spawned."""
+    try:
+        os.killpg(process.pid, signal_number)
+    except ProcessLookupError:
+        pass
+
+
+async def _stop(process: asyncio.subprocess.Process) -> None:
+    """Terminate the command, kill it if it does not terminate in the grace period."""
+    _signal_process_group(process, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), _KILL_GRACE_PERIOD)
+    except asyncio.TimeoutError:
+        _signal_process_group(process, signal.SIGKILL)
+        await process.wait()
+
+
+async def _run(cmd: str, timeout: float, env: dict, cwd: str, output_limit: int) -> tuple:
+    """Run the command in its own process group, return captured output, return code and timeout flag."""
+    process = await asyncio.create_subprocess_shell(
+        cmd,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=env,
+        cwd=cwd,
+        start_new_session=True,
+    )
+    readers = asyncio.gather(
+        _read_stream(process.stdout, output_limit),
+        _read_stream(process.stderr, output_limit),
+    )
+
+    timed_out = False
+    try:
+        await asyncio.wait_for(process.wait(), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        await _stop(process)
+    except asyncio.CancelledError:
+        await _stop(process)
+        readers.cancel()
+        raise
+
+    out, err = await readers
+    return out, err, process.returncode, timed_out
+
+
+def run_command(cmd: str, timeout: float = None, env: dict = None, cwd: str = None,
+                output_limit: int = None) -> CommandResult:
+    """Run the given shell command, environment variables in env extend the current environment.
+
+    A command exceeding the timeout is killed (including processes it spawned) and reported with a non-zero
+    return code. Interrupting the caller (e.g. using KeyboardInterrupt) kills the command as well.
+    """
+    timeout = timeout if timeout is not None else _TIMEOUT
+    output_limit = output_limit if output_limit is not None else _OUTPUT_LIMIT
+    command_env = dict(os.environ)
+    command_env.update(env or {})
+
+    loop = asyncio.new_event_loop()
+    if sys.version_info < (3, 8):
+        # Child watchers need to be attached to the loop explicitly on older Python versions.
+        asyncio.get_child_watcher().attach_loop(loop)
+
+    usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.monotonic()
+    task = loop.create_task(_run(cmd, timeout, command_env, cwd, output_limit))
+    try:
+        out, err, return_code, timed_out = loop.run_until_complete(task)
+    except BaseException:
+        task.cancel()
+        loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+        raise
+    finally:
+        loop.close()
+
+    wall_time = time.monotonic() - start
+    usage_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_time = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    # The kernel reports peak memory of the largest child waited for, it is attributable only if it grew.
+    max_rss = usage_after.ru_maxrss if usage_after.ru_maxrss > usage_before.ru_maxrss else None
+
+    if timed_out:
+        _STATS['timeouts'] += 1
+        err += f"\nCommand {cmd!r} was killed after exceeding timeout of {timeout} seconds"
+        _LOGGER.warning("Command %r was killed after exceeding timeout of %.0f seconds", cmd, timeout)
+
+    _STATS['commands'] += 1
+    _STATS['wall_time'] += wall_time
+    _STATS['cpu_time'] += cpu_time
+    _LOGGER.log(
+        logging.INFO if wall_time > _SLOW_COMMAND else logging.DEBUG,
+        "Command %r finished with return code %d in %.2fs (CPU time %.2fs, max RSS %s KiB)",
+        cmd, return_code, wall_time, cpu_time, max_rss if max_rss is not None else 'n/a'
+    )
+
+    return CommandResult(cmd, out, err, return_code, timed_out, wall_time, cpu_time, max_rss)
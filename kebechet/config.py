@@ -19,17 +19,55 @@
 
 import logging
 import os
+import time
+import typing
 import yaml
 
 import urllib3
 import requests
 
 from .exception import ConfigurationError
+from . import command
+from . import github_snapshot
+from . import http_cache
+from . import http_pool
+from . import package_cache
+from . import rate_limit
+from . import run_state
+from . import webhook
 from .enums import ServiceType
+from .repository_session import RepositorySession
+from .scheduler import Job
+from .scheduler import Scheduler
 
 _LOGGER = logging.getLogger(__name__)
 
 
+def _get_stats() -> dict:
+    """Get statistics gathered in this process so far."""
+    return {
+        'commands': command.get_stats(),
+        'github_snapshot': github_snapshot.get_stats(),
+        'http': http_pool.get_stats(),
+        'http_cache': http_cache.get_stats(),
+        'package_cache': package_cache.get_stats(),
+        'rate_limit': rate_limit.get_stats(),
+        'run_state': run_state.get_stats(),
+    }
+
+
+def _combine_stats(first: dict, second: dict, sign: int = 1) -> dict:
+    """Add (or subtract if sign is -1) numeric statistics in the second dict to statistics in the first one."""
+    result = dict(first)
+    for key, value in second.items():
+        if isinstance(value, dict):
+            result[key] = _combine_stats(first.get(key, {}), value, sign)
+        elif isinstance(value, (int, float)):
+            result[key] = first.get(key, 0) + sign * value
+
+    return result
+
+
 class _Config:
     """Library-wide configuration."""
 
@@ -117,32 +155,46 @@ class _Config:
         requests.Session.patch = patch
 
     @classmethod
-    def run(cls, configuration_file: str) -> None:
-        """Run Kebechet using provided YAML configuration file."""
-        global config
+    def _run_entry(cls, entry: tuple) -> dict:
+        """Run all managers configured for a single repository, report results of each manager run."""
         from kebechet.managers import REGISTERED_MANAGERS
+        from kebechet.managers.manager import _init_igitt
 
-        config.from_file(configuration_file)
+        managers, slug, service_type, service_url, token, tls_verify = entry
+        result = {'slug': slug, 'error': None, 'managers': [], 'stats': {}}
+        stats_start = _get_stats()
 
-        for managers, slug, service_type, service_url, token, tls_verify in config.iter_entries():
-            cls._tls_verification(service_url, slug, verify=tls_verify)
+        cls._tls_verification(service_url, slug, verify=tls_verify)
+        http_cache.install()
+        rate_limit.install()
 
-            if service_url and not service_url.startswith(('https://', 'http://')):
-                # We need to have this explicitly set for IGitt and also for security reasons.
-                _LOGGER.error(
-                    "You have to specify protocol ('https://' or 'http://') in service URL "
-                    "configuration entry - invalid configuration {service_url!}"
-                )
-                continue
+        if service_url and not service_url.startswith(('https://', 'http://')):
+            # We need to have this explicitly set for IGitt and also for security reasons.
+            _LOGGER.error(
+                "You have to specify protocol ('https://' or 'http://') in service URL "
+                "configuration entry - invalid configuration {service_url!}"
+            )
+            result['error'] = f"Invalid service URL configuration {service_url!r}"
+            return result
 
-            if service_url and service_url.endswith('/'):
-                service_url = service_url[:-1]
+        if service_url and service_url.endswith('/'):
+            service_url = service_url[:-1]
 
-            if token:
-                # Allow token expansion based on env variables.
-                token = token.format(**os.environ)
-                _LOGGER.debug(f"Using token '{token[:3]}{'*'*len(token[3:])}'")
+        if token:
+            # Allow token expansion based on env variables.
+            token = token.format(**os.environ)
+            _LOGGER.debug(f"Using token '{token[:3]}{'*'*len(token[3:])}'")
 
+        try:
+            service_type = ServiceType.by_name(service_type)
+            # IGitt global context is adjusted here, session needs to know service URL used.
+            service_url = _init_igitt(service_type, service_url)
+        except Exception as exc:
+            _LOGGER.exception(f"Failed to initialize service for {slug}")
+            result['error'] = str(exc)
+            return result
+
+        with RepositorySession(slug, service_type, service_url, token) as session:
             for manager in managers:
                 # We do pops on dict, which changes it. Let's create a soft duplicate so if a user uses
                 # YAML references, we do not break.
@@ -156,6 +208,7 @@ class _Config:
                 kebechet_manager = REGISTERED_MANAGERS.get(manager_name)
                 if not kebechet_manager:
                     _LOGGER.error("Unable to find requested manager %r, skipping", manager_name)
+                    result['managers'].append({'name': manager_name, 'error': "Unknown manager"})
                     continue
 
                 _LOGGER.info(f"Running manager %r for %r", manager_name, slug)
@@ -163,15 +216,145 @@ class _Config:
                 if manager:
                     _LOGGER.warning(f"Ignoring option {manager} in manager entry for {slug}")
 
+                head_sha = None
+                config_hash = run_state.get_config_hash(manager_name, manager_configuration)
+                if run_state.is_enabled() and kebechet_manager.state_ttl != 0:
+                    head_sha = session.remote_head
+                    if head_sha and run_state.is_up_to_date(
+                            service_url, slug, manager_name, head_sha, config_hash, kebechet_manager.state_ttl):
+                        _LOGGER.info(
+                            "Skipping manager %r for %r, master %s and configuration did not change since the last run",
+                            manager_name, slug, head_sha[:7]
+                        )
+                        result['managers'].append({'name': manager_name, 'error': None, 'skipped': True})
+                        continue
+
                 try:
-                    instance = kebechet_manager(slug, ServiceType.by_name(service_type), service_url, token)
+                    instance = kebechet_manager(slug, service_type, service_url, token, session=session)
                     instance.run(**manager_configuration)
                 except Exception as exc:
                     _LOGGER.exception(
                         f"An error occurred during run of manager {manager!r} {kebechet_manager} for {slug}, skipping"
                     )
+                    result['managers'].append({'name': manager_name, 'error': str(exc) or exc.__class__.__name__})
+                else:
+                    result['managers'].append({'name': manager_name, 'error': None})
+                    if head_sha:
+                        run_state.record(service_url, slug, manager_name, head_sha, config_hash)
+
+        # Statistics are gathered per process, compute what was done for this repository.
+        result['stats'] = _combine_stats(_get_stats(), stats_start, sign=-1)
+        _LOGGER.info(f"Finished management for {slug!r}")
+        return result
+
+    @staticmethod
+    def _report_summary(results: typing.List[dict]) -> None:
+        """Log an aggregated summary of a run across all the configured repositories."""
+        managers_run = sum(len(result['managers']) for result in results)
+        failures = [
+            (result['slug'], entry['name'], entry['error'])
+            for result in results
+            for entry in result['managers'] if entry['error']
+        ]
+        failures.extend((result['slug'], None, result['error']) for result in results if result['error'])
+
+        stats = {}
+        for result in results:
+            stats = _combine_stats(stats, result.get('stats', {}))
+
+        _LOGGER.info(
+            "Run summary: %d repositories processed, %d manager runs, %d failures",
+            len(results), managers_run, len(failures)
+        )
+        for name, value in sorted(stats.items()):
+            _LOGGER.info("Run statistics for %s: %s", name, value)
+
+        conditional_requests = stats.get('http_cache', {}).get('conditional_requests')
+        if conditional_requests:
+            _LOGGER.info(
+                "HTTP cache hit ratio: %.2f (%d requests not counted against GitHub rate limit)",
+                stats['http_cache']['not_modified'] / conditional_requests,
+                stats['http_cache']['rate_limit_saved']
+            )
+        packages_installed = stats.get('package_cache', {}).get('hits', 0) + \
+            stats.get('package_cache', {}).get('downloads', 0)
+        if packages_installed:
+            _LOGGER.info(
+                "Package cache hit ratio: %.2f (%d packages downloaded)",
+                stats['package_cache']['hits'] / packages_installed,
+                stats['package_cache']['downloads']
+            )
+        if stats.get('commands', {}).get('commands'):
+            _LOGGER.info(
+                "Commands run: %d (%d killed on timeout), wall time %.2fs, CPU time %.2fs",
+                stats['commands']['commands'],
+                stats['commands']['timeouts'],
+                stats['commands']['wall_time'],
+                stats['commands']['cpu_time']
+            )
+        for key, budget in sorted(rate_limit.get_budgets().items()):
+            _LOGGER.info(
+                "Rate limit budget for %s: %d of %d requests remaining, reset in %d seconds",
+                key, budget['remaining'], budget['limit'], max(budget['reset'] - time.time(), 0)
+            )
+        for slug, manager_name, error in failures:
+            _LOGGER.warning("Failure for %r (manager %r): %s", slug, manager_name, error)
+
+    @staticmethod
+    def _get_manager_priority(manager_name: str) -> int:
+        """Get priority of the given manager, unknown managers are run with the default priority."""
+        from kebechet.managers import REGISTERED_MANAGERS
+        from kebechet.managers.manager import ManagerBase
 
-            _LOGGER.info(f"Finished management for {slug!r}")
+        return REGISTERED_MANAGERS.get(manager_name, ManagerBase).priority
+
+    @classmethod
+    def run(cls, configuration_file: str, jobs: int = 1) -> typing.List[dict]:
+        """Run Kebechet using provided YAML configuration file.
+
+        Managers of a repository are run in a single job ordered by manager priority, each job in its own
+        process so global state of IGitt and patched requests methods do not interfere. If jobs is greater than
+        one, jobs are run concurrently. An interrupted run is resumed if the queue of jobs is persisted
+        (see kebechet.scheduler).
+        """
+        global config
+
+        config.from_file(configuration_file)
+        entries = list(config.iter_entries())
+
+        results = {}
+
+        def on_finished(job: Job, result: typing.Optional[dict], error: typing.Optional[str]) -> None:
+            if error:
+                result = {'slug': entries[job.entry_index][1], 'error': error, 'managers': [], 'stats': {}}
+
+            results[job.entry_index] = result
+
+        scheduler = Scheduler(entries, cls._run_entry, cls._get_manager_priority, jobs=jobs, on_finished=on_finished)
+        if not scheduler.resume():
+            for entry_index in range(len(entries)):
+                scheduler.add(entry_index)
+
+        _LOGGER.info("Processing %d repositories using %d parallel jobs", len(entries), jobs)
+        scheduler.run()
+
+        results = [results[entry_index] for entry_index in sorted(results)]
+        cls._report_summary(results)
+        return results
+
+    @classmethod
+    def serve(cls, configuration_file: str, host: str = '0.0.0.0', port: int = 8080, workers: int = 1) -> None:
+        """Serve webhooks, run managers affected by events on repositories stated in the configuration file.
+
+        Each job is run in its own process, at most workers jobs at a time.
+        """
+        global config
+
+        config.from_file(configuration_file)
+        webhook.serve(
+            list(config.iter_entries()), cls._run_entry, cls._get_manager_priority,
+            host=host, port=port, workers=workers
+        )
 
 
 config = _Config()
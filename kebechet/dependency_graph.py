@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Dependency graph of a locked application stack derived from package metadata, without installing packages.
+
+The graph is constructed from packages pinned in Pipfile.lock and requirements stated in their metadata (taken
+from wheels present in the local index or from PyPI). The output mimics output of ``pipenv graph`` and
+``pipenv graph --json``.
+"""
+
+import logging
+import typing
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import Parser
+
+from pkg_resources import Requirement
+
+from . import local_index
+from .exception import DependencyGraphError
+from .lockfile import PipfileLock
+from .pypi import get_requires_dist
+from .pypi import normalize_package_name
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _get_wheel_requires_dist(wheel_path: str) -> typing.Optional[typing.List[str]]:
+    """Get requirements stated in METADATA of the given wheel."""
+    try:
+        with zipfile.ZipFile(wheel_path) as wheel:
+            metadata_path = next(name for name in wheel.namelist() if name.endswith('.dist-info/METADATA'))
+            metadata = Parser().parsestr(wheel.read(metadata_path).decode(errors='replace'), headersonly=True)
+    except (OSError, zipfile.BadZipFile, StopIteration) as exc:
+        _LOGGER.debug("Failed to read metadata from wheel %r: %s", wheel_path, str(exc))
+        return None
+
+    return metadata.get_all('Requires-Dist') or []
+
+
+def _get_requires_dist(package_name: str, version: str) -> typing.Optional[typing.List[str]]:
+    """Get requirements of the given package release, prefer metadata available locally."""
+    wheel_path = local_index.find_wheel(package_name, version)
+    if wheel_path:
+        requires_dist = _get_wheel_requires_dist(wheel_path)
+        if requires_dist is not None:
+            return requires_dist
+
+    return get_requires_dist(package_name, version)
+
+
+def _get_marker_environment(meta: dict) -> dict:
+    """Get environment markers are evaluated in, Python version is taken from the lock file if stated."""
+    # Requirements of extras are not installed unless requested (pipenv graph does not show them either).
+    result = {'extra': ''}
+    requires = meta.get('requires') or {}
+    python_full_version = requires.get('python_full_version')
+    python_version = requires.get('python_version')
+    if python_full_version:
+        result['python_full_version'] = python_full_version
+        result['python_version'] = '.'.join(python_full_version.split('.')[:2])
+    elif python_version:
+        result['python_version'] = python_version
+        result['python_full_version'] = python_version
+
+    return result
+
+
+def _get_dependencies(requires_dist: typing.List[str], locked: typing.Dict[str, tuple],
+                      environment: dict) -> typing.List[dict]:
+    """Get dependencies installed from the lock file, requirements are evaluated as done on installation."""
+    result = []
+    for entry in requires_dist:
+        try:
+            requirement = Requirement.parse(entry)
+            if requirement.marker and not requirement.marker.evaluate(environment):
+                continue
+        except Exception as exc:
+            raise DependencyGraphError(f"Failed to evaluate requirement {entry!r}: {str(exc)}") from exc
+
+        package_name = normalize_package_name(requirement.project_name)
+        if package_name not in locked:
+            continue
+
+        result.append({
+            'key': package_name,
+            'package_name': locked[package_name][0],
+            'installed_version': locked[package_name][1],
+            'required_version': str(requirement.specifier) or None,
+        })
+
+    return sorted(result, key=lambda dependency: dependency['key'])
+
+
+def build_dependency_graph(lock: PipfileLock, concurrency: int = 8) -> typing.List[dict]:
+    """Build dependency graph of packages in the lock file (default and develop), in pipenv graph --json format.
+
+    Raise DependencyGraphError if metadata of any package cannot be obtained.
+    """
+    locked = {}
+    for package in lock.packages.values():
+        if not package.version:
+            raise DependencyGraphError(f"Package {package.name!r} is not installed from a package index")
+        locked[normalize_package_name(package.name)] = (package.name, package.version)
+
+    environment = _get_marker_environment(lock.meta)
+    with ThreadPoolExecutor(max_workers=max(min(concurrency, len(locked)), 1)) as executor:
+        requires_dists = dict(zip(locked, executor.map(lambda item: _get_requires_dist(*item), locked.values())))
+
+    result = []
+    for key in sorted(locked):
+        if requires_dists[key] is None:
+            raise DependencyGraphError(f"Unable to obtain metadata for package {locked[key][0]!r}")
+
+        result.append({
+            'package': {
+                'key': key,
+                'package_name': locked[key][0],
+                'installed_version': locked[key][1],
+            },
+            'dependencies': _get_dependencies(requires_dists[key], locked, environment),
+        })
+
+    return result
+
+
+def _render_node(node: dict, graph: typing.Dict[str, dict], depth: int, chain: set, lines: typing.List[str]) -> None:
+    """Render dependencies of the given node, dependency cycles are cut."""
+    for dependency in node['dependencies']:
+        lines.append(
+            f"{'  ' * depth}- {dependency['package_name']} "
+            f"[required: {dependency['required_version'] or 'Any'}, installed: {dependency['installed_version']}]"
+        )
+        if dependency['key'] not in chain:
+            _render_node(graph[dependency['key']], graph, depth + 1, chain | {dependency['key']}, lines)
+
+
+def render_dependency_graph(graph: typing.List[dict]) -> str:
+    """Render dependency graph as a text tree in the same form as pipenv graph does."""
+    indexed = {node['package']['key']: node for node in graph}
+    required = {dependency['key'] for node in graph for dependency in node['dependencies']}
+
+    lines = []
+    for node in graph:
+        if node['package']['key'] in required:
+            continue
+
+        lines.append(f"{node['package']['package_name']}=={node['package']['installed_version']}")
+        _render_node(node, indexed, 1, {node['package']['key']}, lines)
+
+    return '\n'.join(lines) + '\n'
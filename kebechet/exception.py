@@ -17,7 +17,7 @@
 
 """Exceptions and errors that can be found in Kebechet."""
 
-from delegator import Command
+from .command import CommandResult
 
 
 class KebechetException(Exception):
@@ -31,7 +31,7 @@ class ConfigurationError(KebechetException):
 class PipenvError(KebechetException):
     """Raised on missing/invalid Pipenv or Pipenv.lock file."""
 
-    def __init__(self, command: Command, *args, **kwargs):
+    def __init__(self, command: CommandResult, *args, **kwargs):
         """Asssign values for exception so that they can be used in issue reports automatically."""
         self.command = command.cmd
         self.stdout = command.out
@@ -54,3 +54,11 @@ class DependencyManagementError(KebechetException):
 
     This errors are usually wrong or missing Pipfile, Pipfile.lock, requirments.in or requirments.txt.
     """
+
+
+class DependencyGraphError(KebechetException):
+    """Raised if a dependency graph cannot be constructed from package metadata."""
+
+
+class SnapshotError(KebechetException):
+    """Raised if a snapshot of a repository state cannot be obtained from GitHub GraphQL API."""
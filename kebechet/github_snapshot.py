@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""A snapshot of open issues, open pull requests and Kebechet branches of a GitHub repository.
+
+The snapshot is obtained using GitHub GraphQL API - all the data managers need are fetched in a single query
+(additional queries are issued only if a listing does not fit into one page), instead of listing each of them
+and querying each pull request separately using REST API. Entries are converted to the form returned by
+REST API so that IGitt objects can be constructed from them.
+"""
+
+import logging
+import threading
+import typing
+
+import IGitt.GitHub
+
+from .exception import SnapshotError
+from .http_pool import get_session
+
+_LOGGER = logging.getLogger(__name__)
+
+# Branches created by Kebechet, only these are part of the snapshot.
+BRANCH_PREFIX = 'kebechet-'
+
+_PAGE_SIZE = 100
+
+_STATS = {
+    'snapshots': 0,
+    'queries': 0,
+}
+
+_ISSUE_FIELDS = '''
+    number
+    title
+    body
+    url
+    createdAt
+    updatedAt
+    author { login }
+    labels(first: 100) { nodes { name } }
+    assignees(first: 100) { nodes { login } }
+'''
+
+_QUERY = '''
+query($owner: String!, $name: String!, $branchPrefix: String!,
+      $withIssues: Boolean!, $issuesCursor: String,
+      $withPullRequests: Boolean!, $pullRequestsCursor: String,
+      $withRefs: Boolean!, $refsCursor: String) {
+  repository(owner: $owner, name: $name) {
+    issues(states: OPEN, first: %(page_size)d, after: $issuesCursor, orderBy: {field: CREATED_AT, direction: DESC})
+        @include(if: $withIssues) {
+      pageInfo { hasNextPage endCursor }
+      nodes { %(issue_fields)s }
+    }
+    pullRequests(states: OPEN, first: %(page_size)d, after: $pullRequestsCursor,
+                 orderBy: {field: CREATED_AT, direction: DESC}) @include(if: $withPullRequests) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        %(issue_fields)s
+        headRefName
+        headRefOid
+        baseRefName
+        baseRefOid
+        additions
+        deletions
+        commits(first: 1) { totalCount nodes { commit { oid parents(first: 1) { nodes { oid } } } } }
+      }
+    }
+    refs(refPrefix: "refs/heads/", query: $branchPrefix, first: %(page_size)d, after: $refsCursor)
+        @include(if: $withRefs) {
+      pageInfo { hasNextPage endCursor }
+      nodes { name }
+    }
+  }
+}
+''' % {'page_size': _PAGE_SIZE, 'issue_fields': _ISSUE_FIELDS}
+
+# Connections queried and names of variables controlling their pagination.
+_CONNECTIONS = {
+    'issues': ('withIssues', 'issuesCursor'),
+    'pullRequests': ('withPullRequests', 'pullRequestsCursor'),
+    'refs': ('withRefs', 'refsCursor'),
+}
+
+
+def get_stats() -> dict:
+    """Get statistics of snapshots obtained by this process."""
+    return dict(_STATS)
+
+
+class PullRequestInfo:
+    """Commits of an open pull request as needed to decide whether the pull request should be updated."""
+
+    __slots__ = ('number', 'commit_count', 'parent_sha')
+
+    def __init__(self, number: int, commit_count: int, parent_sha: typing.Optional[str]):
+        """Initialize pull request info, parent_sha is SHA of parent of the first commit in the pull request."""
+        self.number = number
+        self.commit_count = commit_count
+        self.parent_sha = parent_sha
+
+
+class GitHubSnapshot:
+    """Open issues, open pull requests and Kebechet branches of a repository.
+
+    Changes made by Kebechet itself are recorded in the snapshot so it does not need to be obtained again.
+    """
+
+    __slots__ = ('issues', 'pull_requests', 'pull_request_infos', 'branches', '_lock')
+
+    def __init__(self, issues: typing.List[dict], pull_requests: typing.List[dict],
+                 pull_request_infos: typing.Dict[int, PullRequestInfo], branches: typing.List[str]):
+        """Initialize snapshot, issues and pull requests are stated as returned by REST API."""
+        self.issues = issues
+        self.pull_requests = pull_requests
+        self.pull_request_infos = pull_request_infos
+        self.branches = branches
+        # Branches are deleted concurrently.
+        self._lock = threading.Lock()
+
+    def add_pull_request(self, pull_request: dict) -> None:
+        """Record a newly opened pull request as returned by REST API, commits are not known for it."""
+        with self._lock:
+            self.pull_requests = [pull_request] + self.pull_requests
+            self.issues = [dict(pull_request, pull_request={'html_url': pull_request['html_url']})] + self.issues
+            branch = pull_request['head']['ref']
+            if branch.startswith(BRANCH_PREFIX) and branch not in self.branches:
+                self.branches = self.branches + [branch]
+
+    def remove_branch(self, branch: str) -> None:
+        """Record deletion of the given branch, pull requests opened from it get closed."""
+        with self._lock:
+            closed = {entry['number'] for entry in self.pull_requests if entry['head']['ref'] == branch}
+            self.branches = [item for item in self.branches if item != branch]
+            self.pull_requests = [entry for entry in self.pull_requests if entry['number'] not in closed]
+            self.issues = [entry for entry in self.issues if entry['number'] not in closed]
+            self.pull_request_infos = {
+                number: info for number, info in self.pull_request_infos.items() if number not in closed
+            }
+
+
+def _get_graphql_url() -> str:
+    """Get URL of GraphQL endpoint, GitHub Enterprise serves it next to REST API (not under it)."""
+    base_url = IGitt.GitHub.BASE_URL.rstrip('/')
+    if base_url.endswith('/api/v3'):
+        return base_url[:-len('/v3')] + '/graphql'
+
+    return base_url + '/graphql'
+
+
+def _query(url: str, token: str, variables: dict) -> dict:
+    """Issue the snapshot query with the given variables, return the repository object."""
+    _STATS['queries'] += 1
+    response = get_session(url).post(
+        url,
+        headers={'Authorization': f'token {token}'},
+        json={'query': _QUERY, 'variables': variables}
+    )
+    if response.status_code != 200:
+        raise SnapshotError(f"GraphQL query failed with status code {response.status_code}: {response.text}")
+
+    try:
+        content = response.json()
+    except ValueError as exc:
+        raise SnapshotError(f"GraphQL query returned invalid response: {response.text}") from exc
+
+    if content.get('errors'):
+        raise SnapshotError(f"GraphQL query failed: {content['errors']}")
+
+    repository = (content.get('data') or {}).get('repository')
+    if repository is None:
+        raise SnapshotError(f"Repository {variables['owner']}/{variables['name']} not found")
+
+    return repository
+
+
+def _to_issue_data(node: dict) -> dict:
+    """Convert an issue (or a pull request) as returned by GraphQL API to the form returned by REST API."""
+    return {
+        'number': node['number'],
+        'title': node['title'],
+        'body': node['body'],
+        'state': 'open',
+        'html_url': node['url'],
+        'created_at': node['createdAt'],
+        'updated_at': node['updatedAt'],
+        'user': {'login': (node['author'] or {}).get('login')},
+        'labels': [{'name': label['name']} for label in node['labels']['nodes']],
+        'assignees': [{'login': assignee['login']} for assignee in node['assignees']['nodes']],
+    }
+
+
+def _to_pull_request_data(node: dict) -> dict:
+    """Convert a pull request as returned by GraphQL API to the form returned by REST API."""
+    result = _to_issue_data(node)
+    result.update({
+        'head': {'ref': node['headRefName'], 'sha': node['headRefOid']},
+        'base': {'ref': node['baseRefName'], 'sha': node['baseRefOid']},
+        'additions': node['additions'],
+        'deletions': node['deletions'],
+    })
+    return result
+
+
+def _to_pull_request_info(node: dict) -> PullRequestInfo:
+    """Get commits of a pull request as returned by GraphQL API."""
+    parent_sha = None
+    if node['commits']['nodes']:
+        parents = node['commits']['nodes'][0]['commit']['parents']['nodes']
+        parent_sha = parents[0]['oid'] if parents else None
+
+    return PullRequestInfo(node['number'], node['commits']['totalCount'], parent_sha)
+
+
+def get_snapshot(token: str, slug: str) -> GitHubSnapshot:
+    """Obtain a snapshot of the given repository, raise SnapshotError if the snapshot cannot be obtained."""
+    owner, name = slug.split('/', maxsplit=1)
+    url = _get_graphql_url()
+    variables = {'owner': owner, 'name': name, 'branchPrefix': BRANCH_PREFIX}
+    for include, cursor in _CONNECTIONS.values():
+        variables[include] = True
+        variables[cursor] = None
+
+    nodes = {connection: [] for connection in _CONNECTIONS}
+    # Only connections with more pages left are queried again.
+    while any(variables[include] for include, _ in _CONNECTIONS.values()):
+        repository = _query(url, token, variables)
+        for connection, (include, cursor) in _CONNECTIONS.items():
+            if not variables[include]:
+                continue
+
+            nodes[connection].extend(repository[connection]['nodes'])
+            page_info = repository[connection]['pageInfo']
+            variables[include] = page_info['hasNextPage']
+            variables[cursor] = page_info['endCursor']
+
+    pull_requests = [_to_pull_request_data(node) for node in nodes['pullRequests']]
+    # REST API lists pull requests as issues as well, newest first.
+    issues = [_to_issue_data(node) for node in nodes['issues']]
+    issues.extend(dict(entry, pull_request={'html_url': entry['html_url']}) for entry in pull_requests)
+    issues.sort(key=lambda entry: entry['created_at'], reverse=True)
+
+    _STATS['snapshots'] += 1
+    _LOGGER.debug(
+        "Obtained snapshot of %s: %d open issues, %d open pull requests, %d branches",
+        slug, len(nodes['issues']), len(pull_requests), len(nodes['refs'])
+    )
+    return GitHubSnapshot(
+        issues=issues,
+        pull_requests=pull_requests,
+        pull_request_infos={node['number']: _to_pull_request_info(node) for node in nodes['pullRequests']},
+        branches=[node['name'] for node in nodes['refs'] if node['name'].startswith(BRANCH_PREFIX)]
+    )
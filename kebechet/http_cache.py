@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""A persistent cache of GET responses revalidated using conditional requests (ETag and Last-Modified).
+
+The cache is plugged into requests.Session so it serves calls done by Kebechet as well as calls done by IGitt.
+Responses answered with 304 Not Modified are replayed from the cache - GitHub does not count these responses
+against the rate limit.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from .utils import get_sqlite_connection
+
+_LOGGER = logging.getLogger(__name__)
+
+_CACHE_PATH = os.getenv('KEBECHET_HTTP_CACHE')
+
+# Headers describing encoding of the original payload, these do not apply to the decoded content stored.
+_IGNORED_HEADERS = frozenset(('content-encoding', 'content-length', 'transfer-encoding'))
+
+_STATS = {
+    'conditional_requests': 0,
+    'not_modified': 0,
+    'rate_limit_saved': 0,
+}
+
+# The connection is shared by threads in the process, serialize access to it.
+_LOCK = threading.Lock()
+
+
+def is_enabled() -> bool:
+    """Check whether the HTTP cache was configured."""
+    return bool(_CACHE_PATH)
+
+
+def _get_connection() -> sqlite3.Connection:
+    """Get connection to the cache database, create the database if needed."""
+    return get_sqlite_connection(
+        _CACHE_PATH,
+        'CREATE TABLE IF NOT EXISTS responses ('
+        'key TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, headers TEXT, content BLOB, updated REAL)'
+    )
+
+
+def _get_key(request: requests.PreparedRequest) -> str:
+    """Compute a cache key for the given request.
+
+    The key respects authorization (tokens can be passed in headers as well as in the URL) so responses are never
+    shared across tokens. Only a digest is stored so no tokens are kept in the cache.
+    """
+    key = '\n'.join((
+        request.url,
+        request.headers.get('Authorization', ''),
+        request.headers.get('Accept', ''),
+    ))
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _replay(request: requests.PreparedRequest, response: requests.Response, row: tuple) -> requests.Response:
+    """Construct a response from the cached entry, take fresh headers from the 304 response."""
+    _, _, headers, content = row
+    cached = requests.Response()
+    cached.status_code = 200
+    cached.reason = 'OK'
+    cached.headers = CaseInsensitiveDict(json.loads(headers))
+    for header, value in response.headers.items():
+        if header.lower() not in _IGNORED_HEADERS:
+            cached.headers[header] = value
+    cached._content = content
+    cached.encoding = get_encoding_from_headers(cached.headers)
+    cached.url = request.url
+    cached.request = request
+    cached.elapsed = response.elapsed
+    cached.connection = response.connection
+    return cached
+
+
+def _store(key: str, response: requests.Response) -> None:
+    """Store the given response if it can be revalidated later on."""
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if not etag and not last_modified:
+        return
+
+    headers = {header: value for header, value in response.headers.items() if header.lower() not in _IGNORED_HEADERS}
+    with _LOCK:
+        _get_connection().execute(
+            'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+            (key, etag, last_modified, json.dumps(headers), response.content, time.time())
+        )
+
+
+def _cached_send(original_send):
+    """Wrap send method of requests.Session to perform conditional requests and replay cached responses."""
+    def send(self, request, **kwargs):
+        if request.method != 'GET' or kwargs.get('stream'):
+            return original_send(self, request, **kwargs)
+
+        key = _get_key(request)
+        try:
+            with _LOCK:
+                row = _get_connection().execute(
+                    'SELECT etag, last_modified, headers, content FROM responses WHERE key = ?', (key,)
+                ).fetchone()
+        except sqlite3.Error:
+            _LOGGER.exception("Failed to query HTTP cache, performing unconditional request")
+            row = None
+
+        if row:
+            _STATS['conditional_requests'] += 1
+            etag, last_modified, _, _ = row
+            if etag:
+                request.headers['If-None-Match'] = etag
+            if last_modified:
+                request.headers['If-Modified-Since'] = last_modified
+
+        response = original_send(self, request, **kwargs)
+
+        if row and response.status_code == 304:
+            _STATS['not_modified'] += 1
+            if 'X-GitHub-Request-Id' in response.headers:
+                # Conditional requests answered with 304 are not counted against GitHub rate limit.
+                _STATS['rate_limit_saved'] += 1
+            return _replay(request, response, row)
+
+        if response.status_code == 200:
+            try:
+                _store(key, response)
+            except sqlite3.Error:
+                _LOGGER.exception("Failed to store response in HTTP cache")
+
+        return response
+
+    send.kebechet_cached = True
+    return send
+
+
+def install() -> None:
+    """Plug the cache into requests.Session if the cache was configured."""
+    if not is_enabled() or getattr(requests.Session.send, 'kebechet_cached', False):
+        return
+
+    _LOGGER.debug("Using HTTP cache stored in %r", _CACHE_PATH)
+    requests.Session.send = _cached_send(requests.Session.send)
+
+
+def get_stats() -> dict:
+    """Get statistics of cache usage in this process."""
+    return dict(_STATS)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Pooled keep-alive HTTP sessions shared across all the calls to a service host."""
+
+import logging
+import os
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_LOGGER = logging.getLogger(__name__)
+
+_POOL_SIZE = int(os.getenv('KEBECHET_HTTP_POOL_SIZE', 10))
+_RETRIES = int(os.getenv('KEBECHET_HTTP_RETRIES', 3))
+_BACKOFF_FACTOR = float(os.getenv('KEBECHET_HTTP_BACKOFF_FACTOR', 0.5))
+
+# Service host -> session used for talking to the host.
+_SESSIONS = {}
+
+
+def get_session(url: str) -> requests.Session:
+    """Get a session for the host of the given URL, reusing connections opened to the host."""
+    host = urlparse(url).netloc
+    session = _SESSIONS.get(host)
+    if session is None:
+        _LOGGER.debug("Creating HTTP session for %r with connection pool of size %d", host, _POOL_SIZE)
+        session = requests.Session()
+        # Requests which are not idempotent (e.g. POST) are not retried after they were sent.
+        retries = Retry(
+            total=_RETRIES,
+            backoff_factor=_BACKOFF_FACTOR,
+            status_forcelist=(500, 502, 503, 504),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_maxsize=_POOL_SIZE, max_retries=retries)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _SESSIONS[host] = session
+
+    return session
+
+
+def _iter_connection_pools():
+    """Iterate over all connection pools of sessions opened."""
+    for session in _SESSIONS.values():
+        for adapter in session.adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    yield pool
+
+
+def get_stats() -> dict:
+    """Get statistics on connections opened and reused by pooled sessions."""
+    connections_opened = 0
+    requests_done = 0
+    # Both adapters mounted to a session are the same instance, count each pool once.
+    for pool in set(_iter_connection_pools()):
+        connections_opened += pool.num_connections
+        requests_done += pool.num_requests
+
+    return {
+        'connections_opened': connections_opened,
+        'connections_reused': max(requests_done - connections_opened, 0),
+        'requests': requests_done,
+    }
+
+
+def reset() -> None:
+    """Drop all the sessions - e.g. in a forked process which must not share connections with its parent."""
+    _SESSIONS.clear()
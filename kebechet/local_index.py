@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""A directory backed simple index (PEP 503) standing in for PyPI during dependency resolution.
+
+The index is populated incrementally from lock files and requirement files Kebechet operates on. In offline mode,
+the index is not populated at all and pipenv resolves dependencies solely against the packages already present.
+"""
+
+import hashlib
+import html
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import typing
+from pathlib import Path
+
+from .lockfile import PipfileLock
+from .pypi import PYPI_SIMPLE_URL
+from .pypi import normalize_package_name
+from .utils import file_lock
+
+_LOGGER = logging.getLogger(__name__)
+
+_INDEX_DIR = os.getenv('KEBECHET_LOCAL_INDEX')
+_OFFLINE = os.getenv('KEBECHET_OFFLINE', '0').lower() in ('1', 'true', 'yes')
+
+# Distribution file names - wheels and source distributions as downloaded by pip.
+_WHEEL_RE = re.compile(r'^(?P<name>[^-]+)-(?P<version>[^-]+)(-[^-]+)?-[^-]+-[^-]+-[^-]+\.whl$')
+_SDIST_RE = re.compile(r'^(?P<name>.+?)-(?P<version>\d[^-]*)\.(tar\.gz|tar\.bz2|zip)$')
+
+# Package names already refreshed to their latest version by this process.
+_REFRESHED = set()
+
+
+def is_enabled() -> bool:
+    """Check whether the local index was configured."""
+    return bool(_INDEX_DIR)
+
+
+def is_offline() -> bool:
+    """Check whether Kebechet should resolve dependencies without touching PyPI."""
+    return _OFFLINE
+
+
+def _get_packages_dir() -> str:
+    """Get directory where distribution files are stored."""
+    return os.path.join(_INDEX_DIR, 'packages')
+
+
+def _get_simple_dir() -> str:
+    """Get root of the simple index served to pipenv."""
+    return os.path.join(_INDEX_DIR, 'simple')
+
+
+def get_environment() -> dict:
+    """Get environment variables pointing pipenv to the local index, if configured."""
+    if not is_enabled():
+        return {}
+
+    return {'PIPENV_PYPI_MIRROR': Path(_get_simple_dir()).absolute().as_uri() + '/'}
+
+
+def _load_state() -> dict:
+    """Load state of the index - pinned packages already downloaded and digests of distribution files."""
+    try:
+        with open(os.path.join(_INDEX_DIR, 'state.json')) as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return {'seen': [], 'hashes': {}}
+
+
+def _write_atomically(path: str, content: str) -> None:
+    """Write the given file so that readers never see a partially written content."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as tmp_file:
+        tmp_file.write(content)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def _parse_file_name(file_name: str) -> typing.Optional[typing.Tuple[str, str]]:
+    """Get normalized project name and version from the distribution file name."""
+    match = _WHEEL_RE.match(file_name) or _SDIST_RE.match(file_name)
+    if not match:
+        return None
+
+    return normalize_package_name(match.group('name')), match.group('version')
+
+
+def find_wheel(package_name: str, version: str) -> typing.Optional[str]:
+    """Get path to a wheel of the given package release present in the index, if any."""
+    if not is_enabled() or not os.path.isdir(_get_packages_dir()):
+        return None
+
+    release = (normalize_package_name(package_name), version)
+    for file_name in os.listdir(_get_packages_dir()):
+        if file_name.endswith('.whl') and _parse_file_name(file_name) == release:
+            return os.path.join(_get_packages_dir(), file_name)
+
+    return None
+
+
+def _regenerate(state: dict) -> None:
+    """Regenerate simple index pages based on distribution files present."""
+    projects = {}
+    for file_name in sorted(os.listdir(_get_packages_dir())):
+        parsed = _parse_file_name(file_name)
+        if not parsed:
+            _LOGGER.debug("Unable to parse project name from distribution %r, not adding it to index", file_name)
+            continue
+
+        if file_name not in state['hashes']:
+            with open(os.path.join(_get_packages_dir(), file_name), 'rb') as distribution:
+                state['hashes'][file_name] = hashlib.sha256(distribution.read()).hexdigest()
+        projects.setdefault(parsed[0], []).append(file_name)
+
+    for project_name, file_names in projects.items():
+        links = '\n'.join(
+            f'<a href="../../packages/{html.escape(file_name)}#sha256={state["hashes"][file_name]}">'
+            f'{html.escape(file_name)}</a><br/>'
+            for file_name in file_names
+        )
+        _write_atomically(
+            os.path.join(_get_simple_dir(), project_name, 'index.html'),
+            f'<!DOCTYPE html>\n<html><body>\n{links}\n</body></html>\n'
+        )
+
+    links = '\n'.join(f'<a href="{name}/">{name}</a><br/>' for name in sorted(projects))
+    _write_atomically(
+        os.path.join(_get_simple_dir(), 'index.html'),
+        f'<!DOCTYPE html>\n<html><body>\n{links}\n</body></html>\n'
+    )
+
+
+def _download(requirements: typing.List[str], no_deps: bool) -> None:
+    """Download distributions of the given requirements from PyPI, try one by one if a batch download fails."""
+    cmd = [
+        sys.executable, '-m', 'pip', 'download', '--quiet',
+        '--dest', _get_packages_dir(),
+        '--index-url', PYPI_SIMPLE_URL,
+    ]
+    if no_deps:
+        cmd.append('--no-deps')
+
+    result = subprocess.run(cmd + requirements, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode == 0 or len(requirements) == 1:
+        if result.returncode != 0:
+            _LOGGER.warning("Failed to download %r to local index: %s", requirements[0], result.stderr)
+        return
+
+    for requirement in requirements:
+        _download([requirement], no_deps)
+
+
+def _populate(pinned: typing.List[str], latest: typing.List[str]) -> None:
+    """Add pinned requirements and the latest versions of the given packages to the index.
+
+    Pinned requirements come from lock files which state all the transitive dependencies, so they are downloaded
+    without dependencies. The latest versions can require packages not locked yet, their dependencies are added.
+    """
+    if not is_enabled():
+        return
+
+    if is_offline():
+        _LOGGER.debug("Running in offline mode, not populating local index")
+        return
+
+    os.makedirs(_get_packages_dir(), exist_ok=True)
+    with file_lock(os.path.join(_INDEX_DIR, '.lock')):
+        state = _load_state()
+        seen = set(state['seen'])
+        pinned = sorted(set(pinned) - seen)
+        latest = sorted(set(latest) - _REFRESHED)
+
+        if pinned:
+            _LOGGER.info("Adding %d pinned packages to local index", len(pinned))
+            _download(pinned, no_deps=True)
+
+        if latest:
+            _LOGGER.info("Refreshing %d packages in local index to their latest versions", len(latest))
+            _download(latest, no_deps=False)
+
+        # Failed downloads are retried next time as packages downloaded are detected based on files present.
+        present = {'=='.join(parsed) for parsed in map(_parse_file_name, os.listdir(_get_packages_dir())) if parsed}
+        seen.update(requirement for requirement in pinned if requirement in present)
+        _REFRESHED.update(latest)
+        state['seen'] = sorted(seen)
+        _regenerate(state)
+        _write_atomically(os.path.join(_INDEX_DIR, 'state.json'), json.dumps(state, indent=2))
+
+
+def populate_from_lock(lock_path: str) -> None:
+    """Add packages stated in the given Pipfile.lock and their latest versions to the index."""
+    pinned = []
+    names = []
+    for package in PipfileLock.load(lock_path).iter_packages():
+        if not package.version:
+            # Packages from VCS or local paths are not served by the index.
+            continue
+        pinned.append(f'{normalize_package_name(package.name)}=={package.version}')
+        names.append(normalize_package_name(package.name))
+
+    _populate(pinned, names)
+
+
+def populate_from_requirements(requirements: typing.List[str]) -> None:
+    """Add the latest versions of the given requirements including their dependencies to the index."""
+    _populate([], requirements)
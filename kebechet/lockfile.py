@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""A model of lock files (Pipfile.lock parsed once per content and pinned requirements.txt) and their differences."""
+
+import hashlib
+import json
+import logging
+import os
+import typing
+from collections import OrderedDict
+
+from pkg_resources import parse_version
+
+from .requirements import iter_requirements
+
+_LOGGER = logging.getLogger(__name__)
+
+# Number of parsed lock files kept in memory.
+_CACHE_SIZE = 16
+
+
+class LockedPackage:
+    """A package pinned down in the lock file."""
+
+    __slots__ = ('name', 'version', 'dev', 'hashes', 'markers')
+
+    def __init__(self, name: str, version: typing.Optional[str], dev: bool, hashes: tuple = (), markers: str = None):
+        """Initialize a locked package, version is None for packages not installed from an index (e.g. VCS)."""
+        self.name = name
+        self.version = version
+        self.dev = dev
+        self.hashes = hashes
+        self.markers = markers
+
+    def __repr__(self):
+        """Represent the locked package."""
+        return f'{self.__class__.__name__}({self.name!r}, {self.version!r}, dev={self.dev!r})'
+
+
+class PipfileLock:
+    """Pipfile.lock parsed into locked packages, instances are cached by content of the lock file."""
+
+    # Content digest -> parsed lock file, least recently used entries are dropped first.
+    _cache = OrderedDict()
+
+    def __init__(self, digest: str, meta: dict, default: typing.Dict[str, LockedPackage],
+                 develop: typing.Dict[str, LockedPackage]):
+        """Initialize lock file model, package names are lower case."""
+        self.digest = digest
+        self.meta = meta
+        self.default = default
+        self.develop = develop
+
+    @staticmethod
+    def _parse_section(section: dict, dev: bool) -> typing.Dict[str, LockedPackage]:
+        """Parse packages stated in the default or develop section of the lock file."""
+        result = {}
+        for package_name, package_info in section.items():
+            version = package_info.get('version')
+            result[package_name.lower()] = LockedPackage(
+                package_name.lower(),
+                version[len('=='):] if version else None,
+                dev,
+                tuple(package_info.get('hashes', ())),
+                package_info.get('markers')
+            )
+
+        return result
+
+    @classmethod
+    def from_bytes(cls, content: bytes) -> 'PipfileLock':
+        """Get lock file model for the given lock file content, parse it only if not parsed before."""
+        digest = hashlib.sha256(content).hexdigest()
+        instance = cls._cache.get(digest)
+        if instance is not None:
+            cls._cache.move_to_end(digest)
+            return instance
+
+        _LOGGER.debug("Parsing lock file with digest %s", digest)
+        parsed = json.loads(content.decode())
+        instance = cls(
+            digest,
+            parsed.get('_meta', {}),
+            cls._parse_section(parsed.get('default', {}), dev=False),
+            cls._parse_section(parsed.get('develop', {}), dev=True)
+        )
+        cls._cache[digest] = instance
+        if len(cls._cache) > _CACHE_SIZE:
+            cls._cache.popitem(last=False)
+
+        return instance
+
+    @classmethod
+    def load(cls, path: str = 'Pipfile.lock') -> 'PipfileLock':
+        """Load the given lock file, a change of the file on disk is reflected as cache is keyed by content.
+
+        Computing digest of the content is considerably cheaper than parsing it, so each call reads the file.
+        """
+        with open(os.path.abspath(path), 'rb') as lock_file:
+            return cls.from_bytes(lock_file.read())
+
+    def get_package(self, package_name: str, dev: bool = False) -> typing.Optional[LockedPackage]:
+        """Get the given package from the default (or develop) section of the lock file."""
+        return (self.develop if dev else self.default).get(package_name.lower())
+
+    def iter_packages(self) -> typing.Iterator[LockedPackage]:
+        """Iterate over all the packages in the lock file, default section first."""
+        yield from self.default.values()
+        yield from self.develop.values()
+
+    @property
+    def packages(self) -> typing.Dict[str, LockedPackage]:
+        """Get all the packages in the lock file keyed by name, packages from the default section take precedence."""
+        result = dict(self.develop)
+        result.update(self.default)
+        return result
+
+
+def parse_requirements_txt(path: str, dev: bool = False) -> typing.Dict[str, LockedPackage]:
+    """Parse a fully pinned down requirements.txt file, raise ValueError if a requirement is not pinned down."""
+    result = {}
+    for requirement in iter_requirements(path):
+        if requirement.editable:
+            # Editable installations are not pinned to a version.
+            continue
+
+        version = requirement.pinned_version
+        if not requirement.name or not version:
+            raise ValueError(f"File {path} does not state fully locked dependencies: {str(requirement)!r} is not "
+                             f"fully qualified dependency")
+
+        package_name = requirement.name.lower()
+        result[package_name] = LockedPackage(package_name, version, dev, requirement.hashes, requirement.markers)
+
+    return result
+
+
+class PackageChange:
+    """A change of a package between two lock files, version is None if the package is not present in a lock."""
+
+    __slots__ = ('name', 'old_version', 'new_version', 'dev')
+
+    def __init__(self, name: str, old_version: typing.Optional[str], new_version: typing.Optional[str], dev: bool):
+        """Initialize package change."""
+        self.name = name
+        self.old_version = old_version
+        self.new_version = new_version
+        self.dev = dev
+
+    def __repr__(self):
+        """Represent the package change."""
+        return f'{self.__class__.__name__}({self.name!r}, {self.old_version!r} -> {self.new_version!r})'
+
+
+class LockDiff:
+    """Packages added, removed, upgraded and downgraded between two lock files."""
+
+    __slots__ = ('added', 'removed', 'upgraded', 'downgraded')
+
+    def __init__(self):
+        """Initialize an empty difference."""
+        self.added = {}
+        self.removed = {}
+        self.upgraded = {}
+        self.downgraded = {}
+
+    def __bool__(self):
+        """Check whether there is any difference."""
+        return bool(self.added or self.removed or self.upgraded or self.downgraded)
+
+    def __repr__(self):
+        """Represent the difference."""
+        return f'{self.__class__.__name__}(added={list(self.added)}, removed={list(self.removed)}, ' \
+               f'upgraded={list(self.upgraded)}, downgraded={list(self.downgraded)})'
+
+    def iter_changes(self) -> typing.Iterator[PackageChange]:
+        """Iterate over all the changes sorted by package name."""
+        changes = {}
+        for section in (self.added, self.removed, self.upgraded, self.downgraded):
+            changes.update(section)
+
+        for package_name in sorted(changes):
+            yield changes[package_name]
+
+
+def _is_downgrade(old_version: typing.Optional[str], new_version: typing.Optional[str]) -> bool:
+    """Check whether the new version is lower than the old one, versions not comparable are never downgrades."""
+    if old_version is None or new_version is None:
+        return False
+
+    return parse_version(new_version) < parse_version(old_version)
+
+
+def diff_locks(old: typing.Dict[str, LockedPackage], new: typing.Dict[str, LockedPackage]) -> LockDiff:
+    """Compute difference of two lock files, the lock files are given as packages keyed by package name."""
+    result = LockDiff()
+    for package_name, old_package in old.items():
+        new_package = new.get(package_name)
+        if new_package is None:
+            result.removed[package_name] = PackageChange(package_name, old_package.version, None, old_package.dev)
+        elif new_package.version != old_package.version:
+            change = PackageChange(package_name, old_package.version, new_package.version, new_package.dev)
+            if _is_downgrade(old_package.version, new_package.version):
+                result.downgraded[package_name] = change
+            else:
+                result.upgraded[package_name] = change
+
+    for package_name, new_package in new.items():
+        if package_name not in old:
+            result.added[package_name] = PackageChange(package_name, None, new_package.version, new_package.dev)
+
+    return result
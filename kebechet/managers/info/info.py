@@ -21,7 +21,6 @@ import logging
 import typing
 
 from kebechet.managers.manager import ManagerBase
-from kebechet.utils import cloned_repo
 
 from .messages import INFO_REPORT
 
@@ -33,6 +32,9 @@ _LOGGER = logging.getLogger(__name__)
 class InfoManager(ManagerBase):
     """Manager for submitting information about running Kebechet instance."""
 
+    # Info requests are waited for by maintainers.
+    priority = 10
+
     def run(self) -> typing.Optional[dict]:
         """Check for info issue and close it with a report."""
         issue = self.sm.get_issue(_INFO_ISSUE_NAME)
@@ -41,11 +43,10 @@ class InfoManager(ManagerBase):
             return
 
         _LOGGER.info(f"Found issue {_INFO_ISSUE_NAME}, generating report")
-        with cloned_repo(self.service_url, self.slug, depth=1) as repo:
-            # We could optimize this as the get_issue() does API calls as well. Keep it this simple now.
+        with self.cloned_repo(depth=1) as repo:
             self.sm.close_issue_if_exists(
                 _INFO_ISSUE_NAME,
-                INFO_REPORT.format(
+                lambda: INFO_REPORT.format(
                     sha=repo.head.commit.hexsha,
                     slug=self.slug,
                     environment_details=self.get_environment_details(),
@@ -17,16 +17,28 @@
 
 """Common and useful utilities for managers."""
 
+import hashlib
+import json
 import logging
+import os
 import platform
+import subprocess
 import typing
 
-import delegator
 import kebechet
 
+from kebechet import local_index
+from kebechet import package_cache
+from kebechet.command import run_command
+from kebechet.dependency_graph import build_dependency_graph
+from kebechet.dependency_graph import render_dependency_graph
+from kebechet.exception import DependencyGraphError
 from kebechet.exception import PipenvError
+from kebechet.lockfile import PipfileLock
 from kebechet.enums import ServiceType
+from kebechet.repository_session import RepositorySession
 from kebechet.source_management import SourceManagement
+from kebechet.utils import cloned_repo
 
 import IGitt.GitHub
 import IGitt.GitLab
@@ -59,57 +71,152 @@ def _init_igitt(service_type: ServiceType = None, service_url: str = None) -> st
 class ManagerBase:
     """A base class for manager instances holding common and useful utilities."""
 
-    def __init__(self, slug, service_type: ServiceType = None, service_url: str = None, token: str = None):
-        """Initialize manager instance for talking to services."""
+    # Seconds a successful run stays valid if neither master nor configuration changed (see kebechet.run_state),
+    # 0 runs the manager each time (e.g. managers reacting to issues), None skips it until master changes.
+    state_ttl = 0
+    # Managers with lower priority number are run first (see kebechet.scheduler).
+    priority = 50
+
+    def __init__(self, slug, service_type: ServiceType = None, service_url: str = None, token: str = None,
+                 session: RepositorySession = None):
+        """Initialize manager instance for talking to services.
+
+        If a session is provided, the cloned repository and SourceManagement are shared with other managers.
+        """
         self.service_type = service_type or ServiceType.GITHUB
         # This needs to be called before instantiation of SourceManagement due to changes in global variables.
         self.service_url = _init_igitt(service_type, service_url)
         # Allow token expansion from env vars.
         self.slug = slug
         self.owner, self.repo_name = self.slug.split('/', maxsplit=1)
-        self.sm = SourceManagement(self.service_type, self.service_url, token, slug)
+        self.session = session
+        if session:
+            self.sm = session.sm
+        else:
+            self.sm = SourceManagement(self.service_type, self.service_url, token, slug)
+
+    def cloned_repo(self, **clone_kwargs):
+        """Clone the repository managed and cd into it, reuse clone from session if available."""
+        if self.session:
+            return self.session.cloned_repo(**clone_kwargs)
+
+        return cloned_repo(self.service_url, self.slug, **clone_kwargs)
+
+    # Environment details do not change during the process lifetime, computed on first use.
+    _environment_details = None
+    # Dependency graphs (or errors obtaining them) keyed by repository HEAD and digest of Pipfile and Pipfile.lock.
+    _dependency_graphs = {}
 
     @classmethod
-    def get_environment_details(cls, as_dict=False) -> str:
-        """Get details for environment in which Kebechet runs."""
-        try:
-            pipenv_version = cls.run_pipenv('pipenv --version')
-        except PipenvError as exc:
-            pipenv_version = f"Failed to obtain pipenv version:\n{exc.stderr}"
+    def _get_environment_details_dict(cls) -> dict:
+        """Get details for environment in which Kebechet runs, computed once per process."""
+        if ManagerBase._environment_details is not None:
+            return ManagerBase._environment_details
 
-        return f"""
-Kebechet version: {kebechet.__version__}
-Python version: {platform.python_version()}
-Platform: {platform.platform()}
-pipenv version: {pipenv_version}
-""" if not as_dict else {
+        details = {
             'kebechet_version': kebechet.__version__,
             'python_version': platform.python_version(),
             'platform': platform.platform(),
-            'pipenv_version': pipenv_version
         }
+        try:
+            details['pipenv_version'] = cls.run_pipenv('pipenv --version')
+        except PipenvError as exc:
+            # Do not memoize failures, these can be transient.
+            details['pipenv_version'] = f"Failed to obtain pipenv version:\n{exc.stderr}"
+            return details
+
+        ManagerBase._environment_details = details
+        return details
+
+    @classmethod
+    def get_environment_details(cls, as_dict=False) -> str:
+        """Get details for environment in which Kebechet runs."""
+        details = cls._get_environment_details_dict()
+        return f"""
+Kebechet version: {details['kebechet_version']}
+Python version: {details['python_version']}
+Platform: {details['platform']}
+pipenv version: {details['pipenv_version']}
+""" if not as_dict else dict(details)
 
     @staticmethod
     def run_pipenv(cmd: str):
         """Run pipenv, raise :ref:kebechet.exception.PipenvError on any error holding all the information."""
         _LOGGER.debug(f"Running pipenv command {cmd!r}")
-        result = delegator.run(cmd)
+        env = local_index.get_environment()
+        with package_cache.environment() as cache_env:
+            env.update(cache_env or {})
+            result = run_command(cmd, env=env)
         if result.return_code != 0:
             _LOGGER.warning(result.err)
             raise PipenvError(result)
 
         return result.out
 
-    @classmethod
-    def get_dependency_graph(cls, graceful: bool = False):
-        """Get dependency graph of the project."""
+    @staticmethod
+    def _get_dependency_graph_key() -> typing.Optional[str]:
+        """Get key identifying dependencies of the repository in the current directory, None if not a git repo."""
         try:
-            cls.run_pipenv('pipenv install --dev --skip-lock')
-            return cls.run_pipenv('pipenv graph')
-        except PipenvError as exc:
+            head = subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True
+            ).stdout.decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+        # Pipfile and Pipfile.lock can be modified in the working tree (e.g. when re-locked).
+        digest = hashlib.sha256()
+        for file_name in ('Pipfile', 'Pipfile.lock'):
+            if os.path.isfile(file_name):
+                with open(file_name, 'rb') as dependency_file:
+                    digest.update(dependency_file.read())
+            digest.update(b'\0')
+
+        return f'{os.getcwd()}:{head}:{digest.hexdigest()}'
+
+    @classmethod
+    def _compute_dependency_graph(cls, as_json: bool):
+        """Compute dependency graph from package metadata, install packages to obtain it only if not possible."""
+        if os.path.isfile('Pipfile.lock'):
+            try:
+                graph = build_dependency_graph(PipfileLock.load())
+                return graph if as_json else render_dependency_graph(graph)
+            except (DependencyGraphError, ValueError) as exc:
+                _LOGGER.warning(f"Failed to construct dependency graph from package metadata, installing packages: "
+                                f"{str(exc)}")
+
+        cls.run_pipenv('pipenv install --dev --skip-lock')
+        if as_json:
+            return json.loads(cls.run_pipenv('pipenv graph --json'))
+
+        return cls.run_pipenv('pipenv graph')
+
+    @classmethod
+    def get_dependency_graph(cls, graceful: bool = False, as_json: bool = False):
+        """Get dependency graph of the project, computed once per repository state.
+
+        The graph is returned as text (as printed by pipenv graph) or as a list of packages with their
+        dependencies if as_json is set.
+        """
+        key = cls._get_dependency_graph_key()
+        if key is not None and (key, as_json) in ManagerBase._dependency_graphs:
+            _LOGGER.debug("Using memoized dependency graph for %r", key)
+            graph, error = ManagerBase._dependency_graphs[(key, as_json)]
+        else:
+            graph, error = None, None
+            try:
+                graph = cls._compute_dependency_graph(as_json)
+            except PipenvError as exc:
+                error = exc
+
+            if key is not None:
+                ManagerBase._dependency_graphs[(key, as_json)] = graph, error
+
+        if error is not None:
             if not graceful:
-                raise
-            return f"Unable to obtain dependency graph:\n\n{exc.stderr}"
+                raise error
+            return f"Unable to obtain dependency graph:\n\n{error.stderr}"
+
+        return graph
 
     def run(self, labels: list) -> typing.Optional[dict]:
         """Run the given manager implementation."""
@@ -21,11 +21,12 @@ import json
 import logging
 import typing
 
+from kebechet.http_pool import get_session
 from kebechet.managers.manager import ManagerBase
+from kebechet.requirements import parse_requirement
+from kebechet.requirements import parse_requirements
 from kebechet.utils import construct_raw_file_url
-from kebechet.utils import cloned_repo
 
-import requests
 import toml
 
 _LOGGER = logging.getLogger(__name__)
@@ -34,6 +35,9 @@ _LOGGER = logging.getLogger(__name__)
 class PipfileRequirementsManager(ManagerBase):
     """Keep requirements.txt in sync with Pipfile or Pipfile.lock."""
 
+    # Results depend solely on content of master.
+    state_ttl = None
+
     @staticmethod
     def get_pipfile_requirements(content: str) -> typing.Set[str]:
         """Parse Pipfile file and gather requirements, respect version specifications listed."""
@@ -48,7 +52,7 @@ class PipfileRequirementsManager(ManagerBase):
                 ))
 
             package_version = entry if entry != '*' else ''
-            requirements.add(f'{package_name}{package_version}')
+            requirements.add(str(parse_requirement(f'{package_name}{package_version}')))
 
         return requirements
 
@@ -66,7 +70,7 @@ class PipfileRequirementsManager(ManagerBase):
                 ))
 
             specifier = package_version if package_version != '*' else ''
-            requirements.add(f'{package_name}{specifier}')
+            requirements.add(str(parse_requirement(f'{package_name}{specifier}')))
 
         return requirements
 
@@ -77,7 +81,7 @@ class PipfileRequirementsManager(ManagerBase):
 
         _LOGGER.debug("Downloading %r from %r", file_name, file_url)
         # TODO: propagate tls_verify for internal GitLab instances here and bellow as well
-        response = requests.get(file_url)
+        response = get_session(file_url).get(file_url)
         response.raise_for_status()
         pipfile_content = sorted(self.get_pipfile_lock_requirements(response.text)) \
             if lockfile else sorted(self.get_pipfile_requirements(response.text))
@@ -86,20 +90,21 @@ class PipfileRequirementsManager(ManagerBase):
             self.service_url, self.slug, 'requirements.txt', self.service_type
         )
         _LOGGER.debug("Downloading requirements.txt from %r", file_url)
-        response = requests.get(file_url)
+        response = get_session(file_url).get(file_url)
         if response.status_code == 404:
             # If the requirements.txt file does not exist, create it.
             requirements_txt_content = []
         else:
             response.raise_for_status()
-            requirements_txt_content = sorted(response.text.splitlines())
+            # Compare requirements in their normalized form so that formatting and comments do not matter.
+            requirements_txt_content = sorted(str(requirement) for requirement in parse_requirements(response.text))
 
         if pipfile_content == requirements_txt_content:
             _LOGGER.info("Requirements in requirements.txt are up to date")
             # TODO: delete branch if already exists
             return
 
-        with cloned_repo(self.service_url, self.slug, depth=1) as repo:
+        with self.cloned_repo(depth=1) as repo:
             with open('requirements.txt', 'w') as requirements_file:
                 requirements_file.write('\n'.join(pipfile_content))
                 requirements_file.write('\n')
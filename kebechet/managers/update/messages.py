@@ -189,3 +189,14 @@ See attached report below to inspect this issue.
 {environment_details}
 ```
 """
+
+# Appended to the body of pull requests with updates, lists all the changes in the locked software stack.
+UPDATE_LOCK_DIFF = \
+    """
+
+##### Changes in the locked software stack
+
+| Package | Old version | New version |
+| --- | --- | --- |
+{changes}
+"""
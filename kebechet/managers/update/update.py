@@ -18,23 +18,39 @@
 """Dependency update management logic."""
 
 import os
+import hashlib
 import logging
+import shutil
+import time
 import toml
 import re
-import json
 import typing
 from itertools import chain
 from functools import partial
+from tempfile import TemporaryDirectory
 
 import git
+from pkg_resources import parse_version
 
+from kebechet import local_index
+from kebechet.exception import ConfigurationError
 from kebechet.exception import DependencyManagementError
 from kebechet.exception import InternalError
 from kebechet.exception import PipenvError
+from kebechet.lockfile import LockDiff
+from kebechet.lockfile import LockedPackage
+from kebechet.lockfile import PipfileLock
+from kebechet.lockfile import diff_locks
+from kebechet.lockfile import parse_requirements_txt
 from kebechet.managers.manager import ManagerBase
+from kebechet.requirements import iter_requirements
+from kebechet.pypi import PYPI_SIMPLE_URL
+from kebechet.pypi import get_latest_versions
 from kebechet.source_management import Issue
 from kebechet.source_management import MergeRequest
-from kebechet.utils import cloned_repo
+from kebechet.utils import copy_environment
+from kebechet.utils import fork_map
+from kebechet.utils import relocate_environment
 
 from .messages import ISSUE_CLOSE_COMMENT
 from .messages import ISSUE_COMMENT_UPDATE_ALL
@@ -42,9 +58,9 @@ from .messages import ISSUE_INITIAL_LOCK
 from .messages import ISSUE_NO_DEPENDENCY_MANAGEMENT
 from .messages import ISSUE_PIPENV_UPDATE_ALL
 from .messages import ISSUE_REPLICATE_ENV
+from .messages import UPDATE_LOCK_DIFF
 
 _LOGGER = logging.getLogger(__name__)
-_RE_VERSION_DELIMITER = re.compile('(==|===|<=|>=|~=|!=|<|>|\\[)')
 
 _ISSUE_UPDATE_ALL_NAME = "Failed to update dependencies to their latest version"
 _ISSUE_INITIAL_LOCK_NAME = "Failed to perform initial lock of software stack"
@@ -59,11 +75,26 @@ _ISSUE_NO_DEPENDENCY_NAME = "No dependency management found"
 class UpdateManager(ManagerBase):
     """Manage updates of dependencies."""
 
+    # New releases of dependencies do not change master, check for them periodically.
+    state_ttl = 6 * 3600
+    # Updates are slow and not urgent.
+    priority = 90
+
+    # Durations of full re-locks done by this process, used to estimate time saved by skipping them.
+    _update_all_durations = []
+
     def __init__(self, *args, **kwargs):
         """Initialize update manager."""
         self._repo = None
         # We do API calls once for merge requests and we cache them for later use.
         self._cached_merge_requests = None
+        self._branch_delete_concurrency = 4
+        self._parallelism = 1
+        self._groups = None
+        # Snapshots of replicated old environments (snapshot path and path of the environment snapshotted),
+        # keyed by Pipfile.lock digest.
+        self._snapshots_dir = None
+        self._environment_snapshots = {}
         super().__init__(*args, **kwargs)
 
     @property
@@ -83,22 +114,23 @@ class UpdateManager(ManagerBase):
         return self.repo.head.commit.hexsha
 
     @staticmethod
-    def _get_dependency_version(dependency: str, is_dev: bool) -> str:
-        """Get version of the given dependency from Pipfile.lock."""
+    def _load_pipfile_lock() -> PipfileLock:
+        """Load Pipfile.lock, the lock file is parsed only if its content changed."""
         try:
-            with open('Pipfile.lock') as pipfile_lock:
-                pipfile_lock_content = json.load(pipfile_lock)
+            return PipfileLock.load('Pipfile.lock')
         except Exception as exc:
             # TODO: open a PR to fix this
             raise DependencyManagementError(f"Failed to load Pipfile.lock file: {str(exc)}") from exc
 
-        version = pipfile_lock_content['develop' if is_dev else 'default'].get(
-            dependency, {}).get('version')
-        if not version:
+    @classmethod
+    def _get_dependency_version(cls, dependency: str, is_dev: bool) -> str:
+        """Get version of the given dependency from Pipfile.lock."""
+        package = cls._load_pipfile_lock().get_package(dependency, dev=is_dev)
+        if not package or not package.version:
             raise InternalError(
                 f"Failed to retrieve version information for dependency {dependency}, (dev: {is_dev})")
 
-        return version[len('=='):]
+        return package.version
 
     @staticmethod
     def _get_direct_dependencies() -> tuple:
@@ -122,44 +154,18 @@ class UpdateManager(ManagerBase):
         and generated Pipfile.lock from it.
         """
         input_file = 'requirements-dev.in' if req_dev else 'requirements.in'
-        with open(input_file, 'r') as requirements_in_file:
-            content = requirements_in_file.read()
-
-        direct_dependencies = set()
-        for line in content.splitlines():
-            if line.strip().startswith('#'):
-                continue
-
-            # TODO: we could reuse pip or pipenv functionality here to parse file.
-            package_name = _RE_VERSION_DELIMITER.split(line)[0]
-            direct_dependencies.add(package_name.lower())
-
-        return direct_dependencies
-
-    @staticmethod
-    def _get_all_packages_versions() -> dict:
-        """Parse Pipfile.lock file and retrieve all packages in the corresponding locked versions."""
         try:
-            with open('Pipfile.lock') as pipfile_lock:
-                pipfile_lock_content = json.load(pipfile_lock)
-        except Exception as exc:
-            # TODO: open a PR to fix this
-            raise DependencyManagementError(f"Failed to load Pipfile.lock file: {str(exc)}") from exc
-
-        result = {}
-        for package_name, package_info in pipfile_lock_content['default'].items():
-            result[package_name.lower()] = {
-                'dev': False,
-                'version': package_info['version'][len('=='):]
-            }
+            return {requirement.name.lower() for requirement in iter_requirements(input_file) if requirement.name}
+        except ValueError as exc:
+            raise DependencyManagementError(str(exc)) from exc
 
-        for package_name, package_info in pipfile_lock_content['develop'].items():
-            result[package_name.lower()] = {
-                'dev': False,
-                'version': package_info['version'][len('=='):]
-            }
-
-        return result
+    @classmethod
+    def _get_all_packages_versions(cls) -> dict:
+        """Parse Pipfile.lock file and retrieve all packages in the corresponding locked versions."""
+        return {
+            package.name: {'dev': package.dev, 'version': package.version}
+            for package in cls._load_pipfile_lock().iter_packages()
+        }
 
     @classmethod
     def _get_direct_dependencies_version(cls) -> dict:
@@ -176,82 +182,96 @@ class UpdateManager(ManagerBase):
         return result
 
     @staticmethod
-    def _get_requirements_txt_dependencies(req_dev: bool) -> dict:
-        """Gather dependencies from fully pinned down stack.
+    def _get_requirements_txt_packages(req_dev: bool) -> typing.Dict[str, LockedPackage]:
+        """Gather packages from fully pinned down stack.
 
         Gather dependencies from either requirements.txt or requirements-dev.txt file,
         our requirements.txt and requirements-dev.txt holds fully pinned down stack.
         """
-        result = {}
-        input_file = 'requirements-dev.txt' if req_dev else 'requirements.txt'
-        with open(input_file, 'r') as requirements_file:
-            content = requirements_file.read()
-
-        for line in content.splitlines():
-            if line.strip().startswith(('#', '-')):
-                continue
-
-            package_and_version = line.split('==', maxsplit=1)
-            if len(package_and_version) != 2:
-                raise DependencyManagementError(f"File {input_file} does not state fully locked "
-                                                f"dependencies: {line!r} is not fully qualified dependency")
-            package_name, package_version = package_and_version
-            result[package_name] = {
-                # FIXME: tabs?
-                'version': package_version.split(r' ', maxsplit=1)[0],
-                'dev': False
-            }
+        try:
+            return parse_requirements_txt('requirements-dev.txt' if req_dev else 'requirements.txt')
+        except ValueError as exc:
+            raise DependencyManagementError(str(exc)) from exc
 
-        return result
+    @staticmethod
+    def _get_requirements_txt_dependencies(packages: typing.Dict[str, LockedPackage]) -> dict:
+        """Gather dependencies from packages of fully pinned down stack in requirements.txt or requirements-dev.txt."""
+        return {package.name: {'version': package.version, 'dev': False} for package in packages.values()}
 
     @staticmethod
     def _construct_branch_name(package_name: str, new_package_version: str) -> str:
         """Construct branch name for the updated dependency."""
         return f'kebechet-{package_name}-{new_package_version}'
 
+    @staticmethod
+    def _construct_lock_diff_body(lock_diff: LockDiff) -> str:
+        """Construct part of the pull request body listing all the changes in the locked software stack."""
+        if not lock_diff:
+            return ''
+
+        changes = '\n'.join(
+            f"| {change.name} | {change.old_version or '-'} | {change.new_version or '-'} |"
+            for change in lock_diff.iter_changes()
+        )
+        return UPDATE_LOCK_DIFF.format(changes=changes)
+
+    def _push_merge_request(self, commit_msg: str, branch_name: str, body: str, labels: list, files: list,
+                            merge_request: MergeRequest) -> MergeRequest:
+        """Push changes into the given branch and open a pull/merge request, or update the already existing one."""
+        # If we have already an update for this branch we simple issue git
+        # push force always to keep branch up2date with the recent master and avoid merge conflicts.
+        self._git_push(":pushpin: " + commit_msg, branch_name, files, force_push=True)
+
+        if not merge_request:
+            return self.sm.open_merge_request(commit_msg, branch_name, body, labels)
+
+        merge_request.add_comment(f"Pull request has been rebased on top of the current master with SHA {self.sha}")
+        return merge_request
+
     def _open_merge_request_update(self, dependency: str, old_version: str, new_version: str,
-                                   labels: list, files: list, merge_request: MergeRequest) -> typing.Optional[int]:
+                                   labels: list, files: list, merge_request: MergeRequest,
+                                   lock_diff: LockDiff = None) -> typing.Optional[int]:
         """Open a pull/merge request for dependency update."""
         branch_name = self._construct_branch_name(dependency, new_version)
         commit_msg = f"Automatic update of dependency {dependency} from {old_version} to {new_version}"
 
-        # If we have already an update for this package we simple issue git
-        # push force always to keep branch up2date with the recent master and avoid merge conflicts.
-        self._git_push(":pushpin: " + commit_msg, branch_name, files, force_push=True)
+        body = f'Dependency {dependency} was used in version {old_version}, ' \
+               f'but the current latest version is {new_version}.'
+        if lock_diff is not None:
+            body += self._construct_lock_diff_body(lock_diff)
 
         if not merge_request:
             _LOGGER.info(f"Creating a pull request to update {dependency} from version {old_version} to {new_version}")
-            body = f'Dependency {dependency} was used in version {old_version}, ' \
-                   f'but the current latest version is {new_version}.'
-            merge_request = self.sm.open_merge_request(commit_msg, branch_name, body, labels)
-            return merge_request
+        else:
+            _LOGGER.info(f"Pull request #{merge_request.number} to update {dependency} from "
+                         f"version {old_version} to {new_version} updated")
 
-        _LOGGER.info(f"Pull request #{merge_request.number} to update {dependency} from "
-                     f"version {old_version} to {new_version} updated")
-        merge_request.add_comment(f"Pull request has been rebased on top of the current master with SHA {self.sha}")
-        return merge_request
+        return self._push_merge_request(commit_msg, branch_name, body, labels, files, merge_request)
 
     def _should_update(self, package_name, new_package_version) -> tuple:
         """Check whether the given update was already proposed as a pull request."""
-        branch_name = self._construct_branch_name(package_name, new_package_version)
+        return self._should_update_branch(self._construct_branch_name(package_name, new_package_version))
+
+    def _should_update_branch(self, branch_name: str) -> tuple:
+        """Check whether the update in the given branch was already proposed as a pull request."""
         response = {mr for mr in self._cached_merge_requests
                     if mr.head_branch_name == branch_name and mr.state in ('opened', 'open')}
 
         if len(response) == 0:
-            _LOGGER.debug(f"No pull request was found for update of {package_name} to version {new_package_version}")
+            _LOGGER.debug(f"No pull request was found for update in branch {branch_name!r}")
             return None, True
         elif len(response) == 1:
             response = list(response)[0]
-            commits = response.commits
-            if len(commits) != 1:
-                _LOGGER.info("Update of package {package_name} to version {new_package_version} will not be issued,"
-                             "the pull request as additional commits (by a maintaner?)")
+            commit_count, parent_sha = self.sm.get_merge_request_commits(response)
+            if commit_count != 1:
+                _LOGGER.info(f"Update in branch {branch_name!r} will not be issued, the pull request "
+                             "has additional commits (by a maintaner?)")
                 return response, False
 
             pr_number = response.number
-            if self.sha != commits[0].parent.sha:
+            if self.sha != parent_sha:
                 _LOGGER.debug(f"Found already existing  pull request #{pr_number} for old master "
-                              f"branch {commits[0].parent.sha[:7]!r} updating pull request based on "
+                              f"branch {parent_sha[:7]!r} updating pull request based on "
                               f"branch {branch_name!r} for the current master branch {self.sha[:7]!r}")
                 return response, True
             else:
@@ -269,24 +289,25 @@ class UpdateManager(ManagerBase):
         self.repo.index.commit(commit_msg)
         self.repo.remote().push(branch_name, force=force_push)
 
-    def _get_all_outdated(self, old_direct_dependencies: dict) -> dict:
-        """Get all outdated packages based on Pipfile.lock."""
-        new_direct_dependencies = self._get_direct_dependencies_version()
+    def _get_all_outdated(self, old_packages: typing.Dict[str, LockedPackage], old_direct_dependencies: dict) -> dict:
+        """Get all outdated direct dependencies based on difference of the old lock and the current Pipfile.lock."""
+        lock_diff = diff_locks(old_packages, self._load_pipfile_lock().packages)
+        _LOGGER.debug(f"Changes in the locked software stack: {lock_diff}")
 
         result = {}
-        for package_name in old_direct_dependencies.keys():
-            if old_direct_dependencies[package_name]['version'] \
-                    != new_direct_dependencies.get(package_name, {}).get('version'):
-                old_version = old_direct_dependencies[package_name]['version']
-                new_version = new_direct_dependencies.get(package_name, {}).get('version')
-                is_dev = old_direct_dependencies[package_name]['dev']
-
-                _LOGGER.debug(f"Found new update for {package_name}: {old_version} -> {new_version} (dev: {is_dev})")
-                result[package_name] = {
-                    'dev': is_dev,  # This should not change
-                    'old_version': old_version,
-                    'new_version': new_version
-                }
+        for change in chain(lock_diff.upgraded.values(), lock_diff.downgraded.values()):
+            if change.name not in old_direct_dependencies:
+                # Transitive dependencies are updated as a part of updates of direct dependencies.
+                continue
+
+            is_dev = old_direct_dependencies[change.name]['dev']
+            _LOGGER.debug(f"Found new update for {change.name}: {change.old_version} -> {change.new_version} "
+                          f"(dev: {is_dev})")
+            result[change.name] = {
+                'dev': is_dev,  # This should not change
+                'old_version': change.old_version,
+                'new_version': change.new_version
+            }
 
         return result
 
@@ -300,20 +321,27 @@ class UpdateManager(ManagerBase):
                 parts = line.split(' ; ', maxsplit=1)
                 requirements_file.write(parts[0])
 
-    def _create_update(self, dependency: str, package_version: str, old_version: str,
-                       is_dev: bool = False, labels: list = None, old_environment: dict = None,
-                       merge_request: MergeRequest = None, pipenv_used: bool = True,
-                       req_dev: bool = False) -> typing.Union[tuple, None]:
-        """Create an update for the given dependency when dependencies are managed by Pipenv.
+    def _lock_updates(self, updates: dict, pipenv_used: bool, req_dev: bool,
+                      old_environment: dict = None) -> typing.Tuple[list, LockDiff]:
+        """Lock the given updates, return files changed and changes done in the locked software stack.
 
-        The old environment is set to a non None value only if we are operating on requirements.{in,txt}. It keeps
-        information of packages that were present in the old environment so we can selectively change versions in the
-        already existing requirements.txt or add packages that were introduced as a transitive dependency.
+        Updates map names of the updated packages to a tuple - the new version and a flag set for development packages.
         """
-        cmd = f'pipenv install {dependency}=={package_version} --keep-outdated'
-        if is_dev:
-            cmd += ' --dev'
-        self.run_pipenv(cmd)
+        if old_environment:
+            old_packages = self._get_requirements_txt_packages(req_dev)
+        else:
+            old_packages = self._load_pipfile_lock().packages
+
+        for dev in (False, True):
+            packages = ' '.join(f'{name}=={version}' for name, (version, is_dev) in updates.items() if is_dev == dev)
+            if not packages:
+                continue
+
+            cmd = f'pipenv install {packages} --keep-outdated'
+            if dev:
+                cmd += ' --dev'
+            self.run_pipenv(cmd)
+
         if pipenv_used:
             # Discard changes by pipenv made in Pipfile (dependency lock) as it affects hashes computed for
             # Pipfile.lock. We don't do `pipenv update` as in some cases pipenv does not update dependencies at all.
@@ -321,25 +349,80 @@ class UpdateManager(ManagerBase):
         self.run_pipenv('pipenv lock --keep-outdated')
 
         if not old_environment:
-            merge_request = self._open_merge_request_update(
-                dependency, old_version, package_version, labels, ['Pipfile.lock'], merge_request
-            )
-            return old_version, package_version, merge_request.number
+            return ['Pipfile.lock'], diff_locks(old_packages, self._load_pipfile_lock().packages)
 
         # For either requirements.txt  or requirements-dev.text scenario we need to propagate all changes
         # (updates of transitive dependencies) into requirements.txt or requirements-dev file
         output_file = 'requirements-dev.txt' if req_dev else 'requirements.txt'
         self._pipenv_lock_requirements(output_file)
+        return [output_file], diff_locks(old_packages, self._get_requirements_txt_packages(req_dev))
+
+    def _create_update(self, dependency: str, package_version: str, old_version: str,
+                       is_dev: bool = False, labels: list = None, old_environment: dict = None,
+                       merge_request: MergeRequest = None, pipenv_used: bool = True,
+                       req_dev: bool = False) -> typing.Union[tuple, None]:
+        """Create an update for the given dependency when dependencies are managed by Pipenv.
+
+        The old environment is set to a non None value only if we are operating on requirements.{in,txt}. It keeps
+        information of packages that were present in the old environment so we can selectively change versions in the
+        already existing requirements.txt or add packages that were introduced as a transitive dependency.
+        """
+        files, lock_diff = self._lock_updates(
+            {dependency: (package_version, is_dev)}, pipenv_used, req_dev, old_environment
+        )
         merge_request = self._open_merge_request_update(
-            dependency, old_version, package_version, labels, [output_file], merge_request
+            dependency, old_version, package_version, labels, files, merge_request, lock_diff=lock_diff
         )
         return old_version, package_version, merge_request.number
 
-    @classmethod
-    def _replicate_old_environment(cls) -> None:
-        """Replicate old environment based on its specification - packages in specific versions."""
+    def _replicate_old_environment(self) -> None:
+        """Replicate old environment based on its specification - packages in specific versions.
+
+        The old environment is installed once and snapshotted, subsequent calls just restore the snapshot (also
+        in worktrees, which inherit snapshots taken before they were created).
+        """
+        venv_path = os.path.join(os.getcwd(), '.venv')
+        lock_digest = self._load_pipfile_lock().digest
+
+        if lock_digest in self._environment_snapshots:
+            _LOGGER.info("Restoring old environment from snapshot for incremental update")
+            snapshot_path, original_path = self._environment_snapshots[lock_digest]
+            shutil.rmtree(venv_path, ignore_errors=True)
+            copy_environment(snapshot_path, venv_path)
+            if original_path != venv_path:
+                relocate_environment(venv_path, original_path)
+            return
+
         _LOGGER.info("Replicating old environment for incremental update")
-        cls.run_pipenv('pipenv sync --dev')
+        self.run_pipenv('pipenv sync --dev')
+
+        if self._snapshots_dir and os.path.isdir(venv_path):
+            # Worktrees are updated in parallel processes, make sure their snapshots do not clash.
+            snapshot_path = os.path.join(self._snapshots_dir, f'{lock_digest}-{os.getpid()}')
+            shutil.rmtree(snapshot_path, ignore_errors=True)
+            copy_environment(venv_path, snapshot_path)
+            self._environment_snapshots[lock_digest] = (snapshot_path, venv_path)
+
+    @staticmethod
+    def _populate_local_index() -> None:
+        """Make sure packages needed for resolution are present in the local index, if one is configured."""
+        if not local_index.is_enabled():
+            return
+
+        if os.path.isfile('Pipfile.lock'):
+            local_index.populate_from_lock('Pipfile.lock')
+        elif os.path.isfile('Pipfile'):
+            pipfile = toml.load('Pipfile')
+            local_index.populate_from_requirements(
+                list(pipfile.get('packages', {}).keys()) + list(pipfile.get('dev-packages', {}).keys())
+            )
+        else:
+            requirements = []
+            for input_file in ('requirements.in', 'requirements-dev.in'):
+                if os.path.isfile(input_file):
+                    # Packages installed from URLs are not served by the index.
+                    requirements.extend(str(r) for r in iter_requirements(input_file) if r.name and not r.url)
+            local_index.populate_from_requirements(requirements)
 
     @classmethod
     def _create_pipenv_environment(cls, input_file: str) -> None:
@@ -371,7 +454,7 @@ class UpdateManager(ManagerBase):
             return False
 
         branch_name = "kebechet-initial-lock"
-        request = {mr for mr in self.sm.repository.merge_requests
+        request = {mr for mr in self.sm.merge_requests
                    if mr.head_branch_name == branch_name and mr.state in ('opened', 'open')}
 
         if req_dev and not pipenv_used:
@@ -389,14 +472,14 @@ class UpdateManager(ManagerBase):
             _LOGGER.info(f"Initial dependency lock present in PR #{request.number}")
         elif len(request) == 1:
             request = list(request)[0]
-            commits = request.commits
+            commit_count, parent_sha = self.sm.get_merge_request_commits(request)
 
-            if len(request.commits) != 1:
+            if commit_count != 1:
                 _LOGGER.info("There have been done changes in the original pull request (multiple commits found), "
                              "aborting doing changes to the adjusted opened pull request")
                 return False
 
-            if self.sha != commits[0].parent.sha:
+            if self.sha != parent_sha:
                 lock_func()
                 self._git_push(commit_msg, branch_name, files, force_push=True)
                 request.add_comment(f"Pull request has been rebased on top of the current master with SHA {self.sha}")
@@ -413,8 +496,51 @@ class UpdateManager(ManagerBase):
     def _pipenv_update_all(cls):
         """Update all dependencies to their latest version."""
         _LOGGER.info("Updating all dependencies to their latest version")
+        start = time.monotonic()
         cls.run_pipenv('pipenv update --dev')
         cls.run_pipenv('pipenv lock')
+        cls._update_all_durations.append(time.monotonic() - start)
+
+    def _is_update_all_needed(self, direct_dependencies_version: dict) -> bool:
+        """Check whether any direct dependency has a newer release on PyPI, so that a full re-lock is needed.
+
+        The check is conservative - if it cannot be performed (packages are not consumed from PyPI, pre-releases are
+        allowed, metadata are not available), a full re-lock is performed.
+        """
+        if local_index.is_enabled():
+            return True
+
+        try:
+            pipfile_content = toml.load('Pipfile')
+        except Exception as exc:
+            raise DependencyManagementError(f"Failed to load Pipfile: {str(exc)}") from exc
+
+        sources = pipfile_content.get('source') or [{'url': PYPI_SIMPLE_URL}]
+        if any(source.get('url', '').rstrip('/') != PYPI_SIMPLE_URL for source in sources):
+            _LOGGER.debug("Packages are not consumed solely from PyPI, not checking for outdated dependencies")
+            return True
+
+        if pipfile_content.get('pipenv', {}).get('allow_prereleases'):
+            return True
+
+        start = time.monotonic()
+        latest_versions = get_latest_versions(direct_dependencies_version.keys())
+        duration = time.monotonic() - start
+
+        for package_name, latest_version in latest_versions.items():
+            if latest_version is None or \
+                    parse_version(latest_version) > parse_version(direct_dependencies_version[package_name]['version']):
+                _LOGGER.debug(f"Check for outdated dependencies took {duration:.2f}s, {package_name} is outdated")
+                return True
+
+        if self._update_all_durations:
+            saved = sum(self._update_all_durations) / len(self._update_all_durations) - duration
+            _LOGGER.info(f"All direct dependencies are up to date, skipping full re-lock (check took {duration:.2f}s, "
+                         f"saved approximately {saved:.2f}s)")
+        else:
+            _LOGGER.info(f"All direct dependencies are up to date, skipping full re-lock (check took {duration:.2f}s)")
+
+        return False
 
     def _add_refresh_comment(self, exc: PipenvError, issue: Issue) -> typing.Optional[str]:
         """Create a refresh comment to an issue if the given master has some changes."""
@@ -457,28 +583,202 @@ class UpdateManager(ManagerBase):
         pr_id = self.sm.open_merge_request(commit_msg, branch_name, f"Fixes: #{issue.number}", labels)
         _LOGGER.info(f"Issued automatic dependency re-locking in PR #{pr_id} to fix issue #{issue.number}")
 
-    def _delete_old_branches(self, outdated: dict) -> None:
+    def _delete_old_branches(self, active_branches: set) -> None:
         """Delete old kebechet branches from the remote repository."""
-        branches = {
-            entry['name']
-            for entry in self.sm.list_branches()
-            if entry['name'].startswith('kebechet-')
-        }
-        for package_name, info in outdated.items():
-            # Do not remove active branches - branches we issued PRs in.
-            branch_name = self._construct_branch_name(package_name, info['new_version'])
-            try:
-                branches.remove(branch_name)
-            except KeyError:
-                # e.g. if there was an issue with PR opening.
-                pass
+        # Do not remove active branches - branches we issued PRs in.
+        branches = {entry['name'] for entry in self.sm.list_branches(prefix='kebechet-')} - active_branches
 
-        for branch_name in branches:
-            _LOGGER.debug(f"Deleting old branch {branch_name}")
+        _LOGGER.debug(f"Deleting old branches {branches}")
+        errors = self.sm.delete_branches(sorted(branches), concurrency=self._branch_delete_concurrency)
+        for branch_name, error in errors.items():
+            if error:
+                _LOGGER.error(f"Failed to delete inactive branch {branch_name}: {error}")
+
+    def _get_update_groups(self, outdated: dict) -> typing.Dict[str, typing.List[str]]:
+        """Assign outdated packages to groups updated together, based on configuration.
+
+        Only groups of at least two packages are returned, other packages are updated one by one.
+        """
+        groups = {}
+        if self._groups == 'all':
+            groups['all'] = list(outdated.keys())
+        elif self._groups == 'dev':
+            for package_name, info in outdated.items():
+                groups.setdefault('dev' if info['dev'] else 'default', []).append(package_name)
+        elif self._groups:
+            for package_name in outdated.keys():
+                for group_name, group_spec in self._groups.items():
+                    if isinstance(group_spec, frozenset):
+                        matches = package_name.lower() in group_spec
+                    else:
+                        matches = group_spec.fullmatch(package_name) is not None
+
+                    if matches:
+                        groups.setdefault(group_name, []).append(package_name)
+                        break
+
+        return {group_name: package_names for group_name, package_names in groups.items() if len(package_names) > 1}
+
+    @staticmethod
+    def _compile_update_groups(groups: typing.Union[str, dict, None]) -> typing.Union[str, dict, None]:
+        """Validate configured grouping of updates, compile regular expressions and normalize lists of packages."""
+        if groups is None or groups in ('all', 'dev'):
+            return groups
+
+        if not isinstance(groups, dict):
+            raise ConfigurationError(f"Unknown grouping of updates {groups!r}, expected 'all', 'dev' or a mapping "
+                                     f"of group names to regular expressions or lists of package names")
+
+        result = {}
+        for group_name, group_spec in groups.items():
+            if isinstance(group_spec, str):
+                try:
+                    result[group_name] = re.compile(group_spec, flags=re.IGNORECASE)
+                except re.error as exc:
+                    msg = f"Invalid regular expression {group_spec!r} for group {group_name!r}: {str(exc)}"
+                    raise ConfigurationError(msg) from exc
+            elif isinstance(group_spec, list) and all(isinstance(name, str) for name in group_spec):
+                result[group_name] = frozenset(name.lower() for name in group_spec)
+            else:
+                raise ConfigurationError(f"Invalid specification of group {group_name!r}: {group_spec!r}, expected "
+                                         f"a regular expression or a list of package names")
+
+        return result
+
+    @staticmethod
+    def _construct_group_branch_name(group_name: str, updates: dict) -> str:
+        """Construct branch name for updates of a group of packages, the name is unique for the given updates."""
+        digest = hashlib.sha256('\n'.join(
+            f"{package_name}=={update['new_version']}" for package_name, update in sorted(updates.items())
+        ).encode()).hexdigest()[:10]
+        group_name = re.sub(r'[^A-Za-z0-9_.-]', '-', group_name)
+        return f'kebechet-group-{group_name}-{digest}'
+
+    def _create_group_update(self, group_name: str, updates: dict, labels: list, pipenv_used: bool,
+                             req_dev: bool, old_environment: dict = None) -> typing.Tuple[dict, set]:
+        """Create a single update for a group of outdated packages, bisect the group if the combined lock fails.
+
+        Return versions of updated packages (as done for updates of single packages) and branches used for the group.
+        A failure to replicate the old environment is propagated as PipenvError.
+        """
+        if len(updates) == 1:
+            # Nothing to group, create an update the same way as if the package was not part of a group.
+            (package_name, update), = updates.items()
+            branch_name = self._construct_branch_name(package_name, update['new_version'])
+            merge_request, should_update = self._should_update_branch(branch_name)
+            if not should_update:
+                _LOGGER.info(f"Skipping update creation for {package_name} as the given update already "
+                             f"exists in PR #{merge_request.number}")
+                return {}, {branch_name}
+
+            self._replicate_old_environment()
             try:
-                self.sm.delete_branch(branch_name)
-            except Exception:
-                _LOGGER.exception(f"Failed to delete inactive branch {branch_name}")
+                versions = self._create_update(
+                    package_name, update['new_version'], update['old_version'], is_dev=update['dev'],
+                    labels=labels, old_environment=old_environment, merge_request=merge_request,
+                    pipenv_used=pipenv_used, req_dev=req_dev
+                )
+                return {package_name: versions}, {branch_name}
+            except Exception as exc:
+                _LOGGER.exception(f"Failed to create update for dependency {package_name}: {str(exc)}")
+                return {}, {branch_name}
+            finally:
+                self.repo.head.reset(index=True, working_tree=True)
+                self.repo.git.checkout('master')
+
+        branch_name = self._construct_group_branch_name(group_name, updates)
+        merge_request, should_update = self._should_update_branch(branch_name)
+        if not should_update:
+            _LOGGER.info(f"Skipping update creation for group {group_name!r} as the given update already "
+                         f"exists in PR #{merge_request.number}")
+            return {}, {branch_name}
+
+        self._replicate_old_environment()
+        _LOGGER.info(f"Creating update of dependencies in group {group_name!r} in repo {self.slug}: "
+                     f"{', '.join(sorted(updates))}")
+        try:
+            files, lock_diff = self._lock_updates(
+                {package_name: (update['new_version'], update['dev']) for package_name, update in updates.items()},
+                pipenv_used, req_dev, old_environment
+            )
+            commit_msg = f"Automatic update of dependencies in group {group_name}"
+            body = 'Dependencies updated together in this pull request:\n\n' + '\n'.join(
+                f"* {package_name} from {update['old_version']} to {update['new_version']}"
+                for package_name, update in sorted(updates.items())
+            ) + self._construct_lock_diff_body(lock_diff)
+            merge_request = self._push_merge_request(commit_msg, branch_name, body, labels, files, merge_request)
+        except PipenvError as exc:
+            _LOGGER.warning(f"Failed to lock updates of dependencies in group {group_name!r}, splitting the group: "
+                            f"{exc.stderr}")
+        except Exception as exc:
+            _LOGGER.exception(f"Failed to create update for dependencies in group {group_name!r}: {str(exc)}")
+            return {}, {branch_name}
+        else:
+            _LOGGER.info(f"Update of dependencies in group {group_name!r} is in PR #{merge_request.number}")
+            return {
+                package_name: (update['old_version'], update['new_version'], merge_request.number)
+                for package_name, update in updates.items()
+            }, {branch_name}
+        finally:
+            self.repo.head.reset(index=True, working_tree=True)
+            self.repo.git.checkout('master')
+
+        # Bisect the group - updates in one of the halves (or both) cannot be locked together.
+        result = {}
+        branches = set()
+        package_names = sorted(updates)
+        middle = len(package_names) // 2
+        for idx, part in enumerate((package_names[:middle], package_names[middle:]), start=1):
+            part_result, part_branches = self._create_group_update(
+                f'{group_name}-{idx}', {package_name: updates[package_name] for package_name in part},
+                labels, pipenv_used, req_dev, old_environment
+            )
+            result.update(part_result)
+            branches.update(part_branches)
+
+        return result, branches
+
+    def _create_update_in_worktree(self, item: tuple) -> typing.Union[tuple, None]:
+        """Create an update for the given dependency in a dedicated git worktree, run in a forked process."""
+        package_name, worktree_path, update_kwargs = item
+        os.chdir(worktree_path)
+        self.repo = git.Repo(worktree_path)
+        _LOGGER.info(f"Creating update of dependency {package_name} in repo {self.slug} "
+                     f"(devel: {update_kwargs['is_dev']}) in worktree {worktree_path}")
+        # Each worktree has its own virtual environment (pipenv keeps it in project).
+        self._replicate_old_environment()
+        return self._create_update(package_name, **update_kwargs)
+
+    def _create_updates_in_worktrees(self, to_update: dict) -> dict:
+        """Create updates for the given dependencies concurrently, each in its own git worktree of the cloned repo."""
+        _LOGGER.info(f"Creating {len(to_update)} updates using {self._parallelism} parallel workers")
+        items = []
+        try:
+            with TemporaryDirectory() as worktrees_dir:
+                for package_name, update_kwargs in to_update.items():
+                    worktree_path = os.path.join(worktrees_dir, package_name)
+                    self.repo.git.worktree('add', '--detach', worktree_path, 'HEAD')
+                    for file_name in ('Pipfile', 'Pipfile.lock'):
+                        # Pipfile and Pipfile.lock generated from requirements.in files are not tracked.
+                        if os.path.isfile(file_name) and not os.path.exists(os.path.join(worktree_path, file_name)):
+                            shutil.copy2(file_name, worktree_path)
+                    items.append((package_name, worktree_path, update_kwargs))
+
+                results = fork_map(self._create_update_in_worktree, items, jobs=self._parallelism)
+        finally:
+            # Worktrees were removed together with the temporary directory, remove also their metadata.
+            self.repo.git.worktree('prune')
+
+        result = {}
+
+        # Keep ordering of results deterministic - the same as ordering of outdated packages.
+        for (package_name, _, _), (versions, error) in zip(items, results):
+            if error:
+                _LOGGER.error(f"Failed to create update for dependency {package_name}: {error}")
+            elif versions:
+                result[package_name] = versions
+
+        return result
 
     def _do_update(self, labels: list, pipenv_used: bool = False, req_dev: bool = False) -> dict:
         """Update dependencies based on management used."""
@@ -512,10 +812,13 @@ class UpdateManager(ManagerBase):
         close_initial_lock_issue()
 
         if pipenv_used:
+            old_packages = self._load_pipfile_lock().packages
             old_environment = self._get_all_packages_versions()
             old_direct_dependencies_version = self._get_direct_dependencies_version()
+            update_all_needed = self._is_update_all_needed(old_direct_dependencies_version)
             try:
-                self._pipenv_update_all()
+                if update_all_needed:
+                    self._pipenv_update_all()
             except PipenvError as exc:
                 _LOGGER.warning("Failed to update dependencies to their latest version, reporting issue")
                 self.sm.open_issue_if_not_exist(
@@ -532,28 +835,41 @@ class UpdateManager(ManagerBase):
                 )
                 return {}
             else:
-                # We were able to update all, close reported issue if any.
-                self.sm.close_issue_if_exists(_ISSUE_UPDATE_ALL_NAME, comment=ISSUE_CLOSE_COMMENT.format(sha=self.sha))
+                # We were able to update all, close reported issue if any. If update all was skipped, nothing
+                # was verified so the reported issue is kept untouched.
+                if update_all_needed:
+                    self.sm.close_issue_if_exists(
+                        _ISSUE_UPDATE_ALL_NAME, comment=ISSUE_CLOSE_COMMENT.format(sha=self.sha)
+                    )
         else:  # either requirements.txt or requirements-dev.txt
-            old_environment = self._get_requirements_txt_dependencies(req_dev)
+            old_packages = self._get_requirements_txt_packages(req_dev)
+            old_environment = self._get_requirements_txt_dependencies(old_packages)
             direct_dependencies = self._get_direct_dependencies_requirements(req_dev)
             old_direct_dependencies_version = {k: v for k, v in old_environment.items() if k in direct_dependencies}
 
-        outdated = self._get_all_outdated(old_direct_dependencies_version)
+        outdated = self._get_all_outdated(old_packages, old_direct_dependencies_version)
         _LOGGER.info(f"Outdated: {outdated}")
 
         # Undo changes made to Pipfile.lock by _pipenv_update_all.
         self.repo.head.reset(index=True, working_tree=True)
 
-        result = {}
         if outdated:
             # Do API calls only once, cache results.
-            self._cached_merge_requests = self.sm.repository.merge_requests
+            self._cached_merge_requests = self.sm.merge_requests
 
+        groups = self._get_update_groups(outdated)
+        grouped = set(chain.from_iterable(groups.values()))
+        active_branches = set()
+
+        to_update = {}
         for package_name in outdated.keys():
+            if package_name in grouped:
+                continue
+
             # As an optimization, first check if the given PR is already present.
             new_version = outdated[package_name]['new_version']
             old_version = outdated[package_name]['old_version']
+            active_branches.add(self._construct_branch_name(package_name, new_version))
 
             merge_request, should_update = self._should_update(package_name, new_version)
             if not should_update:
@@ -561,35 +877,65 @@ class UpdateManager(ManagerBase):
                              f"{new_version} as the given update already exists in PR #{merge_request.number}")
                 continue
 
+            to_update[package_name] = dict(
+                package_version=new_version,
+                old_version=old_version,
+                is_dev=outdated[package_name]['dev'],
+                labels=labels,
+                old_environment=old_environment if not pipenv_used else None,
+                merge_request=merge_request,
+                pipenv_used=pipenv_used,
+                req_dev=req_dev
+            )
+
+        result = {}
+        if self._parallelism > 1 and len(to_update) > 1:
             try:
+                # Check the old environment can be replicated before spawning workers.
                 self._replicate_old_environment()
             except PipenvError as exc:
-                # There has been an error in locking dependencies. This can be due to a missing dependency or simply
-                # currently locked dependencies are not correct. Try to issue a pull request that would fix
-                # that. We know that update all works, use update.
                 _LOGGER.warning("Failed to replicate old environment, re-locking all dependencies")
                 self._relock_all(exc, labels)
                 return {}
 
-            is_dev = outdated[package_name]['dev']
+            result = self._create_updates_in_worktrees(to_update)
+        else:
+            for package_name, update_kwargs in to_update.items():
+                try:
+                    self._replicate_old_environment()
+                except PipenvError as exc:
+                    # There has been an error in locking dependencies. This can be due to a missing dependency or
+                    # simply currently locked dependencies are not correct. Try to issue a pull request that would
+                    # fix that. We know that update all works, use update.
+                    _LOGGER.warning("Failed to replicate old environment, re-locking all dependencies")
+                    self._relock_all(exc, labels)
+                    return {}
+
+                try:
+                    _LOGGER.info(f"Creating update of dependency {package_name} in repo {self.slug} "
+                                 f"(devel: {update_kwargs['is_dev']})")
+                    versions = self._create_update(package_name, **update_kwargs)
+                    if versions:
+                        result[package_name] = versions
+                except Exception as exc:
+                    _LOGGER.exception(f"Failed to create update for dependency {package_name}: {str(exc)}")
+                finally:
+                    self.repo.head.reset(index=True, working_tree=True)
+                    self.repo.git.checkout('master')
+
+        for group_name, package_names in groups.items():
             try:
-                _LOGGER.info(f"Creating update of dependency {package_name} in repo {self.slug} (devel: {is_dev})")
-                versions = self._create_update(
-                    package_name, new_version, old_version,
-                    is_dev=is_dev,
-                    labels=labels,
-                    old_environment=old_environment if not pipenv_used else None,
-                    merge_request=merge_request,
-                    pipenv_used=pipenv_used,
-                    req_dev=req_dev
+                group_result, group_branches = self._create_group_update(
+                    group_name, {package_name: outdated[package_name] for package_name in package_names},
+                    labels, pipenv_used, req_dev, old_environment if not pipenv_used else None
                 )
-                if versions:
-                    result[package_name] = versions
-            except Exception as exc:
-                _LOGGER.exception(f"Failed to create update for dependency {package_name}: {str(exc)}")
-            finally:
-                self.repo.head.reset(index=True, working_tree=True)
-                self.repo.git.checkout('master')
+            except PipenvError as exc:
+                _LOGGER.warning("Failed to replicate old environment, re-locking all dependencies")
+                self._relock_all(exc, labels)
+                return {}
+
+            result.update(group_result)
+            active_branches.update(group_branches)
 
         # We know that locking was done correctly - if the issue is still open, close it. The issue
         # should be automatically closed by merging the generated PR.
@@ -598,17 +944,28 @@ class UpdateManager(ManagerBase):
             comment=ISSUE_CLOSE_COMMENT.format(sha=self.sha)
         )
 
-        self._delete_old_branches(outdated)
+        self._delete_old_branches(active_branches)
         return result
 
-    def run(self, labels: list) -> typing.Optional[dict]:
-        """Create a pull request for each and every direct dependency in the given org/repo (slug)."""
+    def run(self, labels: list, branch_delete_concurrency: int = 4, parallelism: int = 1,
+            groups: typing.Union[str, dict] = None) -> typing.Optional[dict]:
+        """Create a pull request for each and every direct dependency in the given org/repo (slug).
+
+        If groups are configured, updates of packages in the same group are proposed in a single pull request.
+        """
+        # Configuration errors are reported before the repository is cloned and dependencies are resolved.
+        self._groups = self._compile_update_groups(groups)
+        self._branch_delete_concurrency = branch_delete_concurrency
+        self._parallelism = parallelism
         # We will keep venv in the project itself - we have permissions in the cloned repo.
         os.environ['PIPENV_VENV_IN_PROJECT'] = '1'
 
-        with cloned_repo(self.service_url, self.slug, depth=1) as repo:
+        with self.cloned_repo(depth=1) as repo, TemporaryDirectory() as snapshots_dir:
             # Make repo available in the instance.
             self.repo = repo
+            self._snapshots_dir = snapshots_dir
+            self._environment_snapshots = {}
+            self._populate_local_index()
 
             close_no_management_issue = partial(
                 self.sm.close_issue_if_exists,
@@ -27,7 +27,6 @@ import yaml
 import semver
 from datetime import datetime
 
-from kebechet.utils import cloned_repo
 from kebechet.managers.manager import ManagerBase
 
 
@@ -55,6 +54,9 @@ class VersionError(Exception):
 class VersionManager(ManagerBase):
     """Automatic version management for Python projects."""
 
+    # Release requests are waited for by maintainers.
+    priority = 10
+
     def _adjust_version_file(self, file_path: str, issue: Issue) -> typing.Optional[tuple]:
         """Adjust version in the given file, return signalizes whether the return value indicates change in file."""
         with open(file_path, 'r') as input_file:
@@ -219,7 +221,7 @@ class VersionManager(ManagerBase):
             labels: list = None, changelog_file: bool = False) -> None:
         """Check issues for new issue request, if a request exists, issue a new PR with adjusted version in sources."""
         reported_issues = []
-        for issue in self.sm.repository.issues:
+        for issue in self.sm.issues:
             issue_title = issue.title.strip()
 
             if issue_title.startswith((_NO_VERSION_FOUND_ISSUE_NAME, _MULTIPLE_VERSIONS_FOUND_ISSUE_NAME)):
@@ -235,7 +237,7 @@ class VersionManager(ManagerBase):
                 issue.number, issue.title
             )
 
-            with cloned_repo(self.service_url, self.slug) as repo:
+            with self.cloned_repo() as repo:
                 if assignees:
                     try:
                         self.sm.assign(issue, assignees)
@@ -245,12 +247,12 @@ class VersionManager(ManagerBase):
 
                 maintainers = maintainers or self._get_maintainers(labels)
                 if issue.author.username.lower() not in (m.lower() for m in maintainers):
-                    issue.add_comment(
+                    self.sm.close_issue(
+                        issue,
                         f"Sorry, @{issue.author.username} but you are not stated in maintainers section for "
                         f"this project. Maintainers are @" + ', @'.join(maintainers)
                         if maintainers else "Sorry, no maintainers configured."
                     )
-                    issue.close()
                     # Next issue.
                     continue
 
@@ -258,8 +260,7 @@ class VersionManager(ManagerBase):
                     version_identifier, old_version = self._adjust_version_in_sources(repo, labels, issue)
                 except VersionError as exc:
                     _LOGGER.exception("Failed to adjust version information in sources")
-                    issue.add_comment(str(exc))
-                    issue.close()
+                    self.sm.close_issue(issue, str(exc))
                     raise
 
                 if not version_identifier:
@@ -289,5 +290,4 @@ class VersionManager(ManagerBase):
                 )
 
         for reported_issue in reported_issues:
-            reported_issue.add_comment("Closing as this issue is no longer relevant.")
-            reported_issue.close()
+            self.sm.close_issue(reported_issue, "Closing as this issue is no longer relevant.")
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""A persistent cache of downloaded packages and built wheels shared by pip and pipenv across runs and repositories.
+
+Parallel workers use the cache concurrently (pip writes cache entries atomically). Eviction is done between jobs,
+it stops workers from starting new installations and waits for installations in progress to finish.
+"""
+
+import logging
+import os
+import re
+import tempfile
+import time
+import typing
+from contextlib import ExitStack
+from contextlib import contextmanager
+
+from .utils import file_lock
+
+_LOGGER = logging.getLogger(__name__)
+
+_CACHE_DIR = os.getenv('KEBECHET_PACKAGE_CACHE')
+# Size of the cache in MiB, least recently used files are evicted once the size is exceeded.
+_CACHE_SIZE = int(os.getenv('KEBECHET_PACKAGE_CACHE_SIZE', 4096))
+# Walking the whole cache is expensive, check cache size at most once per the given number of seconds.
+_EVICTION_INTERVAL = 600
+# Seconds eviction waits for installations in progress to finish, eviction is deferred afterwards.
+_EVICTION_WAIT = 60
+
+_STATS = {
+    'hits': 0,
+    'downloads': 0,
+}
+
+_LAST_EVICTION = {'time': None}
+
+# Lines logged by pip when a package is taken from its cache (HTTP cache or built wheel) or downloaded.
+_HIT_RE = re.compile(r'Using cached |Processing ' + re.escape(_CACHE_DIR) if _CACHE_DIR else r'Using cached ')
+_DOWNLOAD_RE = re.compile(r'Downloading ')
+
+
+def is_enabled() -> bool:
+    """Check whether the package cache was configured."""
+    return bool(_CACHE_DIR)
+
+
+def _get_lock_path() -> str:
+    """Get path to the lock file guarding the cache against eviction while used."""
+    return os.path.join(_CACHE_DIR, '.lock')
+
+
+def _get_gate_path() -> str:
+    """Get path to the lock file held by eviction to stop new installations from using the cache."""
+    return os.path.join(_CACHE_DIR, '.gate.lock')
+
+
+def _update_stats(log_path: str) -> None:
+    """Count cache hits and downloads based on the pip log."""
+    with open(log_path, 'r', errors='replace') as log_file:
+        for line in log_file:
+            if _HIT_RE.search(line):
+                _STATS['hits'] += 1
+            elif _DOWNLOAD_RE.search(line):
+                _STATS['downloads'] += 1
+
+
+def _evict_files() -> None:
+    """Evict least recently used files so that the cache fits into the configured size, the cache is not in use."""
+    files = []
+    for root, _, file_names in os.walk(_CACHE_DIR):
+        for file_name in file_names:
+            path = os.path.join(root, file_name)
+            if path in (_get_lock_path(), _get_gate_path()):
+                continue
+            try:
+                stat = os.lstat(path)
+            except FileNotFoundError:
+                continue
+            files.append((max(stat.st_atime, stat.st_mtime), path, stat.st_size))
+
+    total_size = sum(size for _, _, size in files)
+    for _, path, size in sorted(files):
+        if total_size <= _CACHE_SIZE * 1024 * 1024:
+            break
+
+        _LOGGER.debug("Evicting %r from package cache (%d bytes)", path, size)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+
+def evict() -> bool:
+    """Evict least recently used files if the cache size was not checked recently, return True if checked.
+
+    New installations wait until eviction is done, eviction waits for installations in progress to finish. If they
+    do not finish in time, eviction is deferred to the next call.
+    """
+    last_eviction = _LAST_EVICTION['time']
+    if not is_enabled() or not os.path.isdir(_CACHE_DIR) \
+            or (last_eviction is not None and time.monotonic() - last_eviction <= _EVICTION_INTERVAL):
+        return False
+
+    with file_lock(_get_gate_path()):
+        deadline = time.monotonic() + _EVICTION_WAIT
+        while True:
+            with file_lock(_get_lock_path(), blocking=False) as acquired:
+                if acquired:
+                    _evict_files()
+                    _LAST_EVICTION['time'] = time.monotonic()
+                    return True
+
+            if time.monotonic() > deadline:
+                _LOGGER.info("Package cache is still in use after %d seconds, deferring eviction", _EVICTION_WAIT)
+                return False
+
+            time.sleep(1)
+
+
+@contextmanager
+def environment() -> typing.Generator[typing.Optional[dict], None, None]:
+    """Get environment variables pointing pip and pipenv to the cache, yield None if the cache is not configured."""
+    if not is_enabled():
+        yield None
+        return
+
+    os.makedirs(_CACHE_DIR, exist_ok=True)
+    log_fd, log_path = tempfile.mkstemp(prefix='kebechet-pip-', suffix='.log')
+    os.close(log_fd)
+    try:
+        with ExitStack() as stack:
+            # The gate is held only while entering the cache so that a pending eviction is not starved.
+            with file_lock(_get_gate_path(), shared=True):
+                stack.enter_context(file_lock(_get_lock_path(), shared=True))
+            yield {
+                'PIP_CACHE_DIR': os.path.join(_CACHE_DIR, 'pip'),
+                'PIPENV_CACHE_DIR': os.path.join(_CACHE_DIR, 'pipenv'),
+                'PIP_LOG': log_path,
+            }
+        _update_stats(log_path)
+    finally:
+        os.remove(log_path)
+
+
+def get_stats() -> dict:
+    """Get statistics of cache usage in this process."""
+    return dict(_STATS)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Queries to PyPI JSON API for package metadata."""
+
+import logging
+import re
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .http_pool import get_session
+
+_LOGGER = logging.getLogger(__name__)
+
+PYPI_SIMPLE_URL = 'https://pypi.org/simple'
+_PYPI_JSON_URL = 'https://pypi.org/pypi/{package_name}/json'
+_PYPI_RELEASE_JSON_URL = 'https://pypi.org/pypi/{package_name}/{version}/json'
+
+# Latest versions of packages queried by this process, keyed by normalized package name.
+_LATEST_VERSIONS = {}
+# Requirements of released packages, keyed by normalized package name and version - releases are immutable.
+_REQUIRES_DIST = {}
+
+
+def normalize_package_name(package_name: str) -> str:
+    """Normalize package name as stated in PEP 503."""
+    return re.sub(r'[-_.]+', '-', package_name).lower()
+
+
+def get_latest_version(package_name: str) -> typing.Optional[str]:
+    """Get the latest version of the given package released on PyPI, None if it cannot be obtained."""
+    package_name = normalize_package_name(package_name)
+    if package_name in _LATEST_VERSIONS:
+        return _LATEST_VERSIONS[package_name]
+
+    url = _PYPI_JSON_URL.format(package_name=package_name)
+    try:
+        response = get_session(url).get(url)
+        response.raise_for_status()
+        version = response.json()['info']['version']
+    except (requests.RequestException, ValueError, KeyError) as exc:
+        _LOGGER.warning(f"Failed to obtain the latest version of {package_name!r} from PyPI: {str(exc)}")
+        # Do not cache failures, these can be transient.
+        return None
+
+    _LATEST_VERSIONS[package_name] = version
+    return version
+
+
+def get_latest_versions(package_names: typing.Iterable[str], concurrency: int = 8) -> typing.Dict[str, str]:
+    """Get the latest versions of the given packages, query PyPI concurrently."""
+    package_names = list(package_names)
+    with ThreadPoolExecutor(max_workers=max(min(concurrency, len(package_names)), 1)) as executor:
+        return dict(zip(package_names, executor.map(get_latest_version, package_names)))
+
+
+def get_requires_dist(package_name: str, version: str) -> typing.Optional[typing.List[str]]:
+    """Get requirements of the given package release as stated in its metadata, None if it cannot be obtained."""
+    key = (normalize_package_name(package_name), version)
+    if key in _REQUIRES_DIST:
+        return _REQUIRES_DIST[key]
+
+    url = _PYPI_RELEASE_JSON_URL.format(package_name=key[0], version=version)
+    try:
+        response = get_session(url).get(url)
+        response.raise_for_status()
+        # Packages with no requirements do not state requires_dist at all.
+        requires_dist = response.json()['info'].get('requires_dist') or []
+    except (requests.RequestException, ValueError, KeyError) as exc:
+        _LOGGER.warning(f"Failed to obtain metadata of {package_name!r} in version {version!r} from PyPI: {str(exc)}")
+        return None
+
+    _REQUIRES_DIST[key] = requires_dist
+    return requires_dist
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Track API rate limit budget per token and throttle requests so that the budget is not exhausted mid-run.
+
+The budget is read from rate limit headers sent by GitHub (``X-RateLimit-*``) and GitLab (``RateLimit-*``) and
+it is shared by all the processes using the same state file. Each process keeps budgets in memory and
+synchronizes them with the state file only once a budget changed considerably, periodically and on exit.
+Once the remaining budget drops below the
+throttling threshold, requests are spread evenly until the budget is reset. If only the reserve is left,
+requests wait for the reset.
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import typing
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from . import utils
+
+_LOGGER = logging.getLogger(__name__)
+
+_STATE_PATH = os.getenv(
+    'KEBECHET_RATE_LIMIT_STATE', os.path.join(tempfile.gettempdir(), f'kebechet-rate-limit-{os.getuid()}.json')
+)
+# Fraction of the budget below which requests are spread until the budget is reset.
+_THROTTLE_THRESHOLD = float(os.getenv('KEBECHET_RATE_LIMIT_THROTTLE', 0.2))
+# Number of requests kept in reserve, requests wait for the reset once only the reserve is left.
+_RESERVE = int(os.getenv('KEBECHET_RATE_LIMIT_RESERVE', 50))
+# Maximum number of seconds a request waits for the budget, the request is sent anyway afterwards.
+_MAX_WAIT = float(os.getenv('KEBECHET_RATE_LIMIT_MAX_WAIT', 900))
+# Seconds after which budgets are synchronized with the state file.
+_SYNC_INTERVAL = float(os.getenv('KEBECHET_RATE_LIMIT_SYNC_INTERVAL', 10))
+# Change of remaining budget (as a fraction of the limit) which is synchronized with the state file immediately.
+_SYNC_STEP = 0.05
+
+_STATS = {
+    'throttled_requests': 0,
+    'throttle_time': 0.0,
+}
+
+# Epoch seconds are sent by GitHub and GitLab, smaller values are seconds to reset (IETF draft headers).
+_EPOCH_THRESHOLD = 10 ** 9
+
+# Budgets known to this process, budgets as stored in the state file on the last synchronization
+# and keys of budgets changed since then.
+_BUDGETS = {}
+_SYNCED = {}
+_CHANGED = set()
+_LAST_SYNC = 0.0
+_LOCK = threading.Lock()
+
+
+def get_stats() -> dict:
+    """Get statistics of requests throttled by this process."""
+    return dict(_STATS)
+
+
+def _get_token(request: requests.PreparedRequest) -> typing.Optional[str]:
+    """Get token used to authenticate the request, if any."""
+    token = request.headers.get('Authorization') or request.headers.get('PRIVATE-TOKEN')
+    if token:
+        return token
+
+    query = parse_qs(urlparse(request.url).query)
+    for parameter in ('access_token', 'private_token'):
+        if parameter in query:
+            return query[parameter][0]
+
+    return None
+
+
+def _get_budget_key(request: requests.PreparedRequest, resource: str = None) -> str:
+    """Get key of the budget the request is counted against - host, digest of token and rate limit resource."""
+    token = _get_token(request)
+    token_digest = hashlib.sha256(token.encode()).hexdigest()[:12] if token else 'anonymous'
+    url = urlparse(request.url)
+    if resource is None:
+        # GitHub accounts GraphQL and search API calls separately.
+        resource = next((name for name in ('graphql', 'search') if url.path.startswith(f'/{name}')), 'core')
+
+    return f'{url.netloc}/{token_digest}/{resource}'
+
+
+def _load_state() -> dict:
+    """Load budgets stored in the state file."""
+    try:
+        with open(_STATE_PATH) as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _merge_budget(budget: dict, other: typing.Optional[dict]) -> dict:
+    """Merge two observations of the same budget - prefer the later window, the lower remaining within a window."""
+    if other is None or other['reset'] < budget['reset']:
+        return budget
+
+    if other['reset'] > budget['reset'] or other['remaining'] < budget['remaining']:
+        return other
+
+    return budget
+
+
+def _sync() -> None:
+    """Synchronize budgets of this process with the state file, called with the lock held."""
+    global _LAST_SYNC
+
+    with utils.file_lock(_STATE_PATH + '.lock'):
+        state = _load_state()
+        for key in _CHANGED:
+            state[key] = _merge_budget(_BUDGETS[key], state.get(key))
+
+        if _CHANGED:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(_STATE_PATH)))
+            with os.fdopen(fd, 'w') as tmp_file:
+                json.dump(state, tmp_file)
+            os.replace(tmp_path, _STATE_PATH)
+
+    for key, budget in state.items():
+        _BUDGETS[key] = _merge_budget(budget, _BUDGETS.get(key))
+    _SYNCED.clear()
+    _SYNCED.update(state)
+    _CHANGED.clear()
+    _LAST_SYNC = time.monotonic()
+
+
+def reset_after_fork() -> None:
+    """Create a new lock in a forked child, the lock could be held by another thread of the parent when forking."""
+    global _LOCK
+    _LOCK = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    # Python 3.7+, children forked by utils.fork_map reset the lock explicitly also on older versions.
+    os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def flush() -> None:
+    """Store budgets changed by this process to the state file so that other processes can see them."""
+    with _LOCK:
+        if _CHANGED:
+            _sync()
+
+
+def get_budgets() -> typing.Dict[str, dict]:
+    """Get budgets known (limit, remaining and reset time as epoch seconds) keyed by host, token digest and resource.
+
+    Budgets which were already reset are reported as fully available.
+    """
+    with _LOCK:
+        state = _load_state()
+        for key, budget in _BUDGETS.items():
+            state[key] = _merge_budget(budget, state.get(key))
+
+    result = {}
+    now = time.time()
+    for key, budget in state.items():
+        if budget['reset'] <= now:
+            budget = dict(budget, remaining=budget['limit'])
+        result[key] = budget
+
+    return result
+
+
+def get_host_budget(host: str) -> typing.Optional[float]:
+    """Get the lowest fraction of budget remaining across tokens used for the given service host."""
+    # GitHub serves its API on a separate host.
+    hosts = (host, f'api.{host}')
+    fractions = [
+        budget['remaining'] / budget['limit']
+        for key, budget in get_budgets().items()
+        if key.split('/', maxsplit=1)[0] in hosts and budget['limit']
+    ]
+    return min(fractions) if fractions else None
+
+
+def _update_budget(key: str, headers: CaseInsensitiveDict) -> None:
+    """Update budget based on rate limit headers of a response."""
+    prefix = 'X-RateLimit-' if 'X-RateLimit-Remaining' in headers else 'RateLimit-'
+    try:
+        limit = int(headers[prefix + 'Limit'])
+        remaining = int(headers[prefix + 'Remaining'])
+        reset = float(headers[prefix + 'Reset'])
+    except (KeyError, ValueError):
+        return
+
+    if reset < _EPOCH_THRESHOLD:
+        reset += time.time()
+
+    with _LOCK:
+        previous = _BUDGETS.get(key)
+        if previous and previous['reset'] == reset and previous['remaining'] < remaining:
+            # Responses of parallel requests can arrive out of order.
+            return
+
+        _BUDGETS[key] = {'limit': limit, 'remaining': remaining, 'reset': reset}
+        _CHANGED.add(key)
+
+        synced = _SYNCED.get(key)
+        if synced is None or synced['reset'] != reset or abs(synced['remaining'] - remaining) >= limit * _SYNC_STEP \
+                or time.monotonic() - _LAST_SYNC >= _SYNC_INTERVAL:
+            _sync()
+
+
+def _get_delay(budget: typing.Optional[dict]) -> float:
+    """Compute how long a request should wait so that the budget lasts until it is reset."""
+    if not budget:
+        return 0.0
+
+    time_to_reset = budget['reset'] - time.time()
+    if time_to_reset <= 0:
+        return 0.0
+
+    if budget['remaining'] <= _RESERVE:
+        return time_to_reset
+
+    if budget['remaining'] < budget['limit'] * _THROTTLE_THRESHOLD:
+        return time_to_reset / (budget['remaining'] - _RESERVE)
+
+    return 0.0
+
+
+def _throttled_send(original_send):
+    """Wrap send method of requests.Session to wait for budget and to track budget based on responses."""
+    def send(self, request, **kwargs):
+        key = _get_budget_key(request)
+        with _LOCK:
+            if time.monotonic() - _LAST_SYNC >= _SYNC_INTERVAL:
+                # Pick up budget consumed by other processes.
+                _sync()
+            budget = _BUDGETS.get(key)
+
+        delay = min(_get_delay(budget), _MAX_WAIT)
+        if delay > 0:
+            _STATS['throttled_requests'] += 1
+            _STATS['throttle_time'] += delay
+            log = _LOGGER.warning if delay > 60 else _LOGGER.debug
+            log("Rate limit budget for %r is low, waiting %.2f seconds before sending the request", key, delay)
+            time.sleep(delay)
+
+        response = original_send(self, request, **kwargs)
+        resource = response.headers.get('X-RateLimit-Resource')
+        _update_budget(_get_budget_key(request, resource) if resource else key, response.headers)
+        return response
+
+    send.kebechet_throttled = True
+    return send
+
+
+def install() -> None:
+    """Plug budget tracking and throttling into requests.Session."""
+    if getattr(requests.Session.send, 'kebechet_throttled', False):
+        return
+
+    requests.Session.send = _throttled_send(requests.Session.send)
+    atexit.register(flush)
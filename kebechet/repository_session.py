@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""State shared across all managers run on a single repository."""
+
+import logging
+import os
+import typing
+from contextlib import ExitStack
+from contextlib import contextmanager
+
+from .enums import ServiceType
+from .source_management import SourceManagement
+from .utils import cloned_repo
+from .utils import cwd
+from .utils import get_remote_head
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class RepositorySession:
+    """Clone a repository once and share the clone and SourceManagement across managers.
+
+    Each manager asking for the cloned repository is given a clean checkout of the current master.
+    """
+
+    def __init__(self, slug: str, service_type: ServiceType, service_url: str, token: str):
+        """Initialize a session for the given repository, nothing is cloned until a manager asks for it."""
+        self.slug = slug
+        self.service_type = service_type
+        self.service_url = service_url
+        self.token = token
+        self._sm = None
+        self._repo = None
+        self._shallow = False
+        self._remote_head = None
+        self._exit_stack = ExitStack()
+
+    def __enter__(self):
+        """Enter the session context."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Remove the cloned repository, if any."""
+        self.close()
+
+    def close(self) -> None:
+        """Remove the cloned repository, if any."""
+        self._exit_stack.close()
+        self._repo = None
+
+    @property
+    def sm(self) -> SourceManagement:
+        """Get SourceManagement shared across managers.
+
+        IGitt global context has to be initialized for the given service before the first access.
+        """
+        if self._sm is None:
+            self._sm = SourceManagement(self.service_type, self.service_url, self.token, self.slug)
+
+        return self._sm
+
+    @property
+    def remote_head(self) -> typing.Optional[str]:
+        """Get commit SHA of master in the remote repository, queried once per session without cloning."""
+        if self._remote_head is None:
+            self._remote_head = get_remote_head(self.service_url, self.slug)
+
+        return self._remote_head
+
+    def _reset(self) -> None:
+        """Bring the cloned repository to a clean state of master as cloned."""
+        _LOGGER.debug("Resetting cloned repository %r to a clean checkout of master", self.slug)
+        self._repo.git.checkout('-f', 'master')
+        self._repo.git.reset('--hard', 'origin/master')
+        self._repo.git.clean('-xdff')
+        for head in self._repo.heads:
+            if head.name != 'master':
+                self._repo.delete_head(head, force=True)
+
+    @contextmanager
+    def cloned_repo(self, **clone_kwargs):
+        """Get a clean checkout of the repository and cd into it, clone the repository on first use."""
+        if self._repo is None:
+            self._repo = self._exit_stack.enter_context(cloned_repo(self.service_url, self.slug, **clone_kwargs))
+            self._shallow = os.path.isfile(os.path.join(self._repo.git_dir, 'shallow'))
+        else:
+            self._reset()
+            if self._shallow and not clone_kwargs.get('depth'):
+                _LOGGER.debug("Fetching full history of %r", self.slug)
+                self._repo.git.fetch('--unshallow', 'origin')
+                self._shallow = False
+
+        with cwd(self._repo.working_tree_dir):
+            yield self._repo
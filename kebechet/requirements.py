@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""A streaming parser of pip requirement files (requirements.in, requirements.txt)."""
+
+import logging
+import os
+import re
+import typing
+
+_LOGGER = logging.getLogger(__name__)
+
+# Comments start at the beginning of the line or after a whitespace (URLs can contain #).
+_RE_COMMENT = re.compile(r'(^|\s+)#.*$')
+_RE_HASH = re.compile(r'\s*--hash[=\s]\s*(\S+)')
+# Only exact version matching pins a requirement, wildcards (==1.0.*) state a range of versions.
+_RE_PINNED = re.compile(r'^===?\s*(?P<version>[^\s,*;]+)$')
+_RE_EGG = re.compile(r'#egg=([A-Za-z0-9][A-Za-z0-9._-]*)')
+_RE_REQUIREMENT = re.compile(
+    r'^(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)\s*'
+    r'(\[(?P<extras>[^\]]*)\])?\s*'
+    r'((?P<specifier>[^;@]*)|@\s*(?P<url>[^;\s]+))\s*'
+    r'(;\s*(?P<markers>.*))?$'
+)
+_INCLUDE_OPTIONS = ('-r', '--requirement')
+_EDITABLE_OPTIONS = ('-e', '--editable')
+
+
+class Requirement:
+    """A single requirement stated in a requirement file."""
+
+    __slots__ = ('name', 'extras', 'specifier', 'url', 'markers', 'hashes', 'editable', 'source', 'line_number')
+
+    def __init__(self, name: typing.Optional[str], extras: tuple = (), specifier: str = '', url: str = None,
+                 markers: str = None, hashes: tuple = (), editable: bool = False, source: str = None,
+                 line_number: int = None):
+        """Initialize requirement, name can be None for URLs not stating the project name."""
+        self.name = name
+        self.extras = extras
+        self.specifier = specifier
+        self.url = url
+        self.markers = markers
+        self.hashes = hashes
+        self.editable = editable
+        self.source = source
+        self.line_number = line_number
+
+    @property
+    def pinned_version(self) -> typing.Optional[str]:
+        """Get version if the requirement is pinned down to a single version, None for any other specifier."""
+        match = _RE_PINNED.match(self.specifier.strip())
+        return match.group('version') if match else None
+
+    def __str__(self):
+        """Get requirement in a normalized form, as accepted by pip."""
+        if self.editable:
+            return f'-e {self.url}'
+
+        if self.name is None:
+            return self.url
+
+        result = self.name
+        if self.extras:
+            result += f"[{','.join(self.extras)}]"
+        result += f' @ {self.url}' if self.url else self.specifier
+        if self.markers:
+            result += f'; {self.markers}'
+
+        return result
+
+    def __repr__(self):
+        """Represent requirement."""
+        return f'{self.__class__.__name__}({str(self)!r})'
+
+
+def _iter_logical_lines(lines: typing.Iterable[str]) -> typing.Iterator[typing.Tuple[int, str]]:
+    """Join continued lines and strip comments, yield line number of the first physical line and the logical line."""
+    parts = []
+    start = None
+    for line_number, line in enumerate(lines, start=1):
+        line = line.rstrip('\r\n')
+        if start is None:
+            start = line_number
+
+        if line.endswith('\\') and not _RE_COMMENT.search(line):
+            parts.append(line[:-1])
+            continue
+
+        parts.append(line)
+        logical_line = _RE_COMMENT.sub('', ' '.join(parts)).strip()
+        if logical_line:
+            yield start, logical_line
+        parts = []
+        start = None
+
+    if parts:
+        logical_line = _RE_COMMENT.sub('', ' '.join(parts)).strip()
+        if logical_line:
+            yield start, logical_line
+
+
+def parse_requirement(line: str, source: str = None, line_number: int = None) -> Requirement:
+    """Parse a single requirement line (without options other than --hash), raise ValueError if not valid."""
+    hashes = tuple(_RE_HASH.findall(line))
+    line = _RE_HASH.sub('', line).strip()
+
+    editable = False
+    for option in _EDITABLE_OPTIONS:
+        if line.startswith(option + ' ') or line.startswith(option + '='):
+            editable = True
+            line = line[len(option) + 1:].strip()
+            break
+
+    if editable or '://' in line.split(';', maxsplit=1)[0].split('@', maxsplit=1)[0] or line.startswith(('.', '/')):
+        # A plain URL or path, the project name can be stated in the egg fragment.
+        url, _, markers = line.partition(';')
+        egg = _RE_EGG.search(url)
+        return Requirement(
+            egg.group(1) if egg else None, url=url.strip(), markers=markers.strip() or None, hashes=hashes,
+            editable=editable, source=source, line_number=line_number
+        )
+
+    match = _RE_REQUIREMENT.match(line)
+    if not match:
+        raise ValueError(f"Failed to parse requirement {line!r} ({source or '<string>'}:{line_number})")
+
+    extras = tuple(extra.strip() for extra in (match.group('extras') or '').split(',') if extra.strip())
+    return Requirement(
+        match.group('name'),
+        extras=extras,
+        specifier=re.sub(r'\s+', '', match.group('specifier') or ''),
+        url=match.group('url'),
+        markers=(match.group('markers') or '').strip() or None,
+        hashes=hashes,
+        source=source,
+        line_number=line_number
+    )
+
+
+def _parse_lines(lines: typing.Iterable[str], source: str, seen: set) -> typing.Iterator[Requirement]:
+    """Parse requirements from the given lines, follow included requirement files."""
+    for line_number, line in _iter_logical_lines(lines):
+        if line.startswith('-') and not line.startswith(_EDITABLE_OPTIONS):
+            option, _, value = line.replace('=', ' ', 1).partition(' ')
+            if option in _INCLUDE_OPTIONS and source:
+                yield from iter_requirements(os.path.join(os.path.dirname(source), value.strip()), _seen=seen)
+            elif option in _INCLUDE_OPTIONS:
+                _LOGGER.warning("Cannot include requirements file %r, the base file is not known", value.strip())
+            else:
+                # Other options - index configuration, constraints, ...
+                _LOGGER.debug("Skipping option in requirements %r: %r", source, line)
+            continue
+
+        yield parse_requirement(line, source=source, line_number=line_number)
+
+
+def iter_requirements(path: str, _seen: set = None) -> typing.Iterator[Requirement]:
+    """Iterate over requirements stated in the given requirement file, including files included using -r."""
+    seen = _seen if _seen is not None else set()
+    real_path = os.path.realpath(path)
+    if real_path in seen:
+        _LOGGER.warning("Requirements file %r was already included, skipping it", path)
+        return
+    seen.add(real_path)
+
+    with open(path, 'r') as requirements_file:
+        yield from _parse_lines(requirements_file, path, seen)
+
+
+def parse_requirements(content: str) -> typing.Iterator[Requirement]:
+    """Parse requirements given as a string, requirement files included using -r cannot be followed."""
+    return _parse_lines(content.splitlines(), None, set())
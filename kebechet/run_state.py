@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""A persistent store of successful manager runs used to skip runs which would not do anything new.
+
+A run of a manager is recorded together with the master commit and configuration it was run with. The next run
+of the same manager is skipped if neither master nor configuration changed and the record is not older than
+the time to live of the manager.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+import typing
+
+import kebechet
+from .utils import get_sqlite_connection
+
+_LOGGER = logging.getLogger(__name__)
+
+_STATE_DB = os.getenv('KEBECHET_STATE_DB')
+
+_STATS = {
+    'skipped': 0,
+    'recorded': 0,
+}
+
+
+def is_enabled() -> bool:
+    """Check whether the run state store was configured."""
+    return bool(_STATE_DB)
+
+
+def get_stats() -> dict:
+    """Get statistics of manager runs skipped and recorded by this process."""
+    return dict(_STATS)
+
+
+def _get_connection() -> sqlite3.Connection:
+    """Get connection to the state database, create the database if needed."""
+    return get_sqlite_connection(
+        _STATE_DB,
+        'CREATE TABLE IF NOT EXISTS runs ('
+        'service_url TEXT, slug TEXT, manager TEXT, head_sha TEXT, config_hash TEXT, finished REAL, '
+        'PRIMARY KEY (service_url, slug, manager))'
+    )
+
+
+def get_config_hash(manager_name: str, configuration: dict) -> str:
+    """Compute digest of manager configuration, a new Kebechet release invalidates all the recorded runs."""
+    return hashlib.sha256(json.dumps(
+        {'manager': manager_name, 'configuration': configuration, 'version': kebechet.__version__},
+        sort_keys=True,
+        default=str
+    ).encode()).hexdigest()
+
+
+def is_up_to_date(service_url: str, slug: str, manager_name: str, head_sha: str, config_hash: str,
+                  ttl: typing.Optional[float]) -> bool:
+    """Check whether the manager was already successfully run for the given master and configuration.
+
+    Records older than ttl seconds are not considered, records never expire if ttl is None.
+    """
+    row = _get_connection().execute(
+        'SELECT head_sha, config_hash, finished FROM runs WHERE service_url = ? AND slug = ? AND manager = ?',
+        (service_url, slug, manager_name)
+    ).fetchone()
+    if row is None or row[0] != head_sha or row[1] != config_hash:
+        return False
+
+    if ttl is not None and time.time() - row[2] > ttl:
+        _LOGGER.debug("Run of manager %r for %r is older than %d seconds", manager_name, slug, ttl)
+        return False
+
+    _STATS['skipped'] += 1
+    return True
+
+
+def record(service_url: str, slug: str, manager_name: str, head_sha: str, config_hash: str) -> None:
+    """Record a successful run of the manager."""
+    _get_connection().execute(
+        'INSERT OR REPLACE INTO runs (service_url, slug, manager, head_sha, config_hash, finished) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        (service_url, slug, manager_name, head_sha, config_hash, time.time())
+    )
+    _STATS['recorded'] += 1
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""A scheduler of manager runs on repositories respecting manager priorities and limits per service host.
+
+All the managers run on a repository form a single job so they share the cloned repository, managers are run
+in the order of their priority. Jobs with the highest priority (lowest number of their most important manager)
+are started first, service hosts with fewer jobs running (and served less recently) are preferred among jobs of
+the same priority. Each job runs in its own forked process which is killed once it exceeds the job timeout.
+"""
+
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import tempfile
+import threading
+import time
+import typing
+from collections import Counter
+
+from . import package_cache
+from . import rate_limit
+from .utils import get_repository_key
+from .utils import run_forked
+
+_LOGGER = logging.getLogger(__name__)
+
+# Maximum number of jobs running against a single service host, defaults to the number of parallel jobs.
+_HOST_CONCURRENCY = int(os.getenv('KEBECHET_HOST_CONCURRENCY', 0))
+# Timeout in seconds for a single job.
+_JOB_TIMEOUT = float(os.getenv('KEBECHET_JOB_TIMEOUT', 3600))
+# A file where jobs not finished yet are stored so that an interrupted run can be resumed.
+_QUEUE_PATH = os.getenv('KEBECHET_QUEUE_PATH')
+# Seconds given to a job to terminate gracefully once it exceeded its timeout.
+_KILL_GRACE_PERIOD = 10
+# Fraction of rate limit budget below which jobs for other service hosts are preferred.
+_LOW_BUDGET = 0.1
+# Seconds to wait for a job to finish before checking for new and timed out jobs.
+_POLL_INTERVAL = 1.0
+
+
+class Job:
+    """Run of managers on a repository, the repository is referenced by its position in the configuration."""
+
+    __slots__ = ('entry_index', 'manager_names', 'priority', 'host', 'sequence')
+
+    def __init__(self, entry_index: int, manager_names: typing.List[str], priority: int, host: str, sequence: int):
+        """Initialize a job, sequence orders jobs of the same priority in the order they were added."""
+        self.entry_index = entry_index
+        self.manager_names = manager_names
+        self.priority = priority
+        self.host = host
+        self.sequence = sequence
+
+    def to_dict(self) -> dict:
+        """Convert job to a dictionary so that it can be persisted."""
+        return {
+            'entry_index': self.entry_index,
+            'manager_names': self.manager_names,
+            'priority': self.priority,
+            'host': self.host,
+        }
+
+    def __repr__(self):
+        """Represent the job."""
+        return f'{self.__class__.__name__}({self.entry_index!r}, {self.manager_names!r}, priority={self.priority!r})'
+
+
+class Scheduler:
+    """Run jobs in forked processes, at most the given number of jobs at a time."""
+
+    def __init__(self, entries: typing.List[tuple], run_entry: typing.Callable, get_priority: typing.Callable,
+                 jobs: int = 1, host_concurrency: int = None, timeout: float = None, queue_path: str = None,
+                 on_finished: typing.Callable = None):
+        """Initialize scheduler for the given configuration entries.
+
+        The run_entry callable is called with a configuration entry restricted to managers of the job,
+        get_priority gives priority of a manager based on its name and on_finished is called with the job,
+        its result and a formatted error (if any) once a job finishes.
+        """
+        self._entries = entries
+        self._run_entry = run_entry
+        self._get_priority = get_priority
+        self._jobs = max(jobs, 1)
+        self._host_concurrency = host_concurrency or _HOST_CONCURRENCY or self._jobs
+        self._timeout = timeout if timeout is not None else _JOB_TIMEOUT
+        self._queue_path = queue_path if queue_path is not None else _QUEUE_PATH
+        self._on_finished = on_finished
+        self._digest = hashlib.sha256(json.dumps(entries, sort_keys=True, default=str).encode()).hexdigest()
+        self._context = multiprocessing.get_context('fork')
+        self._pending = []
+        self._running = {}
+        self._host_served = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def get_managers(self, entry_index: int) -> typing.List[dict]:
+        """Get managers configured for the given repository."""
+        return self._entries[entry_index][0]
+
+    def pending_count(self) -> int:
+        """Get number of jobs waiting to be started."""
+        return len(self._pending)
+
+    def _persist(self) -> None:
+        """Store jobs not finished yet, jobs running are run again if the run is interrupted."""
+        if not self._queue_path:
+            return
+
+        jobs = [job.to_dict() for job, _, _ in self._running.values()] + [job.to_dict() for job in self._pending]
+        directory = os.path.dirname(os.path.abspath(self._queue_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as tmp_file:
+            json.dump({'digest': self._digest, 'jobs': jobs}, tmp_file)
+        os.replace(tmp_path, self._queue_path)
+
+    def resume(self) -> bool:
+        """Load jobs not finished by a previous run of the same configuration, return True if any were loaded."""
+        if not self._queue_path or not os.path.isfile(self._queue_path):
+            return False
+
+        try:
+            with open(self._queue_path) as queue_file:
+                content = json.load(queue_file)
+        except ValueError as exc:
+            _LOGGER.warning(f"Failed to load persisted queue {self._queue_path!r}, ignoring it: {str(exc)}")
+            return False
+
+        if content.get('digest') != self._digest:
+            _LOGGER.info("Configuration changed since the persisted queue was stored, not resuming")
+            return False
+
+        with self._lock:
+            for job in content.get('jobs', []):
+                self._pending.append(Job(
+                    job['entry_index'], job['manager_names'], job['priority'], job['host'], next(self._sequence)
+                ))
+
+        _LOGGER.info("Resuming interrupted run, %d jobs left", len(self._pending))
+        return bool(self._pending)
+
+    def add(self, entry_index: int, manager_names: typing.Iterable[str] = None) -> None:
+        """Add a job running the given managers (all configured if not given), merge it with a job still waiting."""
+        managers, slug, service_type, service_url, *_ = self._entries[entry_index]
+        configured = [manager.get('name') for manager in managers]
+        manager_names = set(manager_names) if manager_names is not None else set(configured)
+
+        with self._lock:
+            job = next((job for job in self._pending if job.entry_index == entry_index), None)
+            if job is not None:
+                manager_names.update(job.manager_names)
+                self._pending.remove(job)
+
+            # Managers are run in the order of their priority, managers of the same priority as configured.
+            names = sorted((name for name in configured if name in manager_names), key=self._get_priority)
+            if names:
+                host = get_repository_key(service_type, service_url, slug)[0]
+                sequence = job.sequence if job is not None else next(self._sequence)
+                self._pending.append(Job(entry_index, names, self._get_priority(names[0]), host, sequence))
+
+            self._persist()
+
+    def _next_job(self) -> typing.Optional[Job]:
+        """Pick a job to be started next, respecting priorities and limits per service host."""
+        running_hosts = Counter(job.host for job, _, _ in self._running.values())
+        running_entries = {job.entry_index for job, _, _ in self._running.values()}
+        candidates = [
+            job for job in self._pending
+            if running_hosts[job.host] < self._host_concurrency and job.entry_index not in running_entries
+        ]
+        if not candidates:
+            return None
+
+        # Work against hosts with rate limit budget running low is postponed so the budget can recover.
+        low_budget = set()
+        for host in {job.host for job in candidates}:
+            budget = rate_limit.get_host_budget(host)
+            if budget is not None and budget < _LOW_BUDGET:
+                low_budget.add(host)
+
+        job = min(candidates, key=lambda job: (
+            job.host in low_budget,
+            job.priority,
+            running_hosts[job.host],
+            self._host_served.get(job.host, 0.0),
+            job.sequence
+        ))
+        self._pending.remove(job)
+        return job
+
+    def _start(self, job: Job) -> None:
+        """Start the given job in a forked process."""
+        managers, *configuration = self._entries[job.entry_index]
+        entry = (
+            sorted(
+                (manager for manager in managers if manager.get('name') in job.manager_names),
+                key=lambda manager: job.manager_names.index(manager.get('name'))
+            ),
+            *configuration
+        )
+        _LOGGER.info("Running managers %s for %r (priority %d)", job.manager_names, configuration[0], job.priority)
+
+        reader, writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=run_forked, args=(self._run_entry, entry, writer))
+        process.start()
+        writer.close()
+        self._running[reader] = (job, process, time.monotonic())
+        self._host_served[job.host] = time.monotonic()
+
+    def _finish(self, reader, result: typing.Any, error: typing.Optional[str]) -> None:
+        """Mark the job as finished and report its result."""
+        with self._lock:
+            job, process, _ = self._running.pop(reader)
+            self._persist()
+
+        reader.close()
+        process.join()
+
+        try:
+            package_cache.evict()
+        except Exception:
+            _LOGGER.exception("Failed to evict files from package cache")
+
+        if error:
+            _LOGGER.error(f"Failed to process repository {self._entries[job.entry_index][1]!r}: {error}")
+
+        if self._on_finished:
+            self._on_finished(job, result, error)
+
+    def _collect(self, reader) -> None:
+        """Collect result of a job which finished."""
+        job, process, _ = self._running[reader]
+        try:
+            result, error = reader.recv()
+        except EOFError:
+            # The child died without reporting anything back (e.g. killed by OOM killer).
+            process.join()
+            result, error = None, f"Worker process exited unexpectedly with exit code {process.exitcode}"
+
+        self._finish(reader, result, error)
+
+    def _stop_timed_out(self) -> None:
+        """Kill jobs running longer than the job timeout."""
+        now = time.monotonic()
+        for reader, (job, process, started) in list(self._running.items()):
+            if now - started <= self._timeout:
+                continue
+
+            _LOGGER.warning("Job %r exceeded timeout of %.0f seconds, terminating it", job, self._timeout)
+            process.terminate()
+            process.join(_KILL_GRACE_PERIOD)
+            if process.is_alive():
+                # Process.kill() is available only on Python 3.7+.
+                os.kill(process.pid, signal.SIGKILL)
+            self._finish(reader, None, f"Job was killed after exceeding timeout of {self._timeout} seconds")
+
+    def step(self) -> None:
+        """Start jobs if there are free slots and wait for jobs to finish for at most the poll interval."""
+        with self._lock:
+            while len(self._running) < self._jobs:
+                job = self._next_job()
+                if job is None:
+                    break
+                self._start(job)
+
+        if not self._running:
+            time.sleep(_POLL_INTERVAL)
+            return
+
+        for reader in multiprocessing.connection.wait(list(self._running), timeout=_POLL_INTERVAL):
+            self._collect(reader)
+
+        self._stop_timed_out()
+
+    def run(self) -> None:
+        """Run all the jobs added, the persisted queue is removed once all the jobs are finished."""
+        while self._pending or self._running:
+            self.step()
+
+        if self._queue_path and os.path.isfile(self._queue_path):
+            os.remove(self._queue_path)
+
+    def serve(self, stop: threading.Event) -> None:
+        """Run jobs as they are added until stopped, jobs running are finished, jobs waiting stay persisted."""
+        while not stop.is_set() or self._running:
+            if stop.is_set():
+                # Do not start new jobs.
+                for reader in multiprocessing.connection.wait(list(self._running), timeout=_POLL_INTERVAL):
+                    self._collect(reader)
+                self._stop_timed_out()
+            else:
+                self.step()
@@ -18,29 +18,48 @@
 """Abstract calls to GitHub and GitLab APIs."""
 
 import logging
+import threading
 import typing
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
 from urllib.parse import quote_plus
 
+import requests
+
 from IGitt.Interfaces import Issue
 from IGitt.Interfaces import MergeRequest
 from IGitt.GitHub.GitHubRepository import GitHubRepository
+from IGitt.GitHub.GitHubIssue import GitHubIssue
 from IGitt.GitHub.GitHubUser import GitHubUser
 from IGitt.GitHub import GitHubToken
 from IGitt.GitHub.GitHubMergeRequest import GitHubMergeRequest
+from IGitt.GitLab.GitLabIssue import GitLabIssue
 from IGitt.GitLab.GitLabMergeRequest import GitLabMergeRequest
 from IGitt.GitLab.GitLabRepository import GitLabRepository
 from IGitt.GitLab import GitLabPrivateToken
 from IGitt.GitLab.GitLabUser import GitLabUser
+import IGitt.GitHub
 import IGitt.GitLab
 
+from . import github_snapshot
 from .enums import ServiceType
+from .exception import SnapshotError
+from .http_pool import get_session
 
 
 _LOGGER = logging.getLogger(__name__)
 
 
+def _is_rate_limited(response: requests.Response) -> bool:
+    """Check whether the given response signalizes API rate limit was exceeded (GitHub or GitLab)."""
+    if response is None or response.status_code not in (403, 429):
+        return False
+
+    return response.headers.get('X-RateLimit-Remaining') == '0' \
+        or response.headers.get('RateLimit-Remaining') == '0' \
+        or 'Retry-After' in response.headers
+
+
 class SourceManagement:
     """Abstract source code management services like GitHub and GitLab."""
 
@@ -54,6 +73,11 @@ class SourceManagement:
         self.slug = slug
         self.service_url = service_url
         self.token = token
+        # Open issues and their index by title, lazily populated.
+        self._issues = None
+        self._issue_index = None
+        # Snapshot of the GitHub repository state, lazily obtained, False if it cannot be obtained.
+        self._snapshot = None
 
         if self.service_type == ServiceType.GITHUB:
             self.repository = GitHubRepository(token=GitHubToken(token), repository=slug)
@@ -62,13 +86,78 @@ class SourceManagement:
         else:
             raise NotImplementedError
 
+    def _get_snapshot(self) -> typing.Optional[github_snapshot.GitHubSnapshot]:
+        """Get snapshot of open issues, pull requests and Kebechet branches, None if not available (GitLab)."""
+        if self.service_type != ServiceType.GITHUB or self._snapshot is False:
+            return None
+
+        if self._snapshot is None:
+            try:
+                self._snapshot = github_snapshot.get_snapshot(self.token, self.slug)
+            except (SnapshotError, requests.RequestException) as exc:
+                _LOGGER.warning(
+                    f"Failed to obtain snapshot of {self.slug} using GraphQL API, falling back to REST API: {str(exc)}"
+                )
+                self._snapshot = False
+                return None
+
+        return self._snapshot
+
+    def invalidate_snapshot(self) -> None:
+        """Drop snapshot of the repository state, a new snapshot is obtained on next access."""
+        if self._snapshot is not False:
+            self._snapshot = None
+
+    def _list_issues(self) -> typing.List[Issue]:
+        """List all open issues, issue objects are created from listing so no additional calls are needed."""
+        if self.service_type == ServiceType.GITHUB:
+            token = GitHubToken(self.token)
+            snapshot = self._get_snapshot()
+            if snapshot:
+                return [GitHubIssue.from_data(entry, token, self.slug, entry['number']) for entry in snapshot.issues]
+
+            return [
+                GitHubIssue.from_data(entry, token, self.slug, entry['number'])
+                for entry in IGitt.GitHub.get(token, f'/repos/{self.slug}/issues', {'state': 'open', 'per_page': 100})
+            ]
+        elif self.service_type == ServiceType.GITLAB:
+            token = GitLabPrivateToken(self.token)
+            return [
+                GitLabIssue.from_data(entry, token, self.slug, entry['iid'])
+                for entry in IGitt.GitLab.get(
+                    token, f'/projects/{quote_plus(self.slug)}/issues', {'state': 'opened', 'per_page': 100}
+                )
+            ]
+        else:
+            raise NotImplementedError
+
+    def _get_issue_index(self) -> typing.Dict[str, Issue]:
+        """Get index of open issues by their title, build it on first access."""
+        if self._issue_index is None:
+            self._issues = self._list_issues()
+            self._issue_index = {}
+            for issue in self._issues:
+                # Keep the first one as listed, the same way as a linear scan would.
+                self._issue_index.setdefault(issue.title, issue)
+            _LOGGER.debug(f"Indexed {len(self._issues)} open issues in {self.slug}")
+
+        return self._issue_index
+
+    def invalidate_issue_index(self) -> None:
+        """Drop index of open issues, the index is built again on next access."""
+        self._issues = None
+        self._issue_index = None
+        self.invalidate_snapshot()
+
+    @property
+    def issues(self) -> typing.List[Issue]:
+        """Get all open issues."""
+        self._get_issue_index()
+        return list(self._issues)
+
     def get_issue(self, title: str) -> Issue:
         """Retrieve issue with the given title."""
-        for issue in self.repository.issues:
-            if issue.title == title:
-                return issue
-
-        return None
+        return self._get_issue_index().get(title)
 
     def open_issue_if_not_exist(self, title: str, body: typing.Callable,
                                 refresh_comment: typing.Callable = None, labels: list = None) -> Issue:
@@ -90,24 +179,64 @@ class SourceManagement:
             issue = self.repository.create_issue(title, body())
             issue.labels = set(labels or [])
             _LOGGER.info(f"Reported issue {title!r} with id #{issue.number}")
+            self._issues.append(issue)
+            self._issue_index[title] = issue
             return issue
 
         return None
 
-    def close_issue_if_exists(self, title: str, comment: str = None):
-        """Close the given issue (referenced by its title) and close it with a comment."""
+    @property
+    def merge_requests(self) -> typing.Set[MergeRequest]:
+        """Get all open merge requests."""
+        snapshot = self._get_snapshot()
+        if snapshot:
+            token = GitHubToken(self.token)
+            return {
+                GitHubMergeRequest.from_data(entry, token, self.slug, entry['number'])
+                for entry in snapshot.pull_requests
+            }
+
+        return self.repository.merge_requests
+
+    def get_merge_request_commits(self, merge_request: MergeRequest) -> typing.Tuple[int, typing.Optional[str]]:
+        """Get number of commits in the given open merge request and SHA of parent of its first commit."""
+        snapshot = self._get_snapshot()
+        if snapshot and merge_request.number in snapshot.pull_request_infos:
+            info = snapshot.pull_request_infos[merge_request.number]
+            return info.commit_count, info.parent_sha
+
+        commits = merge_request.commits
+        return len(commits), commits[0].parent.sha if commits else None
+
+    def close_issue(self, issue: Issue, comment: str = None) -> None:
+        """Close the given issue, optionally with a comment."""
+        if comment:
+            issue.add_comment(comment)
+        issue.close()
+
+        if self._issue_index is not None:
+            self._issues = [item for item in self._issues if item.number != issue.number]
+            # Another issue with the same title could be still opened.
+            self._issue_index = {}
+            for item in self._issues:
+                self._issue_index.setdefault(item.title, item)
+
+    def close_issue_if_exists(self, title: str, comment: typing.Union[str, typing.Callable] = None):
+        """Close the given issue (referenced by its title) and close it with a comment.
+
+        The comment can be given as a callable so that it is rendered only if the issue exists.
+        """
         issue = self.get_issue(title)
         if not issue:
             _LOGGER.debug(f"Issue {title!r} not found, not closing it")
             return
 
-        issue.add_comment(comment)
-        issue.close()
+        self.close_issue(issue, comment() if callable(comment) else comment)
 
-    def _github_open_merge_request(self, commit_msg, body, branch_name) -> GitHubMergeRequest:
+    def _github_open_merge_request(self, commit_msg, body, branch_name, labels) -> GitHubMergeRequest:
         """Create a GitHub pull request with the given dependency update."""
         url = f'{IGitt.GitHub.BASE_URL}/repos/{self.slug}/pulls'
-        response = requests.Session().post(
+        response = get_session(url).post(
             url,
             headers={
                 'Accept': 'application/vnd.github.v3+json',
@@ -128,6 +257,12 @@ class SourceManagement:
 
         mr_number = response.json()['number']
         _LOGGER.info(f"Newly created pull request #{mr_number} available at {response.json()['html_url']}")
+        if self._snapshot:
+            # Record the pull request (with labels assigned to it) instead of obtaining a new snapshot.
+            self._snapshot.add_pull_request(
+                dict(response.json(), labels=[{'name': label} for label in sorted(labels or [])])
+            )
+
         return GitHubMergeRequest.from_data(
             response.json(), token=GitHubToken(self.token), repository=self.slug, number=mr_number
         )
@@ -135,7 +270,7 @@ class SourceManagement:
     def _gitlab_open_merge_request(self, commit_msg, body, branch_name) -> GitLabMergeRequest:
         url = f'{IGitt.GitLab.BASE_URL}/projects/{quote_plus(self.slug)}/merge_requests'
         # Use Session as these calls are mocked based on tls_verify configuration.
-        response = requests.Session().post(
+        response = get_session(url).post(
             url,
             params={'private_token': self.token},
             json={
@@ -171,7 +306,7 @@ class SourceManagement:
     def open_merge_request(self, commit_msg: str, branch_name: str, body: str, labels: list) -> MergeRequest:
         """Open a merge request for the given branch."""
         if self.service_type == ServiceType.GITHUB:
-            merge_request = self._github_open_merge_request(commit_msg, body, branch_name)
+            merge_request = self._github_open_merge_request(commit_msg, body, branch_name, labels)
         elif self.service_type == ServiceType.GITLAB:
             merge_request = self._gitlab_open_merge_request(commit_msg, body, branch_name)
         else:
@@ -182,8 +317,9 @@ class SourceManagement:
 
     def _github_delete_branch(self, branch: str) -> None:
         """Delete the given branch from remote repository."""
-        response = requests.Session().delete(
-            f'{IGitt.GitHub.BASE_URL}/repos/{self.slug}/git/refs/heads/{branch}',
+        url = f'{IGitt.GitHub.BASE_URL}/repos/{self.slug}/git/refs/heads/{branch}'
+        response = get_session(url).delete(
+            url,
             headers={f'Authorization': f'token {self.token}'},
         )
 
@@ -192,49 +328,116 @@ class SourceManagement:
 
     def _gitlab_delete_branch(self, branch: str) -> None:
         """Delete the given branch from remote repository."""
-        response = requests.Session().delete(
-            f'{IGitt.GitLab.BASE_URL}/projects/{quote_plus(self.slug)}/repository/branches/{branch}',
+        url = f'{IGitt.GitLab.BASE_URL}/projects/{quote_plus(self.slug)}/repository/branches/{branch}'
+        response = get_session(url).delete(
+            url,
             params={'private_token': self.token},
         )
         response.raise_for_status()
 
-    def _github_list_branches(self) -> typing.Set[str]:
-        """Get listing of all branches available on the remote GitHub repository."""
-        response = requests.Session().get(
-            f'{IGitt.GitHub.BASE_URL}/repos/{self.slug}/branches',
-            headers={f'Authorization': f'token {self.token}'},
-        )
-
-        response.raise_for_status()
-        # TODO: pagination?
-        return response.json()
+    @staticmethod
+    def _paginate(url: str, params: dict = None, headers: dict = None) -> typing.Iterator[dict]:
+        """Iterate over all entries of a paginated listing, pages are fetched lazily one by one.
 
-    def _gitlab_list_branches(self) -> typing.Set[str]:
-        """Get listing of all branches available on the remote GitLab repository."""
-        response = requests.Session().get(
-            f"{IGitt.GitLab.BASE_URL}/projects/{quote_plus(self.slug)}/repository/branches",
-            params={'private_token': self.token},
-        )
+        GitLab states next page in X-Next-Page header, GitHub provides a complete URL to the next page in Link header.
+        """
+        params = dict(params or {})
+        params['per_page'] = 100
+        session = get_session(url)
+        while url:
+            response = session.get(url, params=params, headers=headers)
+            response.raise_for_status()
+            yield from response.json()
 
-        response.raise_for_status()
-        # TODO: pagination?
-        return response.json()
+            if 'X-Next-Page' in response.headers:
+                next_page = response.headers['X-Next-Page']
+                if not next_page:
+                    break
+                params['page'] = next_page
+            else:
+                url = response.links.get('next', {}).get('url')
+                # The next URL already carries all the query parameters needed.
+                params = None
 
-    def list_branches(self) -> set:
-        """Get branches available on remote."""
+    def _github_list_branches(self, prefix: str = None) -> typing.Iterator[dict]:
+        """Get listing of all branches available on the remote GitHub repository."""
+        headers = {f'Authorization': f'token {self.token}'}
+        if prefix:
+            url = f'{IGitt.GitHub.BASE_URL}/repos/{self.slug}/git/matching-refs/heads/{prefix}'
+            try:
+                for entry in self._paginate(url, headers=headers):
+                    yield {'name': entry['ref'][len('refs/heads/'):]}
+                return
+            except requests.HTTPError as exc:
+                if exc.response is None or exc.response.status_code != 404:
+                    raise
+                # Older GitHub Enterprise instances do not provide matching refs endpoint.
+                _LOGGER.debug("Matching refs not available, filtering branches on client side")
+
+        url = f'{IGitt.GitHub.BASE_URL}/repos/{self.slug}/branches'
+        for entry in self._paginate(url, headers=headers):
+            if not prefix or entry['name'].startswith(prefix):
+                yield entry
+
+    def _gitlab_list_branches(self, prefix: str = None) -> typing.Iterator[dict]:
+        """Get listing of all branches available on the remote GitLab repository."""
+        url = f"{IGitt.GitLab.BASE_URL}/projects/{quote_plus(self.slug)}/repository/branches"
+        params = {'private_token': self.token}
+        if prefix:
+            # Search matches also in the middle of branch names.
+            params['search'] = prefix
+
+        for entry in self._paginate(url, params=params):
+            if not prefix or entry['name'].startswith(prefix):
+                yield entry
+
+    def list_branches(self, prefix: str = None) -> typing.Iterator[dict]:
+        """Iterate over branches available on remote, optionally only over branches with the given prefix."""
         # TODO: remove this logic once IGitt will support branch operations
         if self.service_type == ServiceType.GITHUB:
-            return self._github_list_branches()
+            snapshot = self._get_snapshot() if prefix and prefix.startswith(github_snapshot.BRANCH_PREFIX) else None
+            if snapshot:
+                return iter([{'name': branch} for branch in snapshot.branches if branch.startswith(prefix)])
+            return self._github_list_branches(prefix)
         elif self.service_type == ServiceType.GITLAB:
-            return self._gitlab_list_branches()
+            return self._gitlab_list_branches(prefix)
         else:
             raise NotImplementedError
 
+    def delete_branches(self, branch_names: typing.Iterable[str], concurrency: int = 4) -> typing.Dict[str, str]:
+        """Delete the given branches from remote concurrently, return errors (None on success) for each branch.
+
+        Once the remote reports the rate limit was exceeded, deletion of remaining branches is skipped.
+        """
+        rate_limited = threading.Event()
+
+        def delete(branch_name: str) -> typing.Optional[str]:
+            if rate_limited.is_set():
+                return "Skipped, API rate limit exceeded"
+
+            try:
+                self.delete_branch(branch_name)
+            except requests.HTTPError as exc:
+                if _is_rate_limited(exc.response):
+                    rate_limited.set()
+                return str(exc)
+            except Exception as exc:
+                return str(exc)
+
+            return None
+
+        branch_names = list(branch_names)
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+            return dict(zip(branch_names, executor.map(delete, branch_names)))
+
     def delete_branch(self, branch_name: str) -> None:
         """Delete the given branch from remote."""
         # TODO: remove this logic once IGitt will support branch operations
         if self.service_type == ServiceType.GITHUB:
-            return self._github_delete_branch(branch_name)
+            self._github_delete_branch(branch_name)
+            if self._snapshot:
+                self._snapshot.remove_branch(branch_name)
+            return None
         elif self.service_type == ServiceType.GITLAB:
             return self._gitlab_delete_branch(branch_name)
         else:
@@ -18,18 +18,41 @@
 """Just some utility methods."""
 
 
+import fcntl
 import os
 import logging
+import shutil
+import signal
+import sqlite3
+import multiprocessing
+import multiprocessing.connection
+import subprocess
+import time
+import traceback
+import typing
+from collections import deque
+from contextlib import ExitStack
 from contextlib import contextmanager
 from tempfile import TemporaryDirectory
 from urllib.parse import urljoin
+from urllib.parse import urlparse
 
 import git
 
+from . import clone_cache
+from . import http_pool
+from . import rate_limit
 from .enums import ServiceType
 
 _LOGGER = logging.getLogger(__name__)
 
+# Seconds given to forked children to terminate gracefully (and to stop commands they run) before they are killed.
+_KILL_GRACE_PERIOD = 10
+
+# Connections to SQLite databases keyed by process id and database path, connections cannot be shared with forked
+# processes.
+_SQLITE_CONNECTIONS = {}
+
 
 @contextmanager
 def cwd(path: str):
@@ -43,8 +66,74 @@ def cwd(path: str):
 
 
 @contextmanager
-def cloned_repo(service_url: str, slug: str, **clone_kwargs):
-    """Clone the given Git repository and cd into it."""
+def file_lock(lock_path: str, shared: bool = False, blocking: bool = True):
+    """Acquire a lock on the given lock file, yield whether the lock was acquired."""
+    with open(lock_path, 'a') as lock_file:
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+
+        try:
+            fcntl.flock(lock_file, flags)
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_sqlite_connection(path: str, schema: str) -> sqlite3.Connection:
+    """Get connection of this process to the given SQLite database, create the database with given schema if needed.
+
+    The connection can be used by multiple threads, callers serialize access to it if needed.
+    """
+    pid = os.getpid()
+    connection = _SQLITE_CONNECTIONS.get((pid, path))
+    if connection is None:
+        # Drop connections inherited from the parent process.
+        for key in [key for key in _SQLITE_CONNECTIONS if key[0] != pid]:
+            del _SQLITE_CONNECTIONS[key]
+
+        connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        # Write-ahead log lets parallel workers read while one of them writes.
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(schema)
+        _SQLITE_CONNECTIONS[(pid, path)] = connection
+
+    return connection
+
+
+def copy_environment(source: str, destination: str) -> None:
+    """Copy virtual environment, use copy-on-write clone of files if supported by the filesystem."""
+    try:
+        subprocess.run(['cp', '-a', '--reflink=auto', source, destination], check=True, stderr=subprocess.PIPE)
+    except (OSError, subprocess.CalledProcessError) as exc:
+        _LOGGER.debug(f"Failed to copy virtual environment using cp, falling back to copytree: {str(exc)}")
+        shutil.rmtree(destination, ignore_errors=True)
+        shutil.copytree(source, destination, symlinks=True)
+
+
+def relocate_environment(venv_path: str, original_path: str) -> None:
+    """Rewrite absolute paths to the original location in scripts of a virtual environment restored elsewhere."""
+    bin_path = os.path.join(venv_path, 'bin')
+    for file_name in os.listdir(bin_path):
+        file_path = os.path.join(bin_path, file_name)
+        if os.path.islink(file_path) or not os.path.isfile(file_path):
+            continue
+
+        with open(file_path, 'rb') as script_file:
+            content = script_file.read()
+
+        if original_path.encode() in content:
+            with open(file_path, 'wb') as script_file:
+                script_file.write(content.replace(original_path.encode(), venv_path.encode()))
+
+
+def get_repo_url(service_url: str, slug: str) -> str:
+    """Get URL of the given Git repository used for cloning and pushing."""
     if service_url.startswith('https://'):
         service_url = service_url[len('https://'):]
     elif service_url.startswith('http://'):
@@ -53,10 +142,54 @@ def cloned_repo(service_url: str, slug: str, **clone_kwargs):
         # This is mostly internal error - we require service URL to have protocol explicitly set
         raise NotImplementedError
 
-    repo_url = f'git@{service_url}:{slug}.git'
-    with TemporaryDirectory() as repo_path, cwd(repo_path):
-        _LOGGER.info(f"Cloning repository {repo_url} to {repo_path}")
-        repo = git.Repo.clone_from(repo_url, repo_path, branch='master', **clone_kwargs)
+    return f'git@{service_url}:{slug}.git'
+
+
+def get_repository_key(service_type: typing.Optional[str], service_url: typing.Optional[str], slug: str) -> tuple:
+    """Get key identifying a configured repository - service host and slug (as stated in webhooks)."""
+    if service_url:
+        host = urlparse(service_url).netloc
+    elif ServiceType.by_name(service_type) == ServiceType.GITLAB:
+        host = 'gitlab.com'
+    else:
+        host = 'github.com'
+
+    return host.lower(), slug.lower()
+
+
+def get_remote_head(service_url: str, slug: str, timeout: int = 60) -> typing.Optional[str]:
+    """Get commit SHA of master in the given Git repository without cloning it, None if it cannot be obtained."""
+    repo_url = get_repo_url(service_url, slug)
+    try:
+        result = subprocess.run(
+            ['git', 'ls-remote', repo_url, 'refs/heads/master'],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout, check=True
+        )
+    except (OSError, subprocess.SubprocessError) as exc:
+        _LOGGER.warning(f"Failed to obtain master of {repo_url}: {str(exc)}")
+        return None
+
+    output = result.stdout.decode().split()
+    return output[0] if output else None
+
+
+@contextmanager
+def cloned_repo(service_url: str, slug: str, **clone_kwargs):
+    """Clone the given Git repository and cd into it."""
+    repo_url = get_repo_url(service_url, slug)
+    with TemporaryDirectory() as repo_path, cwd(repo_path), ExitStack() as stack:
+        if clone_cache.is_enabled():
+            mirror_path = stack.enter_context(clone_cache.mirror(repo_url))
+            _LOGGER.info(f"Cloning repository {repo_url} from mirror {mirror_path} to {repo_path}")
+            # Shallow clones are not supported for local clones, shared clones are cheap anyway.
+            clone_kwargs.pop('depth', None)
+            repo = git.Repo.clone_from(mirror_path, repo_path, branch='master', shared=True, **clone_kwargs)
+            # Push directly to the remote repository, not to the mirror.
+            repo.git.remote('set-url', 'origin', repo_url)
+        else:
+            _LOGGER.info(f"Cloning repository {repo_url} to {repo_path}")
+            repo = git.Repo.clone_from(repo_url, repo_path, branch='master', **clone_kwargs)
+
         repo.config_writer().set_value(
             'user', 'name', os.getenv('KEBECHET_GIT_NAME', 'Kebechet')
         ).release()
@@ -79,3 +212,84 @@ def construct_raw_file_url(service_url: str, slug: str, file_name: str,
         raise NotImplementedError
 
     return url
+
+
+def run_forked(func: typing.Callable, item: typing.Any, writer) -> None:
+    """Run the given function in a forked child and send its result (or a formatted exception) to parent.
+
+    This is a target for processes forked by fork_map and by the scheduler, writer is the child end of a pipe.
+    """
+    # Termination interrupts the child so that commands it runs (in their own sessions) are killed as well.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    # Connections opened by parent cannot be shared.
+    http_pool.reset()
+    rate_limit.reset_after_fork()
+    try:
+        writer.send((func(item), None))
+    except Exception:
+        writer.send((None, traceback.format_exc()))
+    finally:
+        writer.close()
+        # Forked children exit without running exit handlers.
+        rate_limit.flush()
+
+
+def fork_map(func: typing.Callable, items: typing.Iterable, jobs: int) -> typing.List[tuple]:
+    """Call func on each item in a separate forked process, keep at most jobs processes running at a time.
+
+    A fresh process is used for each item so any global state (IGitt globals, patched requests methods,
+    current working directory) does not leak between items. Results are returned in the order of items
+    as (result, error) tuples, where error is a formatted traceback if the call failed. Results have to be
+    picklable.
+
+    If the caller is interrupted (or any error occurs), processes still running are terminated.
+    """
+    context = multiprocessing.get_context('fork')
+    pending = deque(enumerate(items))
+    results = [None] * len(pending)
+    running = {}
+
+    try:
+        while pending or running:
+            while pending and len(running) < max(jobs, 1):
+                idx, item = pending.popleft()
+                reader, writer = context.Pipe(duplex=False)
+                process = context.Process(target=run_forked, args=(func, item, writer))
+                process.start()
+                writer.close()
+                running[reader] = (idx, process)
+
+            for reader in multiprocessing.connection.wait(list(running.keys())):
+                idx, process = running.pop(reader)
+                try:
+                    results[idx] = reader.recv()
+                except EOFError:
+                    # The child died without reporting anything back (e.g. killed by OOM killer).
+                    process.join()
+                    results[idx] = None, f"Worker process exited unexpectedly with exit code {process.exitcode}"
+                finally:
+                    reader.close()
+
+                process.join()
+    except BaseException:
+        _terminate_processes([process for _, process in running.values()])
+        for reader in running:
+            reader.close()
+        raise
+
+    return results
+
+
+def _terminate_processes(processes: typing.List[multiprocessing.Process]) -> None:
+    """Terminate the given processes, kill those which do not terminate in the grace period."""
+    for process in processes:
+        process.terminate()
+
+    deadline = time.monotonic() + _KILL_GRACE_PERIOD
+    for process in processes:
+        process.join(max(deadline - time.monotonic(), 0))
+        if process.is_alive():
+            _LOGGER.warning("Worker process %d did not terminate in time, killing it", process.pid)
+            # Process.kill() is available only on Python 3.7+.
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
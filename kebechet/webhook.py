@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""An HTTP endpoint accepting GitHub and GitLab webhooks, managers affected by an event are scheduled to run."""
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import signal
+import threading
+import typing
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse
+
+from . import rate_limit
+from .scheduler import Scheduler
+from .utils import get_repository_key
+
+_LOGGER = logging.getLogger(__name__)
+
+_SECRET = os.getenv('KEBECHET_WEBHOOK_SECRET')
+
+# Events (as named by GitHub and GitLab) and managers reacting to them.
+_EVENT_MANAGERS = {
+    'issues': ('version', 'info'),
+    'Issue Hook': ('version', 'info'),
+    'push': ('update', 'pipfile-requirements'),
+    'Push Hook': ('update', 'pipfile-requirements'),
+}
+
+
+def _verify_signature(headers, body: bytes) -> bool:
+    """Verify the webhook was sent by the service, using the configured shared secret."""
+    if not _SECRET:
+        return True
+
+    if 'X-Gitlab-Token' in headers:
+        return hmac.compare_digest(headers['X-Gitlab-Token'], _SECRET)
+
+    for header, algorithm in (('X-Hub-Signature-256', 'sha256'), ('X-Hub-Signature', 'sha1')):
+        if header in headers:
+            expected = algorithm + '=' + hmac.new(_SECRET.encode(), body, getattr(hashlib, algorithm)).hexdigest()
+            return hmac.compare_digest(headers[header], expected)
+
+    return False
+
+
+def _get_event_repository_key(payload: dict) -> typing.Optional[tuple]:
+    """Get key of the repository the event is about."""
+    if 'project' in payload:
+        # GitLab.
+        project = payload['project']
+        return urlparse(project.get('web_url', '')).netloc.lower(), project.get('path_with_namespace', '').lower()
+
+    if 'repository' in payload:
+        repository = payload['repository']
+        return urlparse(repository.get('html_url', '')).netloc.lower(), repository.get('full_name', '').lower()
+
+    return None
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    """Handle webhooks sent by GitHub or GitLab."""
+
+    def _respond(self, status: int, content: dict) -> None:
+        """Send a JSON response."""
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """Report the server is alive, used for liveness and readiness probes."""
+        self._respond(200, {
+            'status': 'ok',
+            'queued': self.server.scheduler.pending_count(),
+            'rate_limit': rate_limit.get_budgets(),
+        })
+
+    def do_POST(self):
+        """Enqueue managers affected by the event."""
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            content_length = -1
+
+        if content_length < 0:
+            # Reading a negative length would block until the client closes the connection.
+            self._respond(400, {'error': 'Invalid Content-Length header'})
+            return
+
+        body = self.rfile.read(content_length)
+        if not _verify_signature(self.headers, body):
+            _LOGGER.warning("Rejecting webhook with invalid signature from %s", self.client_address[0])
+            self._respond(401, {'error': 'Invalid signature'})
+            return
+
+        event = self.headers.get('X-GitHub-Event') or self.headers.get('X-Gitlab-Event')
+        try:
+            payload = json.loads(body.decode())
+        except ValueError:
+            payload = None
+
+        if not isinstance(payload, dict):
+            self._respond(400, {'error': 'Invalid payload'})
+            return
+
+        if event == 'ping':
+            self._respond(200, {'enqueued': []})
+            return
+
+        manager_names = set(_EVENT_MANAGERS.get(event, ()))
+        if event in ('push', 'Push Hook') and payload.get('ref') != 'refs/heads/master':
+            manager_names = set()
+
+        repository_key = _get_event_repository_key(payload)
+        entry_index = self.server.entries.get(repository_key)
+        if entry_index is None:
+            manager_names = set()
+        else:
+            manager_names &= {manager.get('name') for manager in self.server.scheduler.get_managers(entry_index)}
+
+        if manager_names:
+            _LOGGER.info("Scheduling managers %s for %r on %r event", sorted(manager_names), repository_key, event)
+            self.server.scheduler.add(entry_index, manager_names)
+        else:
+            _LOGGER.debug("No manager to run for %r on %r event", repository_key, event)
+
+        self._respond(202, {'enqueued': sorted(manager_names)})
+
+    def log_message(self, format, *args):
+        """Log requests using Kebechet logging."""
+        _LOGGER.debug("%s - %s", self.client_address[0], format % args)
+
+
+class _WebhookServer(ThreadingMixIn, HTTPServer):
+    """An HTTP server handling each request in its own thread."""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple, entries: dict, scheduler: Scheduler):
+        """Initialize server with positions of configured repositories keyed by repository key."""
+        super().__init__(address, _WebhookHandler)
+        self.entries = entries
+        self.scheduler = scheduler
+
+
+def _raise_interrupt(*_) -> None:
+    """Turn termination signal into interrupt so that the server shuts down gracefully."""
+    raise KeyboardInterrupt
+
+
+def _report_result(job, result: typing.Optional[dict], error: typing.Optional[str]) -> None:
+    """Report failures of managers run."""
+    if not error and (result['error'] or any(manager_result['error'] for manager_result in result['managers'])):
+        _LOGGER.warning("Processing of repository %r finished with errors", result['slug'])
+
+
+def serve(entries: typing.List[tuple], run_entry: typing.Callable, get_priority: typing.Callable,
+          host: str, port: int, workers: int) -> None:
+    """Serve webhooks for the given configuration entries until interrupted.
+
+    Jobs scheduled but not started yet are persisted (if configured) and resumed on the next start.
+    """
+    indexed = {}
+    for entry_index, entry in enumerate(entries):
+        _, slug, service_type, service_url, *_ = entry
+        indexed[get_repository_key(service_type, service_url, slug)] = entry_index
+
+    if not _SECRET:
+        _LOGGER.warning("No webhook secret configured, webhooks are not authenticated")
+
+    scheduler = Scheduler(entries, run_entry, get_priority, jobs=workers, on_finished=_report_result)
+    scheduler.resume()
+    stop = threading.Event()
+    scheduler_thread = threading.Thread(target=scheduler.serve, args=(stop,), daemon=True)
+    scheduler_thread.start()
+
+    server = _WebhookServer((host, port), indexed, scheduler)
+    signal.signal(signal.SIGTERM, _raise_interrupt)
+    _LOGGER.info("Serving webhooks for %d repositories on %s:%d using %d workers", len(indexed), host, port, workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        _LOGGER.info("Shutting down, waiting for running jobs to finish (%d jobs waiting)", scheduler.pending_count())
+    finally:
+        server.server_close()
+        stop.set()
+        scheduler_thread.join()
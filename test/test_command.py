@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the command runner."""
+
+import time
+
+from kebechet.command import run_command
+
+
+def test_run_command():
+    result = run_command('echo out; echo err >&2; exit 3')
+    assert result.out == 'out\n'
+    assert result.err == 'err\n'
+    assert result.return_code == 3
+    assert result.timed_out is False
+
+
+def test_run_command_env():
+    assert run_command('echo $KEBECHET_TEST_VARIABLE', env={'KEBECHET_TEST_VARIABLE': 'value'}).out == 'value\n'
+
+
+def test_run_command_timeout():
+    start = time.monotonic()
+    # The child process spawned by the command has to be killed as well, otherwise output pipes stay open.
+    result = run_command('sleep 30 & sleep 30', timeout=0.5)
+
+    assert time.monotonic() - start < 10
+    assert result.timed_out is True
+    assert result.return_code != 0
+    assert 'exceeding timeout' in result.err
+
+
+def test_run_command_output_limit():
+    result = run_command('seq 1 100000', output_limit=100)
+    assert result.out.startswith('[... ')
+    assert result.out.endswith('100000\n')
+    assert len(result.out.split('\n', maxsplit=1)[1]) == 100
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the local package index, run without touching the network."""
+
+import json
+import os
+
+import pytest
+
+from kebechet import local_index
+
+
+@pytest.fixture
+def index_dir(tmpdir, monkeypatch):
+    """Configure local index in a temporary directory."""
+    monkeypatch.setattr(local_index, '_INDEX_DIR', str(tmpdir))
+    monkeypatch.setattr(local_index, '_REFRESHED', set())
+    return tmpdir
+
+
+# The latest releases of packages and their dependencies, as if served by PyPI.
+_LATEST = {
+    'foo-bar': ('1.1', ['qux']),
+    'qux': ('3.0', []),
+}
+
+
+def _write_wheel(name: str, version: str) -> None:
+    """Create a wheel of the given package release in the index."""
+    file_name = f'{name.replace("-", "_")}-{version}-py3-none-any.whl'
+    with open(os.path.join(local_index._get_packages_dir(), file_name), 'wb') as wheel:
+        wheel.write(b'wheel')
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+    """Record requested downloads, wheels are created in the index instead of downloading them."""
+    result = []
+
+    def download(requirements, no_deps):
+        result.append((list(requirements), no_deps))
+        pending = list(requirements)
+        while pending:
+            requirement = pending.pop()
+            if '==' in requirement:
+                _write_wheel(*requirement.split('=='))
+            elif requirement in _LATEST:
+                version, dependencies = _LATEST[requirement]
+                _write_wheel(requirement, version)
+                if not no_deps:
+                    pending.extend(dependencies)
+
+    monkeypatch.setattr(local_index, '_download', download)
+    return result
+
+
+def _write_lock(tmpdir, packages: dict) -> str:
+    """Write a lock file stating the given packages and their versions."""
+    path = tmpdir.join('Pipfile.lock')
+    path.write(json.dumps({
+        '_meta': {},
+        'default': {name: {'version': f'=={version}'} for name, version in packages.items()},
+        'develop': {},
+    }))
+    return str(path)
+
+
+def test_populate_from_lock(index_dir, downloads, tmpdir_factory):
+    lock_path = _write_lock(tmpdir_factory.mktemp('project'), {'Foo.Bar': '1.0', 'baz': '2.0'})
+
+    local_index.populate_from_lock(lock_path)
+
+    assert downloads == [(['baz==2.0', 'foo-bar==1.0'], True), (['baz', 'foo-bar'], False)]
+    assert local_index.find_wheel('foo_bar', '1.0').endswith('foo_bar-1.0-py3-none-any.whl')
+    assert local_index.find_wheel('foo-bar', '2.0') is None
+
+    project_page = index_dir.join('simple', 'foo-bar', 'index.html').read()
+    assert 'foo_bar-1.0-py3-none-any.whl#sha256=' in project_page
+    assert 'href="foo-bar/"' in index_dir.join('simple', 'index.html').read()
+
+
+def test_populate_incrementally(index_dir, downloads, tmpdir_factory):
+    project_dir = tmpdir_factory.mktemp('project')
+    local_index.populate_from_lock(_write_lock(project_dir, {'foo': '1.0'}))
+    local_index.populate_from_lock(_write_lock(project_dir, {'foo': '1.0', 'bar': '2.0'}))
+
+    # Pinned packages already present and packages already refreshed in this run are not downloaded again.
+    assert downloads[2:] == [(['bar==2.0'], True), (['bar'], False)]
+
+
+def test_populate_latest_with_new_dependency(index_dir, downloads, tmpdir_factory):
+    lock_path = _write_lock(tmpdir_factory.mktemp('project'), {'foo-bar': '1.0'})
+
+    local_index.populate_from_lock(lock_path)
+
+    # The latest release of foo-bar requires qux which is not locked yet, it has to be served by the index.
+    assert local_index.find_wheel('foo-bar', '1.1') is not None
+    assert local_index.find_wheel('qux', '3.0') is not None
+    assert 'href="qux/"' in index_dir.join('simple', 'index.html').read()
+
+
+def test_offline(index_dir, downloads, monkeypatch, tmpdir_factory):
+    monkeypatch.setattr(local_index, '_OFFLINE', True)
+
+    local_index.populate_from_lock(_write_lock(tmpdir_factory.mktemp('project'), {'foo': '1.0'}))
+
+    assert downloads == []
+    assert local_index.get_environment()['PIPENV_PYPI_MIRROR'].startswith('file://')
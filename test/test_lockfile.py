@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the lock file model and the lock file diff engine."""
+
+import json
+
+import pytest
+
+from kebechet.lockfile import PipfileLock
+from kebechet.lockfile import diff_locks
+from kebechet.lockfile import parse_requirements_txt
+
+
+def _lock(default: dict, develop: dict = None) -> PipfileLock:
+    """Construct a lock file model stating the given packages and their versions."""
+    content = {
+        '_meta': {'requires': {'python_version': '3.6'}},
+        'default': {name: {'version': f'=={version}'} for name, version in default.items()},
+        'develop': {name: {'version': f'=={version}'} for name, version in (develop or {}).items()},
+    }
+    return PipfileLock.from_bytes(json.dumps(content).encode())
+
+
+def test_parse_lock():
+    lock = _lock({'Requests': '2.21.0'}, {'pytest': '4.0.0'})
+    assert lock.get_package('requests').version == '2.21.0'
+    assert lock.get_package('pytest', dev=True).dev is True
+    assert set(lock.packages) == {'requests', 'pytest'}
+
+
+def test_parse_lock_cached_by_content():
+    assert _lock({'requests': '2.21.0'}) is _lock({'requests': '2.21.0'})
+    assert _lock({'requests': '2.21.0'}) is not _lock({'requests': '2.20.0'})
+
+
+def test_diff_locks():
+    old = _lock({'requests': '2.20.0', 'urllib3': '1.24.1', 'chardet': '3.0.4'}, {'pytest': '4.0.0'})
+    new = _lock({'requests': '2.21.0', 'urllib3': '1.23', 'idna': '2.8'}, {'pytest': '4.0.0'})
+
+    diff = diff_locks(old.packages, new.packages)
+
+    assert set(diff.upgraded) == {'requests'}
+    assert (diff.upgraded['requests'].old_version, diff.upgraded['requests'].new_version) == ('2.20.0', '2.21.0')
+    assert set(diff.downgraded) == {'urllib3'}
+    assert set(diff.added) == {'idna'}
+    assert diff.added['idna'].old_version is None
+    assert set(diff.removed) == {'chardet'}
+    assert [change.name for change in diff.iter_changes()] == ['chardet', 'idna', 'requests', 'urllib3']
+
+
+def test_diff_locks_versions_compared_semantically():
+    diff = diff_locks(_lock({'foo': '1.9'}).packages, _lock({'foo': '1.10'}).packages)
+    assert set(diff.upgraded) == {'foo'}
+    assert not diff.downgraded
+
+
+def test_diff_locks_no_change():
+    lock = _lock({'requests': '2.21.0'})
+    assert not diff_locks(lock.packages, lock.packages)
+
+
+def test_diff_large_locks():
+    # A lock of a big application, versions of every third package change between the two locks.
+    old_default = {f'package-{idx}': f'1.{idx}.0' for idx in range(1500)}
+    new_default = {name: f'1.{idx}.1' if idx % 3 == 0 else version
+                   for idx, (name, version) in enumerate(old_default.items())}
+    del new_default['package-1']
+    new_default['package-new'] = '0.1.0'
+    develop = {f'dev-package-{idx}': f'2.{idx}' for idx in range(500)}
+
+    old = _lock(old_default, develop)
+    new = _lock(new_default, develop)
+
+    assert len(new.packages) == 2000
+    assert new.get_package('Package-3').version == '1.3.1'
+    assert new.get_package('dev-package-499', dev=True).version == '2.499'
+
+    diff = diff_locks(old.packages, new.packages)
+
+    assert len(diff.upgraded) == 500
+    assert not diff.downgraded
+    assert set(diff.removed) == {'package-1'}
+    assert set(diff.added) == {'package-new'}
+    assert len(list(diff.iter_changes())) == 502
+    assert not diff_locks(new.packages, _lock(new_default, develop).packages)
+
+
+def test_parse_requirements_txt(tmpdir):
+    requirements = tmpdir.join('requirements.txt')
+    requirements.write(
+        'Requests==2.21.0 \\\n'
+        '    --hash=sha256:aaa \\\n'
+        '    --hash=sha256:bbb\n'
+        'idna==2.8; python_version >= "3"\n'
+    )
+
+    packages = parse_requirements_txt(str(requirements))
+
+    assert packages['requests'].version == '2.21.0'
+    assert packages['requests'].hashes == ('sha256:aaa', 'sha256:bbb')
+    assert packages['idna'].markers == 'python_version >= "3"'
+
+
+@pytest.mark.parametrize('requirement', ['requests>=2.0', 'requests==2.*', 'requests'])
+def test_parse_requirements_txt_not_pinned(tmpdir, requirement):
+    requirements = tmpdir.join('requirements.txt')
+    requirements.write(requirement + '\n')
+
+    with pytest.raises(ValueError):
+        parse_requirements_txt(str(requirements))
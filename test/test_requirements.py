@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# Kebechet
+# Copyright(C) 2018, 2019 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the streaming requirements parser."""
+
+import pytest
+
+from kebechet.requirements import iter_requirements
+from kebechet.requirements import parse_requirement
+from kebechet.requirements import parse_requirements
+
+
+def test_parse_specifier():
+    requirement = parse_requirement('requests >= 2.0, < 3.0')
+    assert requirement.name == 'requests'
+    assert requirement.specifier == '>=2.0,<3.0'
+    assert requirement.pinned_version is None
+
+
+def test_parse_extras_and_markers():
+    requirement = parse_requirement('requests[security, socks]==2.21.0; python_version < "3.8"')
+    assert requirement.extras == ('security', 'socks')
+    assert requirement.pinned_version == '2.21.0'
+    assert requirement.markers == 'python_version < "3.8"'
+    assert str(requirement) == 'requests[security,socks]==2.21.0; python_version < "3.8"'
+
+
+def test_parse_hashes():
+    requirement = parse_requirement('requests==2.21.0 --hash=sha256:aaa --hash sha256:bbb')
+    assert requirement.hashes == ('sha256:aaa', 'sha256:bbb')
+    assert requirement.pinned_version == '2.21.0'
+
+
+@pytest.mark.parametrize('line,pinned_version', [
+    ('foo==1.0', '1.0'),
+    ('foo===1.0', '1.0'),
+    ('foo==1.0.*', None),
+    ('foo~=1.0', None),
+    ('foo==1.0,!=1.1', None),
+    ('foo', None),
+])
+def test_pinned_version(line, pinned_version):
+    assert parse_requirement(line).pinned_version == pinned_version
+
+
+def test_parse_editable():
+    requirement = parse_requirement('-e git+https://github.com/thoth-station/kebechet.git#egg=kebechet')
+    assert requirement.editable is True
+    assert requirement.name == 'kebechet'
+    assert requirement.url == 'git+https://github.com/thoth-station/kebechet.git#egg=kebechet'
+    assert requirement.pinned_version is None
+
+
+def test_parse_url():
+    requirement = parse_requirement('kebechet @ https://example.com/kebechet-1.0.tar.gz')
+    assert requirement.name == 'kebechet'
+    assert requirement.url == 'https://example.com/kebechet-1.0.tar.gz'
+
+
+def test_parse_invalid():
+    with pytest.raises(ValueError):
+        parse_requirement('!invalid')
+
+
+def test_parse_requirements_continuation_and_comments():
+    requirements = list(parse_requirements(
+        '# a comment\n'
+        '\n'
+        'requests==2.21.0 \\\n'
+        '    --hash=sha256:aaa  # inline comment\n'
+        '--index-url https://pypi.org/simple\n'
+        'idna\n'
+    ))
+
+    assert [requirement.name for requirement in requirements] == ['requests', 'idna']
+    assert requirements[0].hashes == ('sha256:aaa',)
+    assert requirements[0].line_number == 3
+    assert requirements[1].line_number == 6
+
+
+def test_iter_requirements_includes(tmpdir):
+    tmpdir.join('base.txt').write('requests\n-r requirements.txt\n')
+    tmpdir.join('requirements.txt').write('-r base.txt\nidna\n')
+
+    requirements = list(iter_requirements(str(tmpdir.join('requirements.txt'))))
+
+    # The include cycle is followed only once.
+    assert [requirement.name for requirement in requirements] == ['requests', 'idna']
+    assert requirements[0].source.endswith('base.txt')
+
+
+def test_iter_requirements_large(tmpdir):
+    # A generated requirements file of a big application, requirements are split across included files.
+    included = []
+    for file_idx in range(5):
+        file_name = f'requirements-{file_idx}.txt'
+        lines = []
+        for idx in range(file_idx * 300, (file_idx + 1) * 300):
+            if idx % 2:
+                lines.append(
+                    f'package-{idx}==1.{idx} \\\n    --hash=sha256:{idx:064x} \\\n    --hash=sha256:{idx + 1:064x}\n'
+                )
+            else:
+                lines.append(f'# package number {idx}\npackage-{idx}[extra]>=1.0,<2.0; python_version >= "3"\n')
+        tmpdir.join(file_name).write(''.join(lines))
+        included.append(f'--requirement={file_name}\n' if file_idx % 2 else f'-r {file_name}\n')
+    tmpdir.join('requirements.txt').write('--index-url https://pypi.org/simple\n' + ''.join(included))
+
+    requirements = list(iter_requirements(str(tmpdir.join('requirements.txt'))))
+
+    assert [requirement.name for requirement in requirements] == [f'package-{idx}' for idx in range(1500)]
+    assert requirements[1].hashes == (f'sha256:{1:064x}', f'sha256:{2:064x}')
+    assert requirements[1].pinned_version == '1.1'
+    assert requirements[1].line_number == 3
+    assert requirements[1498].extras == ('extra',)
+    assert requirements[1498].specifier == '>=1.0,<2.0'
+    assert requirements[1498].markers == 'python_version >= "3"'
+    assert requirements[1499].source.endswith('requirements-4.txt')
+    assert sum(1 for requirement in requirements if requirement.hashes) == 750